@@ -0,0 +1,29 @@
+import { createHmac } from 'crypto';
+
+// Token de sesión para el envío directo al equipo de impresión por la red local.
+// El secreto compartido con el servicio (GST3D_SECRETO_ENVIO_LAN) solo existe en el servidor:
+// el navegador recibe un token firmado que vence en pocos minutos.
+const IMPRESION_LAN_URL = process.env.IMPRESION_LAN_URL;
+const IMPRESION_LAN_SECRETO = process.env.IMPRESION_LAN_SECRETO;
+const DURACION_TOKEN_SEGUNDOS = 10 * 60;
+
+export const dynamic = 'force-dynamic';
+
+export async function GET(request: Request) {
+  if (!IMPRESION_LAN_URL || !IMPRESION_LAN_SECRETO) {
+    return Response.json({ error: 'Envío por red local no configurado' }, { status: 404 });
+  }
+  
+  // Solo para páginas del propio dashboard (otra página no puede pedir un token en nombre del usuario)
+  const sitio = request.headers.get('sec-fetch-site');
+  if (sitio && sitio !== 'same-origin') {
+    return Response.json({ error: 'Origen no permitido' }, { status: 403 });
+  }
+  
+  const vence = Math.floor(Date.now() / 1000) + DURACION_TOKEN_SEGUNDOS;
+  const firma = createHmac('sha256', IMPRESION_LAN_SECRETO).update(`impresion-lan:${vence}`).digest('hex');
+  return Response.json(
+    { url: IMPRESION_LAN_URL, token: `${vence}.${firma}`, vence },
+    { headers: { 'Cache-Control': 'no-store' } }
+  );
+}
@@ -4,6 +4,58 @@ import { requireSupabase, SupabaseNotConfiguredError, SupabaseConnectionError }
 
 const MAX_RECORDS = 1000; // Máximo de registros a mantener
 
+// Envío directo al equipo de impresión por la red local (opcional).
+// Si lo acepta, imprime enseguida y escribe él mismo la fila en Supabase con el mismo id.
+// La URL y un token de sesión corto los entrega el servidor del dashboard (/api/impresion-lan).
+const TIMEOUT_IMPRESION_LAN_MS = 1500;
+const MARGEN_RENOVACION_TOKEN_SEGUNDOS = 60;
+
+type SesionLan = { url: string; token: string; vence: number };
+let sesionLan: SesionLan | null = null;
+let envioLanDisponible = true;
+
+async function obtenerSesionLan(): Promise<SesionLan | null> {
+  if (sesionLan && sesionLan.vence - Date.now() / 1000 > MARGEN_RENOVACION_TOKEN_SEGUNDOS) {
+    return sesionLan;
+  }
+  
+  const respuesta = await fetch('/api/impresion-lan', {
+    cache: 'no-store',
+    signal: AbortSignal.timeout(TIMEOUT_IMPRESION_LAN_MS),
+  });
+  if (respuesta.status === 404) {
+    envioLanDisponible = false; // No configurado: no se vuelve a intentar en esta sesión
+    return null;
+  }
+  if (!respuesta.ok) return null;
+  sesionLan = await respuesta.json();
+  return sesionLan;
+}
+
+async function enviarImpresionPorLan(fila: Record<string, unknown>): Promise<boolean> {
+  if (!envioLanDisponible) return false;
+  
+  try {
+    const sesion = await obtenerSesionLan();
+    if (!sesion) return false;
+    
+    const respuesta = await fetch(`${sesion.url.replace(/\/$/, '')}/impresiones`, {
+      method: 'POST',
+      headers: {
+        'Content-Type': 'application/json',
+        Authorization: `Bearer ${sesion.token}`,
+      },
+      body: JSON.stringify(fila),
+      signal: AbortSignal.timeout(TIMEOUT_IMPRESION_LAN_MS),
+    });
+    if (respuesta.status === 401) sesionLan = null; // Token vencido o secreto rotado: se pide otro
+    return respuesta.ok;
+  } catch (error) {
+    console.warn('Equipo de impresión no disponible en la red local, se envía por Supabase:', error);
+    return false;
+  }
+}
+
 export async function obtenerImpresiones(): Promise<ImpresionEtiqueta[]> {
   requireSupabase();
   
@@ -57,24 +109,31 @@ export async function guardarImpresion(impresion: ImpresionEtiqueta): Promise<vo
   requireSupabase();
   
   try {
-    const { error } = await supabase
-      .from('impresiones')
-      .insert({
-        id: impresion.id,
-        maquina_id: impresion.maquinaId,
-        tipo_material: impresion.tipoMaterial,
-        etiqueta_chica: impresion.etiquetaChica,
-        etiqueta_grande: impresion.etiquetaGrande,
-        operador: impresion.operador,
-        fecha: impresion.fecha,
-        timestamp: impresion.timestamp,
-        cantidad_chicas: impresion.cantidadChicas || 8,
-        cantidad_grandes: impresion.cantidadGrandes || 8,
-        estado: 'pendiente', // Estado inicial: pendiente de imprimir
-      });
+    const fila = {
+      id: impresion.id,
+      maquina_id: impresion.maquinaId,
+      tipo_material: impresion.tipoMaterial,
+      etiqueta_chica: impresion.etiquetaChica,
+      etiqueta_grande: impresion.etiquetaGrande,
+      operador: impresion.operador,
+      fecha: impresion.fecha,
+      timestamp: impresion.timestamp,
+      cantidad_chicas: impresion.cantidadChicas || 8,
+      cantidad_grandes: impresion.cantidadGrandes || 8,
+    };
     
-    if (error) {
-      throw new SupabaseConnectionError(`Error al guardar impresión en Supabase: ${error.message}`);
+    if (!(await enviarImpresionPorLan(fila))) {
+      const { error } = await supabase
+        .from('impresiones')
+        .insert({
+          ...fila,
+          estado: 'pendiente', // Estado inicial: pendiente de imprimir
+        });
+      
+      // 23505: la fila ya existe porque la escribió el equipo de impresión con el mismo id
+      if (error && error.code !== '23505') {
+        throw new SupabaseConnectionError(`Error al guardar impresión en Supabase: ${error.message}`);
+      }
     }
     
     // Limpiar registros antiguos si hay más de MAX_RECORDS
@@ -0,0 +1,243 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Mantenimiento de la tabla `impresiones` - GST3D
+Mueve las impresiones terminadas ('impresa' o 'error') más viejas que N días a
+archivos comprimidos locales y/o a la tabla `impresiones_historico`, y las borra
+de `impresiones` para que la cola de pendientes siga siendo chica.
+
+Trabaja por bloques ordenados por (timestamp, id), con memoria acotada a un bloque,
+y se puede interrumpir: la próxima ejecución retoma desde el último bloque confirmado.
+
+Uso:
+    python3 archivar_impresiones.py --dias 30
+    python3 archivar_impresiones.py --dias 90 --destino tabla --lote 1000
+"""
+
+import os
+import sys
+import json
+import gzip
+import argparse
+from datetime import datetime, timedelta
+from typing import Optional, Dict, List
+
+from imprimir_etiquetas_servicio import (
+    conectar_supabase,
+    guardar_json_atomico,
+    log_info,
+    log_error,
+    log_success,
+    log_warning,
+)
+
+# ============================================================================
+# CONFIGURACIÓN
+# ============================================================================
+
+DIRECTORIO_ARCHIVO = "/home/gst3d/archivo_impresiones"
+ARCHIVO_ESTADO_ARCHIVADO = "estado_archivado.json"  # Dentro de DIRECTORIO_ARCHIVO
+ARCHIVO_CORTE_ARCHIVADO = "corte_archivado.json"  # Dentro de DIRECTORIO_ARCHIVO: hasta dónde ya se borró de `impresiones`
+DIAS_A_CONSERVAR = 30
+TAMANO_LOTE = 500
+ESTADOS_TERMINADOS = ['impresa', 'error']
+
+# ============================================================================
+# ARCHIVADO POR BLOQUES
+# ============================================================================
+
+def cargar_estado(ruta_estado: str) -> Optional[Dict]:
+    """Carga el estado de una ejecución anterior que no terminó."""
+    if not os.path.exists(ruta_estado):
+        return None
+    try:
+        with open(ruta_estado, "r", encoding='utf-8') as f:
+            return json.load(f)
+    except Exception as e:
+        log_error("Estado de archivado ilegible, se empieza de cero", e)
+        return None
+
+def leer_corte_archivado(directorio: str = DIRECTORIO_ARCHIVO) -> Optional[int]:
+    """Returns: Timestamp (ms) antes del cual las impresiones terminadas ya se archivaron y borraron, o None."""
+    try:
+        with open(os.path.join(directorio, ARCHIVO_CORTE_ARCHIVADO), "r", encoding='utf-8') as f:
+            return int(json.load(f)["corte_ms"])
+    except FileNotFoundError:
+        return None
+    except Exception as e:
+        log_error("Corte de archivado ilegible", e)
+        return None
+
+def obtener_bloque(cliente, corte_ms: int, cursor: Optional[List], tamano: int) -> List[Dict]:
+    """Obtiene el siguiente bloque de impresiones terminadas anteriores al corte."""
+    consulta = cliente.table('impresiones')\
+        .select('*')\
+        .in_('estado', ESTADOS_TERMINADOS)\
+        .lt('timestamp', corte_ms)
+
+    if cursor is not None:
+        timestamp, impresion_id = cursor
+        consulta = consulta.or_(
+            f'timestamp.gt.{timestamp},and(timestamp.eq.{timestamp},id.gt."{impresion_id}")'
+        )
+
+    response = consulta\
+        .order('timestamp', desc=False)\
+        .order('id', desc=False)\
+        .limit(tamano)\
+        .execute()
+    return response.data or []
+
+def escribir_en_archivo(ruta_archivo: str, filas: List[Dict]) -> int:
+    """
+    Agrega el bloque al archivo gzip como JSON por línea.
+    Cada bloque es un miembro gzip nuevo, así un corte a mitad de ejecución no corrompe lo anterior.
+    Returns: Tamaño del archivo después de escribir el bloque
+    """
+    with gzip.open(ruta_archivo, "at", encoding='utf-8') as f:
+        for fila in filas:
+            f.write(json.dumps(fila, ensure_ascii=False))
+            f.write("\n")
+    return os.path.getsize(ruta_archivo)
+
+def descartar_bloque_sin_confirmar(ruta_archivo: str, bytes_confirmados: Optional[int]):
+    """
+    Recorta el archivo al último bloque confirmado: lo escrito después (un bloque que se cortó antes
+    de guardarse en el estado) se vuelve a escribir al retomar, así no queda duplicado.
+    """
+    if bytes_confirmados is None or not os.path.exists(ruta_archivo):
+        return
+    tamano = os.path.getsize(ruta_archivo)
+    if tamano > bytes_confirmados:
+        log_warning(f"Descartando {tamano - bytes_confirmados} bytes de un bloque sin confirmar en {ruta_archivo}")
+        os.truncate(ruta_archivo, bytes_confirmados)
+
+def borrar_bloque(cliente, ids: List[str]):
+    """Borra de `impresiones` un bloque ya guardado en el destino."""
+    cliente.table('impresiones').delete().in_('id', ids).execute()
+
+def archivar(dias: int = DIAS_A_CONSERVAR, destino: str = "archivo", tamano: int = TAMANO_LOTE,
+             directorio: str = DIRECTORIO_ARCHIVO, borrar: bool = True) -> int:
+    """
+    Archiva y borra las impresiones terminadas más viejas que `dias`.
+    Returns: Cantidad de impresiones archivadas
+    """
+    cliente = conectar_supabase()
+    if cliente is None:
+        log_error("No se pudo conectar a Supabase")
+        return 0
+
+    os.makedirs(directorio, exist_ok=True)
+    ruta_estado = os.path.join(directorio, ARCHIVO_ESTADO_ARCHIVADO)
+
+    estado = cargar_estado(ruta_estado)
+    if estado:
+        # Retomar con otro destino u otro --sin-borrar podría borrar filas que nunca llegaron al destino
+        anteriores = (estado.get("destino", destino), estado.get("borrar", borrar))
+        if anteriores != (destino, borrar):
+            log_error(f"Hay un archivado interrumpido con destino '{anteriores[0]}' y borrar={anteriores[1]}; "
+                      f"retomarlo con las mismas opciones (o borrar {ruta_estado} para empezar de cero)")
+            return 0
+        log_info(f"Retomando archivado interrumpido (corte {estado['corte_ms']}, cursor {estado['cursor']})")
+    else:
+        corte = datetime.now() - timedelta(days=dias)
+        estado = {
+            "corte_ms": int(corte.timestamp() * 1000),
+            "cursor": None,
+            "archivo": f"impresiones_{datetime.now().strftime('%Y%m%d_%H%M%S')}.jsonl.gz",
+            "bytes_archivo": 0,
+            "bloque_guardado": None,  # Bloque ya escrito en el destino pero todavía no borrado
+            "destino": destino,
+            "borrar": borrar,
+            "total": 0,
+        }
+        log_info(f"Archivando impresiones terminadas anteriores a {corte.strftime('%Y-%m-%d %H:%M')}")
+
+    ruta_archivo = os.path.join(directorio, estado["archivo"])
+    descartar_bloque_sin_confirmar(ruta_archivo, estado.get("bytes_archivo"))
+
+    bloque = estado.get("bloque_guardado")
+    if bloque:
+        # Se cortó entre guardar el bloque y borrarlo: se completa sin volver a escribirlo
+        if borrar:
+            borrar_bloque(cliente, bloque["ids"])
+        estado["cursor"] = bloque["ultima"]
+        estado["total"] += len(bloque["ids"])
+        estado["bloque_guardado"] = None
+        guardar_json_atomico(ruta_estado, estado)
+
+    while True:
+        filas = obtener_bloque(cliente, estado["corte_ms"], estado["cursor"], tamano)
+        if not filas:
+            break
+
+        if destino in ("archivo", "ambos"):
+            estado["bytes_archivo"] = escribir_en_archivo(ruta_archivo, filas)
+        if destino in ("tabla", "ambos"):
+            cliente.table('impresiones_historico').upsert(
+                [dict(fila, archivada_at=datetime.now().astimezone().isoformat()) for fila in filas],
+                on_conflict='id'
+            ).execute()
+        # Confirmar la escritura antes de borrar: si se corta acá, al retomar no se escribe de nuevo
+        ultima = filas[-1]
+        ids = [fila['id'] for fila in filas]
+        estado["bloque_guardado"] = {"ids": ids, "ultima": [ultima['timestamp'], ultima['id']]}
+        guardar_json_atomico(ruta_estado, estado)
+
+        if borrar:
+            borrar_bloque(cliente, ids)
+
+        # Confirmar el bloque: recién ahora avanza el cursor
+        estado["cursor"] = estado["bloque_guardado"]["ultima"]
+        estado["bloque_guardado"] = None
+        estado["total"] += len(filas)
+        guardar_json_atomico(ruta_estado, estado)
+        log_info(f"  {estado['total']} impresiones archivadas...")
+
+        if len(filas) < tamano:
+            break
+
+    if borrar:
+        # Lo usa reconciliar_impresiones.py para no reportar como faltantes las filas ya archivadas
+        corte_anterior = leer_corte_archivado(directorio) or 0
+        guardar_json_atomico(os.path.join(directorio, ARCHIVO_CORTE_ARCHIVADO),
+                             {"corte_ms": max(corte_anterior, estado["corte_ms"])})
+    if os.path.exists(ruta_estado):
+        os.remove(ruta_estado)
+    if estado["total"]:
+        log_success(f"Archivado terminado: {estado['total']} impresiones")
+        if destino in ("archivo", "ambos"):
+            log_info(f"Archivo: {ruta_archivo}")
+    else:
+        log_info("No hay impresiones para archivar")
+    return estado["total"]
+
+# ============================================================================
+# LÍNEA DE COMANDOS
+# ============================================================================
+
+def main():
+    parser = argparse.ArgumentParser(description="Archiva impresiones terminadas de Supabase")
+    parser.add_argument("--dias", type=int, default=DIAS_A_CONSERVAR,
+                        help=f"Conservar en `impresiones` los últimos N días (por defecto {DIAS_A_CONSERVAR})")
+    parser.add_argument("--destino", choices=["archivo", "tabla", "ambos"], default="archivo",
+                        help="Dónde guardar lo archivado (por defecto: archivo gzip local)")
+    parser.add_argument("--lote", type=int, default=TAMANO_LOTE,
+                        help=f"Filas por bloque (por defecto {TAMANO_LOTE})")
+    parser.add_argument("--directorio", default=DIRECTORIO_ARCHIVO,
+                        help=f"Carpeta de los archivos comprimidos (por defecto {DIRECTORIO_ARCHIVO})")
+    parser.add_argument("--sin-borrar", action="store_true",
+                        help="Copiar sin borrar de `impresiones` (para probar)")
+    args = parser.parse_args()
+
+    if args.sin_borrar:
+        log_warning("Modo --sin-borrar: las filas se copian pero quedan en `impresiones`")
+
+    try:
+        archivar(args.dias, args.destino, args.lote, args.directorio, borrar=not args.sin_borrar)
+    except KeyboardInterrupt:
+        log_info("Interrumpido: la próxima ejecución retoma desde el último bloque confirmado")
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
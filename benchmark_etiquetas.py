@@ -0,0 +1,273 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Microbenchmarks del camino de impresión de etiquetas - GST3D
+Mide cada etapa propia del servicio por separado y el camino completo por etiqueta,
+contra una carpeta temporal de plantillas y un transporte falso (no imprime nada).
+
+Reporta operaciones por segundo y percentiles de latencia, guarda el resultado en
+JSON y lo compara con una línea base: si alguna etapa empeora más que la tolerancia,
+termina con código 1.
+
+Uso:
+    python3 benchmark_etiquetas.py                          # mide y compara con la línea base
+    python3 benchmark_etiquetas.py --guardar-baseline       # mide y guarda como línea base
+    python3 benchmark_etiquetas.py --etapas renderizar_etiqueta etiqueta_completa
+    python3 benchmark_etiquetas.py --plantillas /home/gst3d/Desktop/ETIQUETAS_PRN
+"""
+
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import platform
+import tempfile
+from datetime import datetime
+from typing import Optional, Dict, List, Callable
+
+import imprimir_etiquetas_servicio as servicio
+
+# ============================================================================
+# CONFIGURACIÓN
+# ============================================================================
+
+ITERACIONES = 2000
+ITERACIONES_CALENTAMIENTO = 100
+RUTA_BASELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "benchmark_etiquetas_baseline.json")
+TOLERANCIA_REGRESION = 0.25  # Se acepta hasta un 25% más lento que la línea base (en p50)
+PERCENTILES = (50, 90, 99)
+
+# Plantilla de prueba con un tamaño parecido a las reales (gráfico + textos)
+PLANTILLA_PRUEBA = (
+    "^XA\n^PW812\n^LL406\n^LH0,0\n"
+    "^FO20,20^GFA,8000,8000,40," + "00FF" * 4000 + "^FS\n"
+    "^FO450,40^A0N,40,40^FDGST3D^FS\n"
+    "^FO450,90^A0N,30,30^FDFilamento 1.75mm^FS\n"
+    "^XZ\n"
+)
+COLORES_PRUEBA = ["BLACK", "WHITE", "RED", "SILK_GOLD"]
+
+# ============================================================================
+# ENTORNO DE PRUEBA
+# ============================================================================
+
+def preparar_entorno(directorio: str, plantillas: Optional[str] = None) -> List[str]:
+    """
+    Redirige los archivos del servicio a `directorio` y deja plantillas de prueba.
+    Returns: Colores disponibles para el benchmark
+    """
+    carpeta_prn = os.path.join(directorio, "prn")
+    os.makedirs(carpeta_prn)
+    if plantillas:
+        for nombre in os.listdir(plantillas):
+            if nombre.endswith(".prn"):
+                shutil.copy(os.path.join(plantillas, nombre), carpeta_prn)
+        colores = sorted(n[:-4] for n in os.listdir(carpeta_prn) if not n[:-4].endswith("_GRANDE"))[:len(COLORES_PRUEBA)]
+    else:
+        colores = COLORES_PRUEBA
+        for color in colores:
+            for nombre in (color, f"{color}_GRANDE"):
+                with open(os.path.join(carpeta_prn, f"{nombre}.prn"), "w", encoding='utf-8') as f:
+                    f.write(PLANTILLA_PRUEBA)
+
+    servicio.RUTA_PRN = carpeta_prn
+    servicio.ARCHIVO_CONTADOR_ID = os.path.join(directorio, "contador_id.txt")
+    servicio.ARCHIVO_ESTADO_HORARIO = os.path.join(directorio, "estado_horario.txt")
+    servicio.ARCHIVO_LOG_LOCAL = os.path.join(directorio, "etiquetas_log.json")
+    servicio.ARCHIVO_NOTIFICACIONES = os.path.join(directorio, "notificaciones_prn.log")
+    # Los singletons se crearon al importar con las rutas de producción: también se redirigen,
+    # así una prueba en el host real no sube el log real ni mueve su cursor ni toma el socket del kiosco
+    servicio.subidor_registros.ruta_log = servicio.ARCHIVO_LOG_LOCAL
+    servicio.subidor_registros.ruta_cursor = os.path.join(directorio, "etiquetas_log.cursor")
+    servicio.acumulador_stock.ruta = os.path.join(directorio, "deltas_stock_pendientes.json")
+    servicio.exportador_trazas.ruta = os.path.join(directorio, "trazas_impresion.jsonl")
+    servicio.perfilador.directorio = os.path.join(directorio, "perfiles")
+    servicio.servidor_envio_local.ruta = os.path.join(directorio, "impresion.sock")
+    servicio.escritor_impresiones_directas.ruta = os.path.join(directorio, "impresiones_directas_pendientes.json")
+    servicio.escritor_impresiones_directas.ruta_rechazadas = os.path.join(directorio, "impresiones_directas_rechazadas.jsonl")
+    servicio.ENVIO_LAN_ACTIVO = False
+    servicio.LIMITE_ETIQUETAS_POR_HORA = 10 ** 9
+    servicio.TRAZAS_ACTIVAS = False
+    servicio.ACTUALIZAR_STOCK_DESDE_SERVICIO = False
+    servicio.enviar_a_impresora = transporte_falso
+    # El benchmark no debe ensuciar la salida con un log por etiqueta
+    servicio.log_info = servicio.log_success = lambda *args, **kwargs: None
+    return colores
+
+def transporte_falso(nombre_impresora: str, datos: bytes, reintentos: int = 3) -> bool:
+    """Acepta la etiqueta sin enviarla a ningún lado."""
+    return len(datos) > 0
+
+# ============================================================================
+# MEDICIÓN
+# ============================================================================
+
+def percentil(valores_ordenados: List[int], p: float) -> int:
+    indice = min(len(valores_ordenados) - 1, int(round(p / 100 * (len(valores_ordenados) - 1))))
+    return valores_ordenados[indice]
+
+def medir(funcion: Callable[[int], object], iteraciones: int, calentamiento: int,
+          operaciones_por_llamada: int = 1) -> Dict:
+    """
+    Ejecuta `funcion(i)` y mide cada llamada con perf_counter_ns.
+    Returns: ops/s y percentiles de latencia por operación (en microsegundos)
+    """
+    for i in range(calentamiento):
+        funcion(i)
+
+    tiempos = []
+    inicio_total = time.perf_counter_ns()
+    for i in range(iteraciones):
+        inicio = time.perf_counter_ns()
+        funcion(i)
+        tiempos.append((time.perf_counter_ns() - inicio) / operaciones_por_llamada)
+    total_ns = time.perf_counter_ns() - inicio_total
+
+    tiempos.sort()
+    resultado = {
+        "iteraciones": iteraciones,
+        "ops_por_segundo": round(iteraciones * operaciones_por_llamada / (total_ns / 1e9), 1),
+        "media_us": round(sum(tiempos) / len(tiempos) / 1000, 3),
+        "max_us": round(tiempos[-1] / 1000, 3),
+    }
+    for p in PERCENTILES:
+        resultado[f"p{p}_us"] = round(percentil(tiempos, p) / 1000, 3)
+    return resultado
+
+def definir_etapas(colores: List[str]) -> Dict[str, tuple]:
+    """Etapas a medir: nombre -> (función(i), operaciones por llamada, divisor de iteraciones)."""
+    def color(i: int) -> str:
+        return colores[i % len(colores)]
+
+    ruta_plantilla = os.path.join(servicio.RUTA_PRN, f"{colores[0]}.prn")
+    zpl = servicio.cargar_plantilla(ruta_plantilla)
+    registro = servicio.renderizar_etiqueta(zpl, "PLA", colores[0], False, 1, 1, "Benchmark")["registro"]
+
+    def plantilla_sin_cache(i: int):
+        servicio._cache_plantillas.clear()
+        return servicio.cargar_plantilla(ruta_plantilla)
+
+    return {
+        "obtener_nombre_archivo_prn": (lambda i: servicio.obtener_nombre_archivo_prn(color(i), i % 2 == 1), 1, 1),
+        "cargar_plantilla": (lambda i: servicio.cargar_plantilla(ruta_plantilla), 1, 1),
+        "cargar_plantilla_sin_cache": (plantilla_sin_cache, 1, 1),
+        "leer_contador_id": (lambda i: servicio.leer_contador_id(), 1, 1),
+        "guardar_contador_id": (lambda i: servicio.guardar_contador_id(i + 1), 1, 1),
+        "guardar_estado_horario": (lambda i: servicio.guardar_estado_horario(), 1, 1),
+        "guardar_log_local": (lambda i: servicio.guardar_log_local(registro), 1, 1),
+        "renderizar_etiqueta": (
+            lambda i: servicio.renderizar_etiqueta(zpl, "PLA", color(i), False, 1, 1, "Benchmark"), 1, 1
+        ),
+        "confirmar_etiqueta_impresa": (lambda i: servicio.confirmar_etiqueta_impresa(registro), 1, 1),
+        "etiqueta_completa": (
+            lambda i: servicio.imprimir_etiqueta("PLA", color(i), i % 2 == 1, 1, 1, "Benchmark"), 1, 4
+        ),
+        "lote_10_etiquetas": (
+            lambda i: servicio.imprimir_etiqueta("PLA", color(i), False, 10, 1, "Benchmark"), 10, 20
+        ),
+    }
+
+# ============================================================================
+# LÍNEA BASE
+# ============================================================================
+
+def comparar_con_baseline(resultados: Dict, baseline: Dict, tolerancia: float) -> List[str]:
+    """
+    Compara el p50 de cada etapa con la línea base.
+    Returns: Descripción de las regresiones encontradas
+    """
+    regresiones = []
+    for etapa, actual in resultados.items():
+        anterior = baseline.get("resultados", {}).get(etapa)
+        if not anterior:
+            continue
+        limite = anterior["p50_us"] * (1 + tolerancia)
+        variacion = (actual["p50_us"] / anterior["p50_us"] - 1) * 100 if anterior["p50_us"] else 0
+        marca = "❌" if actual["p50_us"] > limite else "  "
+        print(f"  {marca} {etapa:<30} p50 {anterior['p50_us']:>10.2f} → {actual['p50_us']:>10.2f} µs ({variacion:+.1f}%)")
+        if actual["p50_us"] > limite:
+            regresiones.append(f"{etapa}: p50 {actual['p50_us']} µs > {limite:.2f} µs")
+    return regresiones
+
+def ejecutar(iteraciones: int = ITERACIONES, etapas: Optional[List[str]] = None,
+             plantillas: Optional[str] = None) -> Dict:
+    """
+    Corre el benchmark en una carpeta temporal.
+    Returns: Documento de resultados (el mismo que se guarda como JSON)
+    """
+    resultados = {}
+    with tempfile.TemporaryDirectory(prefix="benchmark_etiquetas_") as directorio:
+        colores = preparar_entorno(directorio, plantillas)
+        definidas = definir_etapas(colores)
+        desconocidas = set(etapas or []) - set(definidas)
+        if desconocidas:
+            raise ValueError(f"Etapas desconocidas: {', '.join(sorted(desconocidas))}")
+
+        print(f"{'etapa':<32}{'ops/s':>12}{'p50 µs':>12}{'p90 µs':>12}{'p99 µs':>12}")
+        for nombre, (funcion, operaciones, divisor) in definidas.items():
+            if etapas and nombre not in etapas:
+                continue
+            n = max(10, iteraciones // divisor)
+            resultado = medir(funcion, n, max(1, ITERACIONES_CALENTAMIENTO // divisor), operaciones)
+            resultados[nombre] = resultado
+            print(f"{nombre:<32}{resultado['ops_por_segundo']:>12.1f}{resultado['p50_us']:>12.2f}"
+                  f"{resultado['p90_us']:>12.2f}{resultado['p99_us']:>12.2f}")
+
+    return {
+        "fecha": datetime.now().isoformat(timespec='seconds'),
+        "python": platform.python_version(),
+        "plataforma": platform.platform(),
+        "resultados": resultados,
+    }
+
+# ============================================================================
+# LÍNEA DE COMANDOS
+# ============================================================================
+
+def main():
+    parser = argparse.ArgumentParser(description="Microbenchmarks del camino de impresión de etiquetas")
+    parser.add_argument("--iteraciones", type=int, default=ITERACIONES,
+                        help=f"Iteraciones por etapa (por defecto {ITERACIONES})")
+    parser.add_argument("--etapas", nargs="+", default=None, help="Medir solo estas etapas")
+    parser.add_argument("--plantillas", default=None,
+                        help="Carpeta con plantillas .prn reales (por defecto usa una plantilla de prueba)")
+    parser.add_argument("--salida", default=None, help="Guardar los resultados en este JSON")
+    parser.add_argument("--baseline", default=RUTA_BASELINE, help=f"Línea base (por defecto {RUTA_BASELINE})")
+    parser.add_argument("--guardar-baseline", action="store_true", help="Guardar estos resultados como línea base")
+    parser.add_argument("--tolerancia", type=float, default=TOLERANCIA_REGRESION,
+                        help=f"Empeoramiento aceptado del p50 (por defecto {TOLERANCIA_REGRESION})")
+    args = parser.parse_args()
+
+    try:
+        documento = ejecutar(args.iteraciones, args.etapas, args.plantillas)
+    except ValueError as e:
+        parser.error(str(e))
+
+    if args.salida:
+        servicio.guardar_json_atomico(os.path.abspath(args.salida), documento)
+        print(f"\nResultados guardados en {args.salida}")
+
+    if args.guardar_baseline:
+        servicio.guardar_json_atomico(os.path.abspath(args.baseline), documento)
+        print(f"\nLínea base guardada en {args.baseline}")
+        return
+
+    if not os.path.exists(args.baseline):
+        print(f"\nNo hay línea base en {args.baseline}. Ejecutar con --guardar-baseline para crearla")
+        return
+
+    with open(args.baseline, "r", encoding='utf-8') as f:
+        baseline = json.load(f)
+    print(f"\nComparación con la línea base del {baseline.get('fecha')} (tolerancia {args.tolerancia:.0%}):")
+    regresiones = comparar_con_baseline(documento["resultados"], baseline, args.tolerancia)
+    if regresiones:
+        print(f"\n{len(regresiones)} regresión(es):")
+        for regresion in regresiones:
+            print(f"  {regresion}")
+        sys.exit(1)
+    print("\nSin regresiones")
+
+if __name__ == "__main__":
+    main()
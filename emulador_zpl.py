@@ -0,0 +1,319 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Emulador de impresoras Zebra (ZPL) para pruebas de capacidad - GST3D
+Escucha en puertos TCP como una impresora en modo RAW (puerto 9100), así que sirve
+tanto para IMPRESORAS_RAW del servicio como para una cola de CUPS que apunte a
+socket://127.0.0.1:<puerto>. No imprime nada: interpreta los formatos ZPL, cuenta
+etiquetas y copias (con ^PQ y la serialización de ^SN), simula la velocidad de
+impresión y el buffer de recepción, y responde ~HS como una impresora real.
+
+Uso:
+    python3 emulador_zpl.py                                  # ZebraZD420 en 9100 y ZebraZD420_Grande en 9101
+    python3 emulador_zpl.py --impresora Prueba=9200 --velocidad 6 --buffer 32768
+
+Para probar el camino por CUPS:
+    lpadmin -p ZebraZD420 -E -v socket://127.0.0.1:9100 -m raw
+"""
+
+import os
+import re
+import sys
+import json
+import time
+import socket
+import argparse
+import threading
+from collections import deque
+from socketserver import ThreadingTCPServer, StreamRequestHandler
+from typing import Optional, Dict, List
+
+from imprimir_etiquetas_servicio import (
+    NOMBRE_IMPRESORA_CHICAS,
+    NOMBRE_IMPRESORA_GRANDES,
+    guardar_json_atomico,
+    log_info,
+    log_error,
+    log_success,
+)
+
+# ============================================================================
+# CONFIGURACIÓN
+# ============================================================================
+
+IMPRESORAS_POR_DEFECTO = {NOMBRE_IMPRESORA_CHICAS: 9100, NOMBRE_IMPRESORA_GRANDES: 9101}
+DPI = 203
+VELOCIDAD_IPS = 4.0  # Pulgadas por segundo (ZD420: 2 a 6)
+LARGO_ETIQUETA_PUNTOS = 406  # Largo por defecto si el formato no trae ^LL
+BUFFER_RECEPCION = 64 * 1024  # Bytes de formatos pendientes antes de dejar de leer el socket
+ETIQUETAS_RECIENTES = 200  # Etiquetas que se guardan para inspección
+INTERVALO_ESTADISTICAS = 10
+
+STX, ETX = "\x02", "\x03"
+
+# ============================================================================
+# INTERPRETACIÓN DE ZPL
+# ============================================================================
+
+_COMANDO = re.compile(r"\^([A-Z@][A-Z0-9@])([^\^~]*)")
+_CONSULTA = re.compile(r"~(HS|JA|HI)")
+
+def _parametros(texto: str) -> List[str]:
+    return [p.strip() for p in texto.split(",")]
+
+def _entero(valor: str, por_defecto: int) -> int:
+    try:
+        return int(valor)
+    except (TypeError, ValueError):
+        return por_defecto
+
+def incrementar_serie(valor: str, incremento: int, ceros: bool) -> str:
+    """Suma `incremento` a la parte numérica final de `valor`, como ^SN."""
+    coincidencia = re.search(r"(\d+)(\D*)$", valor)
+    if not coincidencia:
+        return valor
+    numero = max(0, int(coincidencia.group(1)) + incremento)
+    texto = str(numero).zfill(len(coincidencia.group(1)) if ceros else 0)
+    return valor[:coincidencia.start(1)] + texto + coincidencia.group(2)
+
+def interpretar_formato(formato: str) -> Dict:
+    """
+    Interpreta un formato ^XA...^XZ.
+    Returns: {"copias", "replicas", "etiquetas", "largo", "campos": [plantillas de campo],
+              "series": [(índice de campo, valor inicial, incremento, ceros)]}
+    """
+    cantidad, replicas, largo = 1, 0, None
+    campos: List[str] = []
+    series = []
+    for comando, argumentos in _COMANDO.findall(formato):
+        if comando == "PQ":
+            partes = _parametros(argumentos)
+            cantidad = max(1, _entero(partes[0], 1))
+            replicas = max(0, _entero(partes[2], 0)) if len(partes) > 2 else 0
+        elif comando == "LL":
+            largo = _entero(_parametros(argumentos)[0], None)
+        elif comando == "SN":
+            partes = _parametros(argumentos)
+            campos.append(partes[0])
+            series.append((len(campos) - 1, partes[0],
+                           _entero(partes[1], 1) if len(partes) > 1 else 1,
+                           len(partes) > 2 and partes[2].upper() == "Y"))
+        elif comando == "FD":
+            campos.append(argumentos)
+    return {
+        "copias": cantidad,
+        "replicas": replicas,
+        "etiquetas": cantidad * (replicas + 1),
+        "largo": largo,
+        "campos": campos,
+        "series": series,
+    }
+
+def expandir_etiquetas(formato: Dict) -> List[List[str]]:
+    """Devuelve los campos de cada etiqueta física, con las series ya incrementadas."""
+    etiquetas = []
+    for copia in range(formato["copias"]):
+        campos = list(formato["campos"])
+        for indice, inicial, incremento, ceros in formato["series"]:
+            campos[indice] = incrementar_serie(inicial, copia * incremento, ceros)
+        etiquetas.extend([campos] * (formato["replicas"] + 1))
+    return etiquetas
+
+# ============================================================================
+# IMPRESORA EMULADA
+# ============================================================================
+
+class ImpresoraEmulada:
+    """Cola de formatos, motor de impresión simulado y contadores de una impresora."""
+
+    def __init__(self, nombre: str, puerto: int, velocidad: float = VELOCIDAD_IPS,
+                 buffer: int = BUFFER_RECEPCION, largo: int = LARGO_ETIQUETA_PUNTOS):
+        self.nombre = nombre
+        self.puerto = puerto
+        self.velocidad = velocidad
+        self.buffer = buffer
+        self.largo = largo
+        self._cola = deque()  # (formato interpretado, bytes)
+        self._condicion = threading.Condition()
+        self.bytes_en_buffer = 0
+        self.formato_parcial = False
+        self.etiquetas_restantes = 0
+        self.recientes = deque(maxlen=ETIQUETAS_RECIENTES)
+        self.estadisticas = {
+            "conexiones": 0, "bytes": 0, "formatos": 0, "etiquetas_recibidas": 0,
+            "etiquetas_impresas": 0, "consultas_estado": 0, "cancelaciones": 0,
+        }
+        self._servidor = None
+
+    def segundos_por_etiqueta(self, largo: Optional[int]) -> float:
+        if self.velocidad <= 0:
+            return 0.0
+        return ((largo or self.largo) / DPI) / self.velocidad
+
+    def encolar(self, formato: Dict, tamano: int):
+        """Agrega un formato; bloquea mientras el buffer de recepción esté lleno."""
+        with self._condicion:
+            while self.bytes_en_buffer > 0 and self.bytes_en_buffer + tamano > self.buffer:
+                self._condicion.wait()
+            self._cola.append((formato, tamano))
+            self.bytes_en_buffer += tamano
+            self.etiquetas_restantes += formato["etiquetas"]
+            self.estadisticas["formatos"] += 1
+            self.estadisticas["etiquetas_recibidas"] += formato["etiquetas"]
+            self._condicion.notify_all()
+
+    def cancelar_todo(self):
+        """~JA: descarta los formatos pendientes."""
+        with self._condicion:
+            self._cola.clear()
+            self.bytes_en_buffer = 0
+            self.etiquetas_restantes = 0
+            self.estadisticas["cancelaciones"] += 1
+            self._condicion.notify_all()
+
+    def _motor(self):
+        while True:
+            with self._condicion:
+                while not self._cola:
+                    self._condicion.wait()
+                formato, tamano = self._cola[0]
+            for campos in expandir_etiquetas(formato):
+                time.sleep(self.segundos_por_etiqueta(formato["largo"]))
+                with self._condicion:
+                    if not self._cola or self._cola[0][0] is not formato:
+                        break  # Cancelado con ~JA
+                    self.recientes.append(campos)
+                    self.etiquetas_restantes -= 1
+                    self.estadisticas["etiquetas_impresas"] += 1
+            with self._condicion:
+                if self._cola and self._cola[0][0] is formato:
+                    self._cola.popleft()
+                    self.bytes_en_buffer -= tamano
+                self._condicion.notify_all()
+
+    def estado_host(self) -> str:
+        """Respuesta a ~HS: tres cadenas entre STX y ETX, como una Zebra."""
+        with self._condicion:
+            formatos = len(self._cola)
+            lleno = int(self.bytes_en_buffer >= self.buffer)
+            restantes = self.etiquetas_restantes
+            parcial = int(self.formato_parcial)
+        cadena1 = f"030,0,0,{self.largo:04d},{min(formatos, 999):03d},{lleno},0,{parcial},000,0,0,0"
+        cadena2 = f"000,0,0,0,1,2,4,0,{min(restantes, 99999999):08d},1,000"
+        cadena3 = "1234,0"
+        return "".join(f"{STX}{cadena}{ETX}\r\n" for cadena in (cadena1, cadena2, cadena3))
+
+    def esperar_vacia(self, tiempo_maximo: float = 60) -> bool:
+        """Espera a que no queden etiquetas por imprimir (para pruebas)."""
+        limite = time.monotonic() + tiempo_maximo
+        with self._condicion:
+            while self._cola:
+                restante = limite - time.monotonic()
+                if restante <= 0:
+                    return False
+                self._condicion.wait(restante)
+        return True
+
+    def iniciar(self, host: str = "127.0.0.1"):
+        impresora = self
+
+        class Manejador(StreamRequestHandler):
+            def handle(self):
+                impresora.atender(self.connection)
+
+        ThreadingTCPServer.allow_reuse_address = True
+        self._servidor = ThreadingTCPServer((host, self.puerto), Manejador)
+        self._servidor.daemon_threads = True
+        self.puerto = self._servidor.server_address[1]
+        threading.Thread(target=self._servidor.serve_forever, name=f"emulador-{self.nombre}", daemon=True).start()
+        threading.Thread(target=self._motor, name=f"motor-{self.nombre}", daemon=True).start()
+        return self
+
+    def detener(self):
+        if self._servidor:
+            self._servidor.shutdown()
+            self._servidor.server_close()
+
+    def atender(self, conexion: socket.socket):
+        """Lee una conexión: responde consultas ~ al instante y encola cada ^XA...^XZ completo."""
+        self.estadisticas["conexiones"] += 1
+        pendiente = ""
+        while True:
+            datos = conexion.recv(4096)
+            if not datos:
+                break
+            self.estadisticas["bytes"] += len(datos)
+            pendiente += datos.decode("utf-8", errors="replace")
+
+            for consulta in _CONSULTA.findall(pendiente):
+                if consulta == "HS":
+                    self.estadisticas["consultas_estado"] += 1
+                    conexion.sendall(self.estado_host().encode("ascii"))
+                elif consulta == "HI":
+                    conexion.sendall(f"{STX}ZD420-203dpi,V84.20.21Z,8,8192KB{ETX}\r\n".encode("ascii"))
+                else:
+                    self.cancelar_todo()
+            pendiente = _CONSULTA.sub("", pendiente)
+
+            while True:
+                inicio = pendiente.find("^XA")
+                fin = pendiente.find("^XZ", inicio + 3) if inicio >= 0 else -1
+                if fin < 0:
+                    break
+                formato = pendiente[inicio:fin + 3]
+                pendiente = pendiente[fin + 3:]
+                self.encolar(interpretar_formato(formato), len(formato.encode("utf-8")))
+            self.formato_parcial = "^XA" in pendiente
+
+# ============================================================================
+# LÍNEA DE COMANDOS
+# ============================================================================
+
+def parsear_impresora(texto: str) -> tuple:
+    nombre, _, puerto = texto.partition("=")
+    if not puerto.isdigit():
+        raise argparse.ArgumentTypeError("usar NOMBRE=PUERTO")
+    return nombre, int(puerto)
+
+def main():
+    parser = argparse.ArgumentParser(description="Emulador de impresoras ZPL por TCP")
+    parser.add_argument("--impresora", type=parsear_impresora, action="append", default=None,
+                        help="NOMBRE=PUERTO (se puede repetir). Por defecto: "
+                             + ", ".join(f"{n}={p}" for n, p in IMPRESORAS_POR_DEFECTO.items()))
+    parser.add_argument("--host", default="127.0.0.1", help="Dirección en la que escuchar")
+    parser.add_argument("--velocidad", type=float, default=VELOCIDAD_IPS,
+                        help=f"Pulgadas por segundo (0 = instantáneo, por defecto {VELOCIDAD_IPS})")
+    parser.add_argument("--buffer", type=int, default=BUFFER_RECEPCION,
+                        help=f"Bytes del buffer de recepción (por defecto {BUFFER_RECEPCION})")
+    parser.add_argument("--largo", type=int, default=LARGO_ETIQUETA_PUNTOS,
+                        help=f"Largo de etiqueta en puntos si el formato no trae ^LL (por defecto {LARGO_ETIQUETA_PUNTOS})")
+    parser.add_argument("--estadisticas", default=None, help="Guardar las estadísticas en este JSON al salir")
+    args = parser.parse_args()
+
+    impresoras = []
+    for nombre, puerto in args.impresora or IMPRESORAS_POR_DEFECTO.items():
+        try:
+            impresoras.append(ImpresoraEmulada(nombre, puerto, args.velocidad, args.buffer, args.largo).iniciar(args.host))
+        except OSError as e:
+            log_error(f"No se pudo escuchar en el puerto {puerto} para {nombre}", e)
+            sys.exit(1)
+        log_success(f"{nombre} emulada en {args.host}:{puerto}")
+    log_info(f"Velocidad {args.velocidad} ips, buffer {args.buffer} bytes. Ctrl+C para terminar")
+
+    try:
+        while True:
+            time.sleep(INTERVALO_ESTADISTICAS)
+            for impresora in impresoras:
+                e = impresora.estadisticas
+                log_info(f"{impresora.nombre}: {e['etiquetas_impresas']}/{e['etiquetas_recibidas']} etiquetas, "
+                         f"{e['formatos']} formatos, {impresora.bytes_en_buffer} bytes en buffer")
+    except KeyboardInterrupt:
+        pass
+    finally:
+        resumen = {impresora.nombre: dict(impresora.estadisticas, puerto=impresora.puerto) for impresora in impresoras}
+        log_info(json.dumps(resumen, ensure_ascii=False))
+        if args.estadisticas:
+            guardar_json_atomico(os.path.abspath(args.estadisticas), resumen)
+
+if __name__ == "__main__":
+    main()
@@ -2,11 +2,16 @@
 # -- coding: utf-8 --
 
 import os
+import time
 import tkinter as tk
 from datetime import datetime, timedelta
 import subprocess
 import json
 import re
+import bisect
+import socket
+import queue
+import threading
 
 
 RUTA_PRN = "/home/gst3d/etiquetas"
@@ -17,10 +22,34 @@ ARCHIVO_CONTADOR_ID = "/home/gst3d/contador_id_numero.txt"
 ARCHIVO_LOG_LOCAL = "/home/gst3d/etiquetas_log.json"
 ID_MAQUINA = "02"
 
+# Catálogo de colores (mismas credenciales que el servicio de impresión)
+SUPABASE_URL = "https://rybokbjrbugvggprnith.supabase.co"
+SUPABASE_KEY = "sb_publishable_VAI_JWRKxhjCwcPw_qWXNA_IkXLfKR_"
+ARCHIVO_CATALOGO = "/home/gst3d/catalogo_kiosco.json"
+INTERVALO_CATALOGO = 300  # segundos entre consultas de updated_at
+INTERVALO_REVISION_CATALOGO_MS = 1000
+
+# Servicio de impresión del mismo equipo: si está corriendo, los pedidos pasan por su cola
+# (mismo cupo horario y contador de IDs). Si no responde, se imprime localmente con lp.
+SOCKET_SERVICIO = "/home/gst3d/impresion.sock"
+TIMEOUT_SERVICIO = 2  # segundos
+OPERADOR_KIOSCO = "Kiosco"
+INTERVALO_RESULTADOS_MS = 50  # Cada cuánto la interfaz revisa los resultados del hilo de impresión
+COLUMNAS_GRILLA = 7
+MARGEN_FILAS = 3  # Filas construidas por encima y por debajo de las visibles
+PAUSA_PREPARACION_MS = 50  # Entre tarea y tarea de preparación en segundo plano
+
 etiquetas_impresas_en_hora = 0
 hora_de_inicio_del_contador = datetime.now()
 
-colores_por_tipo = {
+cola_impresion = queue.Queue()  # (nombre_archivo, tipo, color) que esperan al hilo de impresión
+cola_resultados = queue.Queue()  # Resultados que la interfaz aplica con after()
+etiquetas_en_cola = 0  # Encoladas y todavía sin resultado (se descuentan del contador en pantalla)
+cupo_conocido = None  # Último cupo restante informado por el servicio o por la impresión local
+cola_catalogo = queue.Queue()  # Catálogos nuevos que dejó el hilo de sincronización
+
+# Colores base (los mismos que trae la web); los personalizados y eliminados llegan de Supabase
+colores_base = {
     "PLA": {
         "BLACK": "#000000",
         "COLORCHANGE": "#808080",
@@ -76,7 +105,6 @@ colores_por_tipo = {
         "SROSEGOLD": "#B76E79",
         "SSAND": "#C2B280",
         "SORANGEFLUOR": "#FF8000",
-        "SSAND": "#FFD700",
         "SGREENFLUOR": "#556B2F",
         "SMARBLE": "#A7A59B",
         "SPEARL": "#4682B4",
@@ -194,80 +222,191 @@ def guardar_log_local(datos):
         print(f"Error al guardar log localmente: {e}")
 
 
+def enviar_al_servicio(pedido):
+    """
+    Envía un pedido al servicio de impresión por su socket local.
+    Returns: La respuesta del servicio, o None si no se pudo conectar (hay que imprimir localmente)
+    """
+    try:
+        conexion = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        conexion.settimeout(TIMEOUT_SERVICIO)
+        conexion.connect(SOCKET_SERVICIO)
+    except OSError as e:
+        print(f"Servicio de impresión no disponible ({e}). Se imprime localmente.")
+        return None
+    
+    # Ya conectados: si algo falla desde acá el pedido pudo haber entrado, no se reimprime localmente
+    try:
+        with conexion, conexion.makefile("rb") as lector:
+            conexion.sendall(json.dumps(pedido).encode("utf-8") + b"\n")
+            linea = lector.readline()
+        return json.loads(linea)
+    except (OSError, ValueError) as e:
+        return {"ok": False, "error": f"sin respuesta del servicio: {e}"}
+
 def imprimir_y_guardar_etiqueta_unificada(nombre_archivo, tipo, color):
+    """
+    Imprime una etiqueta por el servicio o, si no está corriendo, localmente.
+    Corre en el hilo de impresión: no toca la interfaz, devuelve el resultado.
+    Returns: {"ok": bool, "cupo_restante": int | None, "limite": bool, "titulo": str, "mensaje": str}
+    """
+    respuesta = enviar_al_servicio({
+        "accion": "imprimir",
+        "tipo_material": tipo,
+        "color": nombre_archivo,
+        "cantidad": 1,
+        "maquina_id": int(ID_MAQUINA),
+        "operador": OPERADOR_KIOSCO,
+    })
+    if respuesta is None:
+        return imprimir_y_guardar_etiqueta_local(nombre_archivo, tipo, color)
+    if respuesta.get("ok"):
+        print(f"Etiqueta {color} enviada al servicio de impresión ({respuesta.get('id')})")
+        return {"ok": True, "cupo_restante": respuesta.get("cupo_restante")}
+    if respuesta.get("error") == "limite":
+        cargar_estado_horario()  # El servicio guarda el mismo archivo de estado
+        return {"ok": False, "limite": True, "cupo_restante": respuesta.get("cupo_restante")}
+    print(f"Error del servicio de impresión: {respuesta.get('error')}")
+    return {"ok": False, "titulo": "Error de Impresión",
+            "mensaje": f"El servicio de impresión rechazó la etiqueta. Error: {respuesta.get('error')}"}
+
+def imprimir_y_guardar_etiqueta_local(nombre_archivo, tipo, color):
     global etiquetas_impresas_en_hora
     global hora_de_inicio_del_contador
     
+    # El servicio pudo haber impreso desde la última lectura: partir de su estado
+    cargar_estado_horario()
     tiempo_transcurrido = datetime.now() - hora_de_inicio_del_contador
     if tiempo_transcurrido >= timedelta(hours=1):
         etiquetas_impresas_en_hora = 0
         hora_de_inicio_del_contador = datetime.now()
     
-    if etiquetas_impresas_en_hora < LIMITE_ETIQUETAS_POR_HORA:
-        id_numero = leer_contador_id()
-        numero_formateado = f"{id_numero:010d}"
-        fecha_actual = datetime.now().strftime("%d/%m/%Y %H:%M:%S")
-        contenido_barcode = f"{ID_MAQUINA}-{tipo}-{color}-{numero_formateado}"
-        
-        ruta_original = os.path.join(RUTA_PRN, f"{nombre_archivo}.prn")
-        if not os.path.exists(ruta_original):
-            tk.messagebox.showerror("Error", f"No se encontró el archivo de plantilla: {ruta_original}")
-            return
-        
-        with open(ruta_original, 'r') as f:
-            zpl_original = f.read()
-        zpl_extra = f"""
-        ^FO60,60^BY0.5,2,150^BCN,100,Y,N,N^FD{contenido_barcode}^FS
-        ^FO30,300^A0N,30,30^FDFecha: {fecha_actual}^FS
-        ^FO30,340^A0N,30,30^FDEtiq. ID: {numero_formateado}^FS
-        """
-        
-        zpl_final = zpl_original.replace("^XZ", zpl_extra + "\n^XZ")
-        ruta_temp = f"/tmp/{nombre_archivo}_unificada.prn"
-        with open(ruta_temp, 'w') as f:
-            f.write(zpl_final)
+    if etiquetas_impresas_en_hora >= LIMITE_ETIQUETAS_POR_HORA:
+        return {"ok": False, "limite": True, "cupo_restante": 0}
+    
+    id_numero = leer_contador_id()
+    numero_formateado = f"{id_numero:010d}"
+    fecha_actual = datetime.now().strftime("%d/%m/%Y %H:%M:%S")
+    contenido_barcode = f"{ID_MAQUINA}-{tipo}-{color}-{numero_formateado}"
+    
+    ruta_original = os.path.join(RUTA_PRN, f"{nombre_archivo}.prn")
+    if not os.path.exists(ruta_original):
+        return {"ok": False, "titulo": "Error", "mensaje": f"No se encontró el archivo de plantilla: {ruta_original}"}
+    
+    with open(ruta_original, 'r') as f:
+        zpl_original = f.read()
+    zpl_extra = f"""
+    ^FO60,60^BY0.5,2,150^BCN,100,Y,N,N^FD{contenido_barcode}^FS
+    ^FO30,300^A0N,30,30^FDFecha: {fecha_actual}^FS
+    ^FO30,340^A0N,30,30^FDEtiq. ID: {numero_formateado}^FS
+    """
+    
+    zpl_final = zpl_original.replace("^XZ", zpl_extra + "\n^XZ")
+    ruta_temp = f"/tmp/{nombre_archivo}_unificada.prn"
+    with open(ruta_temp, 'w') as f:
+        f.write(zpl_final)
 
+    try:
+        # Enviar a la impresora
+        subprocess.run(["lp", "-d", NOMBRE_IMPRESORA, ruta_temp], check=True)
+        print("Envío a la impresora exitoso.")
+    except subprocess.CalledProcessError as e:
+        print(f"Error al imprimir: {e}")
+        return {"ok": False, "titulo": "Error de Impresión", "mensaje": f"No se pudo enviar el archivo a la impresora. Error: {e}"}
+
+    # Guardar log y actualizar contadores
+    datos = {
+        "fecha": fecha_actual,
+        "tipo": str(tipo),
+        "color": str(color),
+        "id_numero": str(numero_formateado),
+        "codigo_barra": str(contenido_barcode),
+        "id_maquina": str(ID_MAQUINA)
+    }
+    guardar_log_local(datos)
+    guardar_contador_id(id_numero + 1)
+    
+    etiquetas_impresas_en_hora += 1
+    guardar_estado_horario()
+    print(f"Etiquetas impresas en la última hora: {etiquetas_impresas_en_hora}/{LIMITE_ETIQUETAS_POR_HORA}")
+    return {"ok": True, "cupo_restante": LIMITE_ETIQUETAS_POR_HORA - etiquetas_impresas_en_hora}
+
+def mostrar_limite_alcanzado():
+    proximo_reinicio = hora_de_inicio_del_contador + timedelta(hours=1)
+    tiempo_restante = proximo_reinicio - datetime.now()
+    minutos_restantes = int(tiempo_restante.total_seconds() / 60)
+    segundos_restantes = int(tiempo_restante.total_seconds() % 60)
+    
+    print(f"Límite de etiquetas por hora ({LIMITE_ETIQUETAS_POR_HORA}) alcanzado.")
+    print(f"El contador se reiniciará en {minutos_restantes} minutos y {segundos_restantes} segundos.")
+    
+    tk.messagebox.showinfo("Límite Alcanzado",
+                           f"Límite de etiquetas por hora ({LIMITE_ETIQUETAS_POR_HORA}) alcanzado.\n\n"
+                           f"El contador se reiniciará en {minutos_restantes} minutos y {segundos_restantes} segundos.")
+
+# ============================================================================
+# IMPRESIÓN EN SEGUNDO PLANO
+# ============================================================================
+# Los botones solo encolan la etiqueta y descuentan el contador en pantalla; un hilo
+# imprime (servicio o lp) y deja el resultado en cola_resultados, que la interfaz
+# revisa con after(). Así la pantalla no se congela aunque la impresora o CUPS tarden.
+
+def trabajador_impresion():
+    """Hilo de impresión: atiende las etiquetas encoladas en orden, una por vez."""
+    while True:
+        nombre_archivo, tipo, color = cola_impresion.get()
         try:
-            # Enviar a la impresora
-            subprocess.run(["lp", "-d", NOMBRE_IMPRESORA, ruta_temp], check=True)
-            print("Envío a la impresora exitoso.")
-
-            # Guardar log y actualizar contadores
-            datos = {
-                "fecha": fecha_actual,
-                "tipo": str(tipo),
-                "color": str(color),
-                "id_numero": str(numero_formateado),
-                "codigo_barra": str(contenido_barcode),
-                "id_maquina": str(ID_MAQUINA)
-            }
-            guardar_log_local(datos)
-            guardar_contador_id(id_numero + 1)
-            
-            etiquetas_impresas_en_hora += 1
-            guardar_estado_horario()
-            print(f"Etiquetas impresas en la última hora: {etiquetas_impresas_en_hora}/{LIMITE_ETIQUETAS_POR_HORA}")
-            actualizar_etiqueta_contador()
-        except subprocess.CalledProcessError as e:
-            print(f"Error al imprimir: {e}")
-            tk.messagebox.showerror("Error de Impresión", f"No se pudo enviar el archivo a la impresora. Error: {e}")
-            
-    else:
-        proximo_reinicio = hora_de_inicio_del_contador + timedelta(hours=1)
-        tiempo_restante = proximo_reinicio - datetime.now()
-        minutos_restantes = int(tiempo_restante.total_seconds() / 60)
-        segundos_restantes = int(tiempo_restante.total_seconds() % 60)
-        
-        print(f"Límite de etiquetas por hora ({LIMITE_ETIQUETAS_POR_HORA}) alcanzado.")
-        print(f"El contador se reiniciará en {minutos_restantes} minutos y {segundos_restantes} segundos.")
-        
-        tk.messagebox.showinfo("Límite Alcanzado",
-                               f"Límite de etiquetas por hora ({LIMITE_ETIQUETAS_POR_HORA}) alcanzado.\n\n"
-                               f"El contador se reiniciará en {minutos_restantes} minutos y {segundos_restantes} segundos.")
+            resultado = imprimir_y_guardar_etiqueta_unificada(nombre_archivo, tipo, color)
+        except Exception as e:
+            print(f"Error inesperado al imprimir {color}: {e}")
+            resultado = {"ok": False, "titulo": "Error de Impresión", "mensaje": f"Error inesperado al imprimir: {e}"}
+        cola_resultados.put(resultado)
+
+def encolar_etiqueta(nombre_archivo, tipo, color):
+    """Acción de los botones: encola la etiqueta y actualiza el contador sin esperar a la impresora."""
+    global etiquetas_en_cola
+    etiquetas_en_cola += 1
+    actualizar_etiqueta_contador()
+    cola_impresion.put((nombre_archivo, tipo, color))
+
+def revisar_resultados():
+    """Aplica en la interfaz los resultados que dejó el hilo de impresión (se reprograma con after)."""
+    global etiquetas_en_cola
+    global cupo_conocido
+    
+    procesados = 0
+    limite_alcanzado = False
+    errores = []
+    while True:
+        try:
+            resultado = cola_resultados.get_nowait()
+        except queue.Empty:
+            break
+        procesados += 1
+        if resultado.get("cupo_restante") is not None:
+            cupo_conocido = resultado["cupo_restante"]
+        if resultado.get("limite"):
+            limite_alcanzado = True
+        elif not resultado.get("ok"):
+            errores.append(resultado)
+    
+    if procesados:
+        etiquetas_en_cola -= procesados
+        actualizar_etiqueta_contador()
+    # Un solo aviso por tanda, aunque hayan fallado varios toques seguidos
+    if limite_alcanzado:
+        mostrar_limite_alcanzado()
+    if errores:
+        mensaje = errores[-1]["mensaje"]
+        if len(errores) > 1:
+            mensaje += f"\n\n({len(errores)} etiquetas no se imprimieron)"
+        tk.messagebox.showerror(errores[-1]["titulo"], mensaje)
+    root.after(INTERVALO_RESULTADOS_MS, revisar_resultados)
 
 def actualizar_etiqueta_contador():
-    etiquetas_restantes = LIMITE_ETIQUETAS_POR_HORA - etiquetas_impresas_en_hora
-    contador_label.config(text=f"Etiquetas restantes: {etiquetas_restantes}")
+    """Muestra el cupo restante descontando las etiquetas que todavía están en cola."""
+    etiquetas_restantes = cupo_conocido if cupo_conocido is not None else LIMITE_ETIQUETAS_POR_HORA - etiquetas_impresas_en_hora
+    contador_label.config(text=f"Etiquetas restantes: {max(0, etiquetas_restantes - etiquetas_en_cola)}")
 
 def es_color_oscuro(hex_color):
     hex_color = hex_color.lstrip('#')
@@ -327,45 +466,330 @@ def limpiar_nombre(etiqueta, tipo):
     return etiqueta_mostrar
 
 
-def actualizar_botones(tipo):
-    for w in frame_botones.winfo_children():
-        w.destroy()
+# ============================================================================
+# CATÁLOGO DE COLORES
+# ============================================================================
+# El catálogo es el mismo que muestra la web: los colores base de arriba, más los
+# personalizados (`colores_personalizados`) y menos los eliminados (`colores_eliminados`),
+# variante chica. Se arranca desde la última copia guardada en ARCHIVO_CATALOGO y un hilo
+# la refresca desde Supabase solo cuando cambia el `updated_at` de alguna de las dos filas.
+
+TABLAS_CATALOGO = (("colores_personalizados", "colores_global"), ("colores_eliminados", "eliminados_global"))
+
+def combinar_catalogo(personalizados, eliminados):
+    """Returns: {tipo: {color: hex}} con los colores base, los personalizados y sin los eliminados."""
+    catalogo = {tipo: dict(colores) for tipo, colores in colores_base.items()}
+    for tipo, variantes in (personalizados or {}).items():
+        for color, color_hex in ((variantes or {}).get("chica") or {}).items():
+            valido = isinstance(color_hex, str) and re.fullmatch(r"#[0-9A-Fa-f]{6}", color_hex)
+            catalogo.setdefault(tipo, {})[color] = color_hex if valido else "#808080"
+    for tipo, variantes in (eliminados or {}).items():
+        for color in ((variantes or {}).get("chica") or []):
+            catalogo.get(tipo, {}).pop(color, None)
+    return {tipo: colores for tipo, colores in catalogo.items() if colores}
+
+def cargar_snapshot_catalogo():
+    """Lee la última copia del catálogo. Returns: (colores, versiones), o los colores base si no hay copia."""
+    try:
+        with open(ARCHIVO_CATALOGO, "r") as f:
+            datos = json.load(f)
+        if datos.get("colores"):
+            return datos["colores"], datos.get("versiones") or {}
+    except FileNotFoundError:
+        pass
+    except (ValueError, IOError, AttributeError) as e:
+        print(f"Error al leer la copia local del catálogo: {e}. Se usan los colores base.")
+    return {tipo: dict(colores) for tipo, colores in colores_base.items()}, {}
+
+def guardar_snapshot_catalogo(colores, versiones):
+    """Guarda el catálogo de forma atómica (archivo temporal + rename)."""
+    ruta_temporal = f"{ARCHIVO_CATALOGO}.tmp"
+    with open(ruta_temporal, "w") as f:
+        json.dump({"versiones": versiones, "colores": colores}, f)
+    os.replace(ruta_temporal, ARCHIVO_CATALOGO)
+
+def consultar_versiones_catalogo(cliente):
+    """Returns: {tabla: updated_at} de las filas que forman el catálogo (consulta liviana)."""
+    versiones = {}
+    for tabla, fila_id in TABLAS_CATALOGO:
+        respuesta = cliente.table(tabla).select("updated_at").eq("id", fila_id).limit(1).execute()
+        versiones[tabla] = respuesta.data[0].get("updated_at") if respuesta.data else None
+    return versiones
+
+def descargar_catalogo(cliente):
+    """Returns: El catálogo combinado con los datos actuales de Supabase."""
+    datos = {}
+    for tabla, fila_id in TABLAS_CATALOGO:
+        columna = "colores_data" if tabla == "colores_personalizados" else "eliminados_data"
+        respuesta = cliente.table(tabla).select(columna).eq("id", fila_id).limit(1).execute()
+        datos[tabla] = (respuesta.data[0].get(columna) if respuesta.data else None) or {}
+    return combinar_catalogo(datos["colores_personalizados"], datos["colores_eliminados"])
+
+def sincronizar_catalogo():
+    """Hilo de fondo: cada INTERVALO_CATALOGO revisa si el catálogo cambió y deja el nuevo en cola_catalogo."""
+    global versiones_catalogo
+    
+    try:
+        from supabase import create_client
+    except ImportError:
+        print("La librería supabase no está instalada: el kiosco usa la copia local del catálogo.")
+        return
+    
+    cliente = None
+    while True:
+        try:
+            if cliente is None:
+                cliente = create_client(SUPABASE_URL, SUPABASE_KEY)
+            versiones = consultar_versiones_catalogo(cliente)
+            if versiones != versiones_catalogo:
+                colores = descargar_catalogo(cliente)
+                guardar_snapshot_catalogo(colores, versiones)
+                versiones_catalogo = versiones
+                cola_catalogo.put(colores)
+        except Exception as e:
+            print(f"No se pudo actualizar el catálogo desde Supabase: {e}")
+        time.sleep(INTERVALO_CATALOGO)
+
+def aplicar_catalogo(nuevo):
+    """
+    Aplica un catálogo nuevo a la interfaz: solo se recalculan los modelos de los materiales
+    que cambiaron, y la grilla reutiliza sus filas (las que no cambiaron ni se reconfiguran).
+    """
+    cambiados = [tipo for tipo in list(colores_por_tipo) + [t for t in nuevo if t not in colores_por_tipo]
+                 if colores_por_tipo.get(tipo) != nuevo.get(tipo)]
+    if not cambiados:
+        return
+    materiales_cambiaron = list(colores_por_tipo) != list(nuevo)
+    colores_por_tipo.clear()
+    colores_por_tipo.update(nuevo)
+    for tipo in cambiados:
+        modelos_por_tipo.pop(tipo, None)
+    print(f"Catálogo actualizado: {', '.join(cambiados)}")
+    
+    if materiales_cambiaron:
+        actualizar_menu_materiales()
+    tipo_actual = tipo_var.get()
+    if tipo_actual not in colores_por_tipo:
+        tipo_var.set(next(iter(colores_por_tipo)))
+        actualizar_botones(tipo_var.get())
+    elif tipo_actual in cambiados:
+        actualizar_botones(tipo_actual)
+
+def actualizar_menu_materiales():
+    """Rearma las opciones del selector de material."""
+    menu = menu_materiales["menu"]
+    menu.delete(0, "end")
+    for tipo in colores_por_tipo:
+        menu.add_command(label=tipo, command=tk._setit(tipo_var, tipo, actualizar_botones))
+
+def revisar_catalogo():
+    """Aplica el último catálogo que haya dejado el hilo de sincronización (se reprograma con after)."""
+    nuevo = None
+    while True:
+        try:
+            nuevo = cola_catalogo.get_nowait()
+        except queue.Empty:
+            break
+    if nuevo is not None:
+        aplicar_catalogo(nuevo)
+    root.after(INTERVALO_REVISION_CATALOGO_MS, revisar_catalogo)
+
+colores_por_tipo, versiones_catalogo = cargar_snapshot_catalogo()
+
+# ============================================================================
+# GRILLA VIRTUAL DE BOTONES
+# ============================================================================
+# Cada material tiene su modelo (nombres y colores de letra ya calculados), que se arma
+# una sola vez. La grilla solo construye las filas visibles más un margen y reutiliza
+# esos widgets al desplazarse o al cambiar de material, así la memoria y el arranque no
+# crecen con el catálogo. El resto de las filas y modelos se preparan en los ratos libres.
 
-    colores = colores_por_tipo.get(tipo, {})
-    cols = 7
+modelos_por_tipo = {}  # tipo -> filas ("titulo", texto) o ("botones", ((etiqueta, texto, fondo, letra), ...))
+entradas_botones = {}  # (tipo, etiqueta, fondo) -> (etiqueta, texto, fondo, letra), para no recalcular al cambiar el catálogo
 
-    # SILK agrupar por categorías
+def agrupar_colores(tipo, colores):
+    """Returns: [(titulo o None, [etiquetas])] en el orden en que se muestran."""
     if tipo == "SILK":
-        categorias = {
-            "Normales": sorted([k for k in colores if k.startswith("S") and not k.startswith("SBICOLOR") and not k.startswith("STRICOLOR")]),
-            "Bicolor": sorted([k for k in colores if k.startswith("BICO") or k.startswith("S") and "BICO" in k]),
-            "Tricolor": sorted([k for k in colores if k.startswith("STRI")])
-        }
-        row = 0
-        for categoria, claves in categorias.items():
-            if claves:
-                tk.Label(frame_botones, text=f"── {categoria} ──", fg="white", bg="#2e2e2e", font=("Helvetica", 12, "bold")).grid(row=row, column=0, columnspan=cols, pady=(10, 5))
-                row += 1
-                for idx, etiqueta in enumerate(claves):
-                    r, c = divmod(idx, cols)
-                    r += row
-                    color_hex = colores[etiqueta]
-                    fg = "white" if es_color_oscuro(color_hex) else "black"
-                    etiqueta_mostrar = limpiar_nombre(etiqueta, tipo)
-                    btn = tk.Button(frame_botones, text=etiqueta_mostrar, bg=color_hex, fg=fg, width=20, height=4, wraplength=140, font=("Arial", 10, "bold"), justify="center", command=lambda e=etiqueta, t=tipo: imprimir_y_guardar_etiqueta_unificada(e, t, e))
-                    btn.grid(row=r, column=c, padx=5, pady=5, sticky="nsew")
-                row += (len(claves) // cols) + (1 if len(claves) % cols > 0 else 0)
-    else:
-        # Para el resto de los tipos (PLA, PETG, etc.) se muestran todos juntos
-        for idx, (etiqueta, color_hex) in enumerate(colores.items()):
-            r, c = divmod(idx, cols)
-            fg = "white" if es_color_oscuro(color_hex) else "black"
-            etiqueta_mostrar = limpiar_nombre(etiqueta, tipo)
-            btn = tk.Button(frame_botones, text=etiqueta_mostrar, bg=color_hex, fg=fg, width=20, height=4, wraplength=140, font=("Arial", 10, "bold"), justify="center", command=lambda e=etiqueta, t=tipo: imprimir_y_guardar_etiqueta_unificada(e, t, e))
-            btn.grid(row=r, column=c, padx=5, pady=5, sticky="nsew")
+        return [
+            ("Normales", sorted([k for k in colores if k.startswith("S") and not k.startswith("SBICOLOR") and not k.startswith("STRICOLOR")])),
+            ("Bicolor", sorted([k for k in colores if k.startswith("BICO") or k.startswith("S") and "BICO" in k])),
+            ("Tricolor", sorted([k for k in colores if k.startswith("STRI")])),
+        ]
+    # Para el resto de los tipos (PLA, PETG, etc.) se muestran todos juntos
+    return [(None, list(colores))]
+
+def entrada_boton(tipo, etiqueta, color_hex):
+    """Returns: (etiqueta, texto, fondo, letra) de un botón, calculado una sola vez por color."""
+    clave = (tipo, etiqueta, color_hex)
+    if clave not in entradas_botones:
+        fg = "white" if es_color_oscuro(color_hex) else "black"
+        entradas_botones[clave] = (etiqueta, limpiar_nombre(etiqueta, tipo), color_hex, fg)
+    return entradas_botones[clave]
+
+def modelo_vista(tipo):
+    """Calcula (una sola vez por material) las filas de la grilla con nombres y colores resueltos."""
+    if tipo not in modelos_por_tipo:
+        colores = colores_por_tipo.get(tipo, {})
+        filas = []
+        for titulo, claves in agrupar_colores(tipo, colores):
+            if not claves:
+                continue
+            if titulo:
+                filas.append(("titulo", titulo))
+            botones = [entrada_boton(tipo, etiqueta, colores[etiqueta]) for etiqueta in claves]
+            for inicio in range(0, len(botones), COLUMNAS_GRILLA):
+                filas.append(("botones", tuple(botones[inicio:inicio + COLUMNAS_GRILLA])))
+        modelos_por_tipo[tipo] = filas
+    return modelos_por_tipo[tipo]
+
+class FilaGrilla:
+    """Una fila reutilizable del canvas: un título o hasta COLUMNAS_GRILLA botones."""
+
+    def __init__(self, canvas):
+        self.frame = tk.Frame(canvas, bg="#2e2e2e")
+        self.titulo = tk.Label(self.frame, fg="white", bg="#2e2e2e", font=("Helvetica", 12, "bold"))
+        self.botones = [
+            tk.Button(self.frame, width=20, height=4, wraplength=140, font=("Arial", 10, "bold"), justify="center")
+            for _ in range(COLUMNAS_GRILLA)
+        ]
+        for i in range(COLUMNAS_GRILLA):
+            self.frame.columnconfigure(i, weight=1, uniform="columna")
+        self.item = canvas.create_window(0, 0, anchor="nw", window=self.frame, state="hidden")
+        self.contenido = None  # (tipo, fila del modelo) que muestra (None = sin asignar)
+
+    def mostrar(self, fila, tipo):
+        """Configura los widgets para una fila del modelo (no hace nada si ya la muestra)."""
+        if (tipo, fila) == self.contenido:
+            return
+        self.contenido = (tipo, fila)
+        if fila[0] == "titulo":
+            for boton in self.botones:
+                boton.grid_remove()
+            self.titulo.configure(text=f"── {fila[1]} ──")
+            self.titulo.grid(row=0, column=0, columnspan=COLUMNAS_GRILLA, pady=(10, 5))
+            return
+        self.titulo.grid_remove()
+        for c, boton in enumerate(self.botones):
+            if c < len(fila[1]):
+                etiqueta, etiqueta_mostrar, color_hex, fg = fila[1][c]
+                boton.configure(text=etiqueta_mostrar, bg=color_hex, fg=fg, command=lambda e=etiqueta, t=tipo: encolar_etiqueta(e, t, e))
+                boton.grid(row=0, column=c, padx=5, pady=5, sticky="nsew")
+            else:
+                boton.grid_remove()
+
+class GrillaVirtual:
+    """
+    Muestra el modelo de un material en un canvas creando solo las filas visibles
+    (más MARGEN_FILAS arriba y abajo). Las filas que salen de la vista vuelven a un
+    pool y se reasignan a las que entran.
+    """
+
+    def __init__(self, canvas):
+        self.canvas = canvas
+        self.tipo = None
+        self.filas = []
+        self.inicios = [0]  # Coordenada y de cada fila (y el alto total al final)
+        self.visibles = {}  # índice de fila -> FilaGrilla
+        self.libres = []
+        self.posiciones = {}  # tipo -> desplazamiento guardado al cambiar de material
+        self.alto_botones = None
+        self.alto_titulo = None
+
+    def _medir(self):
+        """Mide el alto real de una fila de botones y de una de título con una fila de muestra."""
+        fila = FilaGrilla(self.canvas)
+        fila.mostrar(("botones", [("", "Muestra", "#2e2e2e", "white")]), None)
+        self.canvas.update_idletasks()
+        self.alto_botones = fila.frame.winfo_reqheight()
+        fila.mostrar(("titulo", "Muestra"), None)
+        self.canvas.update_idletasks()
+        self.alto_titulo = fila.frame.winfo_reqheight()
+        fila.contenido = None
+        self.libres.append(fila)
+
+    def _tomar_fila(self, fila_modelo):
+        """Saca una fila del pool, prefiriendo una que ya muestre ese contenido."""
+        for i, fila in enumerate(self.libres):
+            if fila.contenido == (self.tipo, fila_modelo):
+                return self.libres.pop(i)
+        return self.libres.pop() if self.libres else FilaGrilla(self.canvas)
+
+    def mostrar_tipo(self, tipo):
+        """Cambia de material reutilizando los widgets existentes."""
+        if self.tipo is not None:
+            self.posiciones[self.tipo] = self.canvas.yview()[0]
+        if self.alto_botones is None:
+            self._medir()
+        self.tipo = tipo
+        self.filas = modelo_vista(tipo)
+        self.inicios = [0]
+        for fila in self.filas:
+            self.inicios.append(self.inicios[-1] + (self.alto_titulo if fila[0] == "titulo" else self.alto_botones))
+        for fila in self.visibles.values():
+            self.canvas.itemconfigure(fila.item, state="hidden")
+            self.libres.append(fila)
+        self.visibles = {}
+        self.canvas.configure(scrollregion=(0, 0, self.canvas.winfo_width(), self.inicios[-1]))
+        self.canvas.yview_moveto(self.posiciones.get(tipo, 0))
+        self.refrescar()
+
+    def refrescar(self):
+        """Asigna filas del pool a las filas del modelo que quedaron en la vista (más el margen)."""
+        arriba = self.canvas.canvasy(0)
+        abajo = arriba + self.canvas.winfo_height()
+        primera = max(0, bisect.bisect_right(self.inicios, arriba) - 1 - MARGEN_FILAS)
+        ultima = min(len(self.filas), bisect.bisect_left(self.inicios, abajo) + MARGEN_FILAS)
+        
+        for indice in [i for i in self.visibles if not primera <= i < ultima]:
+            fila = self.visibles.pop(indice)
+            self.canvas.itemconfigure(fila.item, state="hidden")
+            self.libres.append(fila)
+        ancho = self.canvas.winfo_width()
+        for indice in range(primera, ultima):
+            if indice not in self.visibles:
+                fila = self._tomar_fila(self.filas[indice])
+                fila.mostrar(self.filas[indice], self.tipo)
+                self.canvas.coords(fila.item, 0, self.inicios[indice])
+                self.canvas.itemconfigure(fila.item, state="normal", width=ancho)
+                self.visibles[indice] = fila
+
+    def al_redimensionar(self, evento):
+        """El canvas cambió de tamaño: ajustar el ancho de las filas y completar las visibles."""
+        for fila in self.visibles.values():
+            self.canvas.itemconfigure(fila.item, width=evento.width)
+        self.canvas.configure(scrollregion=(0, 0, evento.width, self.inicios[-1]))
+        self.refrescar()
+
+    def completar_pool(self):
+        """
+        En los ratos libres, deja creadas las filas que puede necesitar un desplazamiento
+        (una pantalla más el margen de cada lado), de a una por vez.
+        Returns: True si creó una fila
+        """
+        if not self.alto_botones:
+            return False
+        necesarias = self.canvas.winfo_height() // self.alto_botones + 1 + 2 * MARGEN_FILAS
+        if len(self.visibles) + len(self.libres) >= necesarias:
+            return False
+        self.libres.insert(0, FilaGrilla(self.canvas))
+        return True
 
-    for i in range(cols):
-        frame_botones.columnconfigure(i, weight=1)
+def actualizar_botones(tipo):
+    """Muestra la grilla del material elegido."""
+    grilla.mostrar_tipo(tipo)
+
+def al_desplazar(primero, ultimo):
+    sb.set(primero, ultimo)
+    grilla.refrescar()
+
+def preparar_en_segundo_plano():
+    """Tareas de los ratos libres, de a una por vez: completar el pool de filas y los modelos de los demás materiales."""
+    if not grilla.completar_pool():
+        pendientes = [tipo for tipo in colores_por_tipo if tipo not in modelos_por_tipo]
+        if not pendientes:
+            return
+        modelo_vista(pendientes[0])
+    root.after(PAUSA_PREPARACION_MS, lambda: root.after_idle(preparar_en_segundo_plano))
 
 root = tk.Tk()
 root.title("Impresión de etiquetas Filason")
@@ -383,18 +807,23 @@ top_frame.pack(side="top", fill="x", padx=10, pady=10)
 contador_label = tk.Label(top_frame, text=f"Etiquetas restantes: {LIMITE_ETIQUETAS_POR_HORA - etiquetas_impresas_en_hora}", font=("Arial", 16, "bold"), bg="#2e2e2e", fg="white")
 contador_label.pack(side="right", padx=10)
 
-tipo_var = tk.StringVar(value="PLA")
-tk.OptionMenu(top_frame, tipo_var, *colores_por_tipo.keys(), command=actualizar_botones).pack(side="left", pady=10)
+tipo_var = tk.StringVar(value="PLA" if "PLA" in colores_por_tipo else next(iter(colores_por_tipo)))
+menu_materiales = tk.OptionMenu(top_frame, tipo_var, *colores_por_tipo.keys(), command=actualizar_botones)
+menu_materiales.pack(side="left", pady=10)
 
 canvas = tk.Canvas(root, bg="#2e2e2e")
-frame_botones = tk.Frame(canvas, bg="#2e2e2e")
-frame_botones.bind("<Configure>", lambda e: canvas.configure(scrollregion=canvas.bbox("all")))
-canvas.create_window((0, 0), window=frame_botones, anchor="nw")
+grilla = GrillaVirtual(canvas)
+canvas.bind("<Configure>", grilla.al_redimensionar)
 
 sb = tk.Scrollbar(root, orient="vertical", command=canvas.yview, width=20, bg="#2e2e2e")
-canvas.configure(yscrollcommand=sb.set)
+canvas.configure(yscrollcommand=al_desplazar)
 canvas.pack(side="left", fill="both", expand=True)
 sb.pack(side="right", fill="y")
 
 actualizar_botones(tipo_var.get())
+threading.Thread(target=trabajador_impresion, name="impresion", daemon=True).start()
+root.after(INTERVALO_RESULTADOS_MS, revisar_resultados)
+root.after_idle(preparar_en_segundo_plano)
+threading.Thread(target=sincronizar_catalogo, name="catalogo", daemon=True).start()
+root.after(INTERVALO_REVISION_CATALOGO_MS, revisar_catalogo)
 root.mainloop()
\ No newline at end of file
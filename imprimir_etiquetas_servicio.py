@@ -10,12 +10,34 @@ import os
 import sys
 import time
 import json
+import asyncio
+import random
+import queue
+import socket
+import socketserver
 import subprocess
+import threading
 import traceback
+import atexit
+import urllib.request
+import bisect
+import contextlib
+import signal
+import hmac
+import marshal
+import ipaddress
+import tracemalloc
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import uuid
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta
 from typing import Optional, Dict, List
 
 from supabase import create_client, Client
+from postgrest.exceptions import APIError
+
+from optimizador_zpl import optimizar_zpl
 
 # ============================================================================
 # CONFIGURACIÓN - TODAS LAS CREDENCIALES AQUÍ
@@ -31,17 +53,132 @@ NOMBRE_IMPRESORA_CHICAS = "ZebraZD420"  # Nombre de la impresora CUPS para etiqu
 NOMBRE_IMPRESORA_GRANDES = "ZebraZD420_Grande"  # Nombre de la impresora CUPS para etiquetas grandes
 ID_MAQUINA = "02"  # ID de la máquina para códigos de barras
 
+# Transporte hacia la impresora (el ZPL nunca se escribe en disco)
+# - "stdin": se entrega a `lp` por su entrada estándar
+# - "memfd": se entrega a `lp` como archivo anónimo en memoria (solo Linux)
+MODO_SPOOLER = "stdin"
+# Impresoras que se alimentan directo por socket RAW (puerto 9100), sin pasar por CUPS
+# Ejemplo: {"ZebraZD420": ("192.168.1.50", 9100)}
+IMPRESORAS_RAW: Dict[str, tuple] = {}
+TIMEOUT_IMPRESION = 30  # segundos
+
 # Límites
 LIMITE_ETIQUETAS_POR_HORA = 100
 
+# Cantidad de etiquetas que se dejan renderizadas por delante de la que se está imprimiendo
+ETIQUETAS_RENDERIZADAS_ADELANTADAS = 4
+
+# Plantillas: se imprime la forma optimizada (gráficos :Z64:, sin configuración repetida).
+# La copia optimizada queda en una subcarpeta de RUTA_PRN; el .prn original no se toca.
+OPTIMIZAR_PLANTILLAS = True
+SUBCARPETA_PLANTILLAS_OPTIMIZADAS = ".optimizadas"
+
 # Archivos locales
 ARCHIVO_ESTADO_HORARIO = "/home/gst3d/estado_contador.txt"
 ARCHIVO_CONTADOR_ID = "/home/gst3d/contador_id_numero.txt"
 ARCHIVO_LOG_LOCAL = "/home/gst3d/etiquetas_log.json"
 ARCHIVO_NOTIFICACIONES = "/home/gst3d/notificaciones_prn.log"
+ARCHIVO_DELTAS_STOCK = "/home/gst3d/deltas_stock_pendientes.json"
+ARCHIVO_CURSOR_SUBIDA_LOG = "/home/gst3d/etiquetas_log.cursor"
+
+# Notificaciones
+VENTANA_DEDUPLICACION_NOTIFICACIONES = 3600  # segundos: un mismo aviso se manda una vez por ventana
+INTERVALO_ENVIO_NOTIFICACIONES = 5  # segundos que se juntan avisos antes de enviarlos
+MAX_NOTIFICACIONES_EN_MEMORIA = 100
+MAX_BYTES_ARCHIVO_NOTIFICACIONES = 1024 * 1024  # Se rota a .1 al superar este tamaño
+NOTIFICACIONES_WEBHOOK_URL: Optional[str] = None  # p. ej. "https://hooks.example.com/gst3d"
+
+# Stock desde el servicio
+# Desactivado por defecto: hoy la web ya suma las bobinas al stock cuando se crea la impresión.
+# Si se activa, quitar ese ajuste de la web para no contar dos veces.
+ACTUALIZAR_STOCK_DESDE_SERVICIO = False
+DELTA_STOCK_POR_BOBINA = 1  # Una bobina = 1 etiqueta chica + 1 grande; se cuenta por cada grande impresa
+INTERVALO_ENVIO_STOCK = 30  # segundos entre envíos del lote de deltas
+
+# Contador de etiquetas realmente impresas (tabla contador_etiquetas)
+# Se usa una fila propia para no sumar dos veces lo que la web ya cuenta en 'contador_global'
+ACTUALIZAR_CONTADOR_ETIQUETAS = True
+ID_CONTADOR_ETIQUETAS_SERVICIO = "contador_impreso"
+INTERVALO_ENVIO_CONTADOR = 10  # segundos
+ETIQUETAS_POR_ENVIO_CONTADOR = 50  # o antes, si se juntan estas etiquetas
+
+# Subida del log local de etiquetas a Supabase (tabla etiquetas_impresas)
+SUBIR_REGISTROS_ETIQUETAS = True
+INTERVALO_SUBIDA_REGISTROS = 30  # segundos
+LOTE_SUBIDA_MINIMO = 50
+LOTE_SUBIDA_MAXIMO = 1000
+LATENCIA_OBJETIVO_SUBIDA = 2.0  # segundos por inserción antes de achicar el lote
+
+# Endpoint HTTP de métricas (formato Prometheus) y salud
+SERVIDOR_METRICAS_ACTIVO = True
+HOST_METRICAS = "127.0.0.1"  # Solo este equipo
+PUERTO_METRICAS = 9464
+# Interfaz que se usa con ENVIO_LAN_ACTIVO o METRICAS_EN_RED (p. ej. Prometheus en otro equipo)
+HOST_METRICAS_RED = "0.0.0.0"
+METRICAS_EN_RED = False
+
+# Trazas por trabajo (spans en JSONL, con rotación por tamaño)
+TRAZAS_ACTIVAS = True
+MUESTREO_TRAZAS = 0.1  # Fracción de trabajos que se trazan (1.0 = todos)
+ARCHIVO_TRAZAS = "/home/gst3d/trazas_impresion.jsonl"
+MAX_BYTES_ARCHIVO_TRAZAS = 10 * 1024 * 1024
+ARCHIVOS_TRAZAS_CONSERVADOS = 3
+INTERVALO_ESCRITURA_TRAZAS = 5
+MAX_SPANS_EN_MEMORIA = 5000
+
+# Perfilado bajo demanda (SIGUSR1 = CPU, SIGUSR2 = memoria, o POST /admin/perfil/... desde localhost)
+DIRECTORIO_PERFILES = "/home/gst3d/perfiles"
+DURACION_PERFIL_CPU = 30  # Segundos por defecto de una captura de CPU
+MAX_DURACION_PERFIL_CPU = 600
+INTERVALO_MUESTREO_CPU = 0.005  # Segundos entre muestras de las pilas
+# Sin reloj de CPU por hilo (fuera de Unix) se descartan las muestras cuyo último cuadro Python es una espera
+FUNCIONES_DE_ESPERA = {
+    ("threading.py", "wait"), ("threading.py", "_wait_for_tstate_lock"), ("queue.py", "get"),
+    ("selectors.py", "select"), ("socketserver.py", "serve_forever"), ("socket.py", "accept"),
+    ("base_events.py", "_run_once"), ("thread.py", "_worker"),
+}
+CUADROS_TRACEMALLOC = 25  # Profundidad de pila guardada por asignación
+
+# Envío local de trabajos por socket Unix (kiosco y otras herramientas del mismo equipo)
+ENVIO_LOCAL_ACTIVO = True
+SOCKET_ENVIO_LOCAL = "/home/gst3d/impresion.sock"
+MAX_CANTIDAD_ENVIO_LOCAL = 100  # Etiquetas por pedido
+ESPERA_MAXIMA_ENVIO_LOCAL = 120  # Segundos que espera un pedido con "esperar": true
+
+# Envío directo desde el dashboard por la red local (POST /impresiones en el puerto de métricas).
+# Se imprime enseguida y la fila de `impresiones` se escribe en Supabase en segundo plano con el mismo id.
+# El servidor del dashboard firma tokens de sesión cortos con el secreto compartido; el secreto nunca
+# llega al navegador. Sin secreto o sin origen configurado el endpoint rechaza todo.
+ENVIO_LAN_ACTIVO = False
+SECRETO_ENVIO_LAN = os.environ.get("GST3D_SECRETO_ENVIO_LAN")
+ORIGEN_PERMITIDO_LAN = os.environ.get("GST3D_ORIGEN_DASHBOARD")  # Origen exacto del dashboard, p. ej. http://192.168.1.10:3000
+DURACION_MAXIMA_TOKEN_LAN = 15 * 60  # segundos; un token que vence más allá de esto se rechaza
+MAX_BYTES_PEDIDO_LAN = 16 * 1024
+ARCHIVO_IMPRESIONES_DIRECTAS = "/home/gst3d/impresiones_directas_pendientes.json"
+ARCHIVO_IMPRESIONES_DIRECTAS_RECHAZADAS = "/home/gst3d/impresiones_directas_rechazadas.jsonl"  # Filas que Supabase no acepta
+INTERVALO_REINTENTO_DIRECTAS = 10  # segundos entre reintentos de escritura en Supabase
+MAX_IDS_DIRECTOS_RECORDADOS = 5000  # Ids que el polling ignora porque ya entraron por la red local
 
 # Intervalo de polling (segundos)
 INTERVALO_POLLING = 5
+INTERVALO_POLLING_MAXIMO = 60  # Techo del backoff cuando la cola está vacía
+FACTOR_BACKOFF_POLLING = 2
+JITTER_POLLING = 0.2  # ±20% para que varios hosts no consulten sincronizados
+TAMANO_PAGINA_PENDIENTES = 10
+
+# Drenaje de backlog (después de un corte, con muchos pendientes acumulados)
+TAMANO_PAGINA_DRENAJE_MAXIMO = 200
+LATENCIA_OBJETIVO_PAGINA = 1.0  # segundos por consulta antes de achicar la página
+
+# Columnas que el servicio realmente usa de cada impresión
+COLUMNAS_IMPRESION = "id,maquina_id,tipo_material,etiqueta_chica,etiqueta_grande,operador,cantidad_chicas,cantidad_grandes,timestamp"
+
+# Núcleo asíncrono
+MAX_IMPRESIONES_EN_CURSO = 10  # Trabajos aceptados que todavía no tienen estado final
+INTERVALO_HEARTBEAT = 60  # segundos
+
+# Verificación de archivos PRN faltantes (en segundo plano)
+INTERVALO_VERIFICACION_PRN = 500  # segundos
 
 # Configuración de reintentos
 MAX_REINTENTOS_CONEXION = 5
@@ -54,6 +191,14 @@ hora_de_inicio_del_contador = datetime.now()
 supabase_client: Optional[Client] = None
 conteo_errores_consecutivos = 0
 ultimo_heartbeat = datetime.now()
+supabase_conectado = False
+duracion_ultima_consulta_ms = None  # Lo adjuntan las trazas de los trabajos de esa consulta
+impresiones_pendientes_vistas = 0  # Filas 'pendiente' vistas en la última pasada de polling (con su drenaje)
+
+# Protege el contador horario y el contador de IDs (se usan desde varios hilos)
+_lock_contadores = threading.RLock()
+# Caché de plantillas ZPL: ruta -> (mtime_ns, contenido)
+_cache_plantillas: Dict[str, tuple] = {}
 
 # ============================================================================
 # FUNCIONES DE LOGGING MEJORADAS
@@ -81,41 +226,801 @@ def log_warning(mensaje: str):
     timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
     print(f"[{timestamp}] ⚠️  {mensaje}")
 
+# ============================================================================
+# NOTIFICACIONES (DEDUPLICADAS Y EN LOTE)
+# ============================================================================
+
+def leer_ultimas_lineas(ruta: str, cantidad: int, tamano_bloque: int = 4096) -> List[str]:
+    """Lee las últimas líneas de un archivo leyendo bloques desde el final."""
+    with open(ruta, 'rb') as f:
+        f.seek(0, os.SEEK_END)
+        posicion = f.tell()
+        datos = b""
+        while posicion > 0 and datos.count(b"\n") <= cantidad:
+            leer = min(tamano_bloque, posicion)
+            posicion -= leer
+            f.seek(posicion)
+            datos = f.read(leer) + datos
+    lineas = datos.decode('utf-8', errors='replace').splitlines()
+    return [linea.strip() for linea in lineas[-cantidad:] if linea.strip()]
+
+class BandejaNotificaciones:
+    """
+    Bandeja de salida de notificaciones.
+    - Colapsa avisos repetidos con la misma clave dentro de VENTANA_DEDUPLICACION_NOTIFICACIONES
+    - Envía en lote a los destinos registrados cada INTERVALO_ENVIO_NOTIFICACIONES
+    - Guarda las últimas notificaciones en memoria para leerlas sin tocar el archivo
+    """
+
+    def __init__(self, ventana: float = VENTANA_DEDUPLICACION_NOTIFICACIONES,
+                 intervalo: float = INTERVALO_ENVIO_NOTIFICACIONES):
+        self.ventana = ventana
+        self.intervalo = intervalo
+        self.destinos = []
+        self.recientes = deque(maxlen=MAX_NOTIFICACIONES_EN_MEMORIA)
+        self._ultimo_envio_por_clave: Dict[tuple, float] = {}
+        self._repeticiones: Dict[tuple, int] = {}
+        self._pendientes: List[str] = []
+        self._lock = threading.Lock()
+        self._hay_pendientes = threading.Event()
+        self._hilo: Optional[threading.Thread] = None
+
+    def agregar_destino(self, destino):
+        """Registra un destino: una función que recibe la lista de mensajes del lote."""
+        self.destinos.append(destino)
+
+    def registrar(self, clave: tuple, mensaje: str) -> bool:
+        """
+        Encola una notificación salvo que la misma clave ya se haya notificado dentro de la ventana.
+        Returns: True si se encoló, False si se colapsó con una anterior
+        """
+        ahora = time.monotonic()
+        with self._lock:
+            ultimo = self._ultimo_envio_por_clave.get(clave)
+            if ultimo is not None and ahora - ultimo < self.ventana:
+                self._repeticiones[clave] = self._repeticiones.get(clave, 0) + 1
+                return False
+            
+            repeticiones = self._repeticiones.pop(clave, 0)
+            if repeticiones:
+                mensaje = f"{mensaje} (repetida {repeticiones} veces desde el aviso anterior)"
+            self._ultimo_envio_por_clave[clave] = ahora
+            self._pendientes.append(mensaje)
+            self.recientes.append(mensaje)
+        
+        self._iniciar()
+        self._hay_pendientes.set()
+        return True
+
+    def enviar_pendientes(self):
+        """Envía el lote acumulado a todos los destinos."""
+        with self._lock:
+            lote, self._pendientes = self._pendientes, []
+        if not lote:
+            return
+        for destino in self.destinos:
+            try:
+                destino(lote)
+            except Exception as e:
+                log_error(f"Error al enviar {len(lote)} notificación(es) a {getattr(destino, '__name__', destino)}", e)
+
+    def ultimas(self, cantidad: int = 10) -> List[str]:
+        """Últimas notificaciones, desde memoria o (recién iniciado) desde el final del archivo."""
+        with self._lock:
+            if self.recientes:
+                return list(self.recientes)[-cantidad:]
+        if not os.path.exists(ARCHIVO_NOTIFICACIONES):
+            return []
+        return leer_ultimas_lineas(ARCHIVO_NOTIFICACIONES, cantidad)
+
+    def _bucle(self):
+        while True:
+            self._hay_pendientes.wait()
+            # Esperar un poco para juntar avisos que llegan casi juntos
+            time.sleep(self.intervalo)
+            self._hay_pendientes.clear()
+            self.enviar_pendientes()
+
+    def _iniciar(self):
+        if self._hilo is None:
+            self._hilo = threading.Thread(target=self._bucle, name="notificaciones", daemon=True)
+            self._hilo.start()
+            atexit.register(self.enviar_pendientes)
+
+def destino_archivo_notificaciones(lote: List[str]):
+    """Agrega el lote al archivo de notificaciones, rotándolo si supera el tamaño máximo."""
+    os.makedirs(os.path.dirname(ARCHIVO_NOTIFICACIONES), exist_ok=True)
+    try:
+        if os.path.getsize(ARCHIVO_NOTIFICACIONES) > MAX_BYTES_ARCHIVO_NOTIFICACIONES:
+            os.replace(ARCHIVO_NOTIFICACIONES, ARCHIVO_NOTIFICACIONES + ".1")
+    except FileNotFoundError:
+        pass
+    with open(ARCHIVO_NOTIFICACIONES, 'a', encoding='utf-8') as f:
+        f.write("".join(f"{mensaje}\n" for mensaje in lote))
+
+def destino_webhook_notificaciones(lote: List[str]):
+    """Envía el lote como JSON a NOTIFICACIONES_WEBHOOK_URL (si está configurada)."""
+    if not NOTIFICACIONES_WEBHOOK_URL:
+        return
+    cuerpo = json.dumps({"maquina": ID_MAQUINA, "notificaciones": lote}, ensure_ascii=False).encode('utf-8')
+    solicitud = urllib.request.Request(
+        NOTIFICACIONES_WEBHOOK_URL, data=cuerpo, headers={"Content-Type": "application/json"}
+    )
+    with urllib.request.urlopen(solicitud, timeout=10):
+        pass
+
+bandeja_notificaciones = BandejaNotificaciones()
+bandeja_notificaciones.agregar_destino(destino_archivo_notificaciones)
+bandeja_notificaciones.agregar_destino(destino_webhook_notificaciones)
+
 def notificar_error_prn(color: str, es_grande: bool, tipo_material: str):
     """Registra una notificación de error de archivo PRN faltante."""
     try:
         timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
         variante = "grande" if es_grande else "chica"
-        mensaje = f"[{timestamp}] ARCHIVO PRN FALTANTE: {color} ({variante}) - {tipo_material}\n"
-
-        # Registrar en archivo de notificaciones
-        with open(ARCHIVO_NOTIFICACIONES, 'a', encoding='utf-8') as f:
-            f.write(mensaje)
-
-        log_warning(f"Archivo PRN faltante registrado: {color} ({variante}) - {tipo_material}")
+        mensaje = f"[{timestamp}] ARCHIVO PRN FALTANTE: {color} ({variante}) - {tipo_material}"
 
-        # Aquí se podría agregar envío de email, webhook, etc.
-        # enviar_notificacion_email(mensaje)
-        # enviar_webhook_notificacion(mensaje)
+        if bandeja_notificaciones.registrar((color, variante, tipo_material), mensaje):
+            log_warning(f"Archivo PRN faltante registrado: {color} ({variante}) - {tipo_material}")
 
     except Exception as e:
         log_error("Error al registrar notificación PRN", e)
 
 def obtener_notificaciones_pendientes() -> List[str]:
-    """Obtiene las notificaciones pendientes."""
+    """Obtiene las últimas 10 notificaciones."""
     try:
-        if not os.path.exists(ARCHIVO_NOTIFICACIONES):
-            return []
-
-        with open(ARCHIVO_NOTIFICACIONES, 'r', encoding='utf-8') as f:
-            lineas = f.readlines()
-
-        # Retornar las últimas 10 notificaciones
-        return [linea.strip() for linea in lineas[-10:]]
+        return bandeja_notificaciones.ultimas(10)
     except Exception as e:
         log_error("Error al leer notificaciones", e)
         return []
 
+# ============================================================================
+# MÉTRICAS Y SALUD DEL SERVICIO
+# ============================================================================
+
+BUCKETS_LATENCIA = (0.001, 0.005, 0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 300, 900)
+
+class MetricasServicio:
+    """
+    Contadores, histogramas y gauges en memoria, expuestos en formato de texto de Prometheus.
+    Registrar una observación cuesta un lock y una búsqueda binaria.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._ayudas: Dict[str, tuple] = {}  # nombre -> (tipo, ayuda)
+        self._contadores: Dict[tuple, float] = {}
+        self._histogramas: Dict[tuple, list] = {}  # clave -> [conteos por bucket, suma, total]
+        self._gauges: Dict[str, object] = {}  # nombre -> función sin argumentos
+        self._etiquetas_recientes = deque()  # momentos de las etiquetas del último minuto
+
+    @staticmethod
+    def _clave(nombre: str, etiquetas: Optional[Dict]) -> tuple:
+        return (nombre, tuple(sorted((etiquetas or {}).items())))
+
+    def describir(self, nombre: str, tipo: str, ayuda: str):
+        self._ayudas[nombre] = (tipo, ayuda)
+
+    def incrementar(self, nombre: str, etiquetas: Optional[Dict] = None, valor: float = 1):
+        clave = self._clave(nombre, etiquetas)
+        with self._lock:
+            self._contadores[clave] = self._contadores.get(clave, 0) + valor
+
+    def observar(self, nombre: str, valor: float, etiquetas: Optional[Dict] = None):
+        clave = self._clave(nombre, etiquetas)
+        with self._lock:
+            histograma = self._histogramas.get(clave)
+            if histograma is None:
+                histograma = self._histogramas[clave] = [[0] * len(BUCKETS_LATENCIA), 0.0, 0]
+            indice = bisect.bisect_left(BUCKETS_LATENCIA, valor)
+            if indice < len(BUCKETS_LATENCIA):
+                histograma[0][indice] += 1
+            histograma[1] += valor
+            histograma[2] += 1
+
+    def gauge(self, nombre: str, ayuda: str, funcion):
+        """Registra un gauge que se calcula al momento de exponer las métricas."""
+        self.describir(nombre, "gauge", ayuda)
+        self._gauges[nombre] = funcion
+
+    def registrar_etiqueta_impresa(self, nombre_impresora: str):
+        self.incrementar("gst3d_etiquetas_impresas_total", {"impresora": nombre_impresora})
+        ahora = time.monotonic()
+        with self._lock:
+            self._etiquetas_recientes.append(ahora)
+            while self._etiquetas_recientes and ahora - self._etiquetas_recientes[0] > 60:
+                self._etiquetas_recientes.popleft()
+
+    def etiquetas_por_minuto(self) -> int:
+        ahora = time.monotonic()
+        with self._lock:
+            while self._etiquetas_recientes and ahora - self._etiquetas_recientes[0] > 60:
+                self._etiquetas_recientes.popleft()
+            return len(self._etiquetas_recientes)
+
+    @staticmethod
+    def _formatear_etiquetas(etiquetas: tuple, extra: Optional[tuple] = None) -> str:
+        pares = list(etiquetas) + ([extra] if extra else [])
+        if not pares:
+            return ""
+        return "{" + ",".join(f'{k}="{v}"' for k, v in pares) + "}"
+
+    def exponer(self) -> str:
+        """Genera el texto de /metrics."""
+        lineas = []
+        descritos = set()
+        
+        def encabezado(nombre: str):
+            if nombre in descritos or nombre not in self._ayudas:
+                return
+            tipo, ayuda = self._ayudas[nombre]
+            lineas.append(f"# HELP {nombre} {ayuda}")
+            lineas.append(f"# TYPE {nombre} {tipo}")
+            descritos.add(nombre)
+        
+        with self._lock:
+            contadores = sorted(self._contadores.items())
+            histogramas = sorted((clave, (list(h[0]), h[1], h[2])) for clave, h in self._histogramas.items())
+        
+        for (nombre, etiquetas), valor in contadores:
+            encabezado(nombre)
+            lineas.append(f"{nombre}{self._formatear_etiquetas(etiquetas)} {valor}")
+        
+        for (nombre, etiquetas), (buckets, suma, total) in histogramas:
+            encabezado(nombre)
+            acumulado = 0
+            for limite, cantidad in zip(BUCKETS_LATENCIA, buckets):
+                acumulado += cantidad
+                lineas.append(f"{nombre}_bucket{self._formatear_etiquetas(etiquetas, ('le', limite))} {acumulado}")
+            lineas.append(f"{nombre}_bucket{self._formatear_etiquetas(etiquetas, ('le', '+Inf'))} {total}")
+            lineas.append(f"{nombre}_sum{self._formatear_etiquetas(etiquetas)} {suma}")
+            lineas.append(f"{nombre}_count{self._formatear_etiquetas(etiquetas)} {total}")
+        
+        for nombre, funcion in sorted(self._gauges.items()):
+            try:
+                valor = funcion()
+            except Exception:
+                continue
+            encabezado(nombre)
+            lineas.append(f"{nombre} {valor}")
+        
+        return "\n".join(lineas) + "\n"
+
+metricas = MetricasServicio()
+metricas.describir("gst3d_latencia_cola_segundos", "histogram", "Desde que se creó la impresión hasta que terminó de imprimirse")
+metricas.describir("gst3d_renderizado_segundos", "histogram", "Tiempo de renderizado de una etiqueta")
+metricas.describir("gst3d_transporte_segundos", "histogram", "Tiempo de envío de una etiqueta a la impresora, con reintentos")
+metricas.describir("gst3d_etiquetas_impresas_total", "counter", "Etiquetas aceptadas por la impresora")
+metricas.describir("gst3d_reintentos_impresion_total", "counter", "Reintentos de envío a la impresora")
+metricas.describir("gst3d_errores_impresion_total", "counter", "Etiquetas que fallaron todos los reintentos")
+metricas.gauge("gst3d_etiquetas_por_minuto", "Etiquetas impresas en los últimos 60 segundos", metricas.etiquetas_por_minuto)
+metricas.gauge("gst3d_supabase_conectado", "1 si la última verificación de Supabase fue exitosa",
+               lambda: int(supabase_conectado))
+metricas.gauge("gst3d_cupo_horario_restante", "Etiquetas que todavía se pueden imprimir en la hora actual",
+               lambda: max(0, LIMITE_ETIQUETAS_POR_HORA - etiquetas_impresas_en_hora))
+metricas.gauge("gst3d_segundos_desde_heartbeat", "Segundos desde el último heartbeat",
+               lambda: round((datetime.now() - ultimo_heartbeat).total_seconds(), 1))
+
+def observar_latencia_cola(impresion: Dict):
+    """Registra cuánto tardó una impresión desde su creación hasta terminar."""
+    timestamp = impresion.get('timestamp')
+    if isinstance(timestamp, (int, float)):
+        metricas.observar("gst3d_latencia_cola_segundos", max(0.0, time.time() - timestamp / 1000))
+
+def estado_salud() -> tuple:
+    """
+    Liveness: el heartbeat es reciente.
+    Returns: (vivo, detalle)
+    """
+    segundos = (datetime.now() - ultimo_heartbeat).total_seconds()
+    vivo = segundos < 3 * max(INTERVALO_HEARTBEAT, INTERVALO_POLLING_MAXIMO)
+    return vivo, {"heartbeat_hace_segundos": round(segundos, 1)}
+
+def estado_listo() -> tuple:
+    """
+    Readiness: hay conexión con Supabase y existe la carpeta de plantillas.
+    Returns: (listo, detalle)
+    """
+    detalle = {"supabase": supabase_conectado, "plantillas": os.path.isdir(RUTA_PRN)}
+    return all(detalle.values()), detalle
+
+class ManejadorHTTPServicio(BaseHTTPRequestHandler):
+    """
+    Rutas: /metrics, /healthz (liveness), /readyz (readiness).
+    Administración (solo desde localhost): POST /admin/perfil/cpu?segundos=N y POST /admin/perfil/memoria.
+    Envío directo desde el dashboard (con ENVIO_LAN_ACTIVO, desde su origen y con token de sesión): POST /impresiones.
+    """
+
+    def _responder(self, codigo: int, cuerpo: str, tipo: str = "application/json"):
+        datos = cuerpo.encode('utf-8')
+        self.send_response(codigo)
+        self.send_header("Content-Type", f"{tipo}; charset=utf-8")
+        self.send_header("Content-Length", str(len(datos)))
+        self._cabeceras_cors()
+        self.end_headers()
+        self.wfile.write(datos)
+
+    def do_GET(self):
+        ruta = self.path.split("?", 1)[0]
+        if ruta == "/metrics":
+            self._responder(200, metricas.exponer(), "text/plain; version=0.0.4")
+        elif ruta in ("/healthz", "/readyz"):
+            ok, detalle = estado_salud() if ruta == "/healthz" else estado_listo()
+            self._responder(200 if ok else 503, json.dumps(dict(detalle, ok=ok)))
+        else:
+            self._responder(404, json.dumps({"error": "ruta desconocida"}))
+
+    def _cabeceras_cors(self):
+        if ENVIO_LAN_ACTIVO and ORIGEN_PERMITIDO_LAN and self.path.split("?", 1)[0] == "/impresiones":
+            self.send_header("Access-Control-Allow-Origin", ORIGEN_PERMITIDO_LAN)
+            self.send_header("Vary", "Origin")
+            self.send_header("Access-Control-Allow-Headers", "Authorization, Content-Type")
+            self.send_header("Access-Control-Allow-Methods", "POST, OPTIONS")
+
+    def do_OPTIONS(self):
+        self.send_response(204 if ENVIO_LAN_ACTIVO and self.path.split("?", 1)[0] == "/impresiones" else 404)
+        self.send_header("Content-Length", "0")
+        self._cabeceras_cors()
+        self.end_headers()
+
+    def _recibir_impresion_directa(self):
+        if not ENVIO_LAN_ACTIVO:
+            self._responder(404, json.dumps({"error": "ruta desconocida"}))
+            return
+        if not ORIGEN_PERMITIDO_LAN or self.headers.get("Origin") != ORIGEN_PERMITIDO_LAN:
+            self._responder(403, json.dumps({"error": "origen no permitido"}))
+            return
+        if not token_lan_valido(self.headers.get("Authorization")):
+            self._responder(401, json.dumps({"error": "no autorizado"}))
+            return
+        try:
+            largo = int(self.headers.get("Content-Length") or 0)
+        except ValueError:
+            largo = -1
+        if not 0 < largo <= MAX_BYTES_PEDIDO_LAN:
+            self._responder(400, json.dumps({"error": "cuerpo inválido"}))
+            return
+        try:
+            codigo, respuesta = atender_impresion_directa(json.loads(self.rfile.read(largo)))
+        except ValueError as e:
+            codigo, respuesta = 400, {"ok": False, "error": str(e)}
+        self._responder(codigo, json.dumps(respuesta, ensure_ascii=False))
+
+    def do_POST(self):
+        ruta, _, parametros = self.path.partition("?")
+        if ruta == "/impresiones":
+            self._recibir_impresion_directa()
+            return
+        
+        try:
+            local = ipaddress.ip_address(self.client_address[0]).is_loopback
+        except ValueError:
+            local = False
+        if not local:
+            self._responder(403, json.dumps({"error": "solo desde localhost"}))
+            return
+        
+        if ruta == "/admin/perfil/cpu":
+            valores = dict(p.split("=", 1) for p in parametros.split("&") if "=" in p)
+            try:
+                segundos = float(valores.get("segundos", DURACION_PERFIL_CPU))
+            except ValueError:
+                self._responder(400, json.dumps({"error": "segundos inválido"}))
+                return
+            if perfilador.perfil_cpu(segundos):
+                self._responder(202, json.dumps({"directorio": perfilador.directorio, "segundos": segundos}))
+            else:
+                self._responder(409, json.dumps({"error": "ya hay un perfil de CPU en curso"}))
+        elif ruta == "/admin/perfil/memoria":
+            reporte = perfilador.instantanea_memoria()
+            self._responder(200, json.dumps({"reporte": reporte, "tracemalloc_activado": reporte is None}))
+        else:
+            self._responder(404, json.dumps({"error": "ruta desconocida"}))
+
+    def log_message(self, formato, *args):
+        # Las consultas de Prometheus no se registran en el log del servicio
+        pass
+
+def host_servidor_metricas() -> str:
+    """Returns: la interfaz del servidor HTTP; solo se publica en la red si se pidió explícitamente."""
+    return HOST_METRICAS_RED if (ENVIO_LAN_ACTIVO or METRICAS_EN_RED) else HOST_METRICAS
+
+def iniciar_servidor_metricas():
+    """Levanta el endpoint HTTP de métricas y salud en un hilo propio."""
+    host = host_servidor_metricas()
+    try:
+        servidor = ThreadingHTTPServer((host, PUERTO_METRICAS), ManejadorHTTPServicio)
+    except OSError as e:
+        log_error(f"No se pudo abrir el puerto de métricas {PUERTO_METRICAS}", e)
+        return None
+    servidor.daemon_threads = True
+    threading.Thread(target=servidor.serve_forever, name="metricas", daemon=True).start()
+    log_info(f"📈 Métricas en http://{host}:{PUERTO_METRICAS}/metrics")
+    return servidor
+
+# ============================================================================
+# TRAZAS POR TRABAJO
+# ============================================================================
+# Cada trabajo muestreado genera un span raíz y spans hijos por etapa. Los tiempos
+# salen del reloj monotónico (convertidos a epoch con un desfase fijo) y se escriben
+# en lote, un span por línea, con nombres de campos al estilo OTLP.
+# Si el trabajo no se muestrea, todas las llamadas devuelven _SPAN_NULO y no hacen nada.
+
+_DESFASE_EPOCH_NS = time.time_ns() - time.monotonic_ns()
+_contexto_trazas = threading.local()
+
+def _pila_spans() -> list:
+    pila = getattr(_contexto_trazas, "pila", None)
+    if pila is None:
+        pila = _contexto_trazas.pila = []
+    return pila
+
+class _SpanNulo:
+    """Span que no registra nada (trabajo no muestreado)."""
+    muestreado = False
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, tipo, valor, tb):
+        return False
+
+    def hijo(self, nombre: str, **atributos):
+        return self
+
+    def agregar_atributos(self, **atributos):
+        pass
+
+    def terminar(self, error: Optional[str] = None, **atributos):
+        pass
+
+_SPAN_NULO = _SpanNulo()
+
+class Span:
+    """Intervalo de tiempo de una etapa. Se usa con `with` o se cierra con terminar()."""
+    muestreado = True
+    __slots__ = ("trace_id", "span_id", "padre_id", "nombre", "inicio_ns", "atributos", "_terminado")
+
+    def __init__(self, trace_id: str, padre_id: Optional[str], nombre: str, atributos: Dict):
+        self.trace_id = trace_id
+        self.span_id = uuid.uuid4().hex[:16]
+        self.padre_id = padre_id
+        self.nombre = nombre
+        self.atributos = atributos
+        self.inicio_ns = time.monotonic_ns()
+        self._terminado = False
+
+    def __enter__(self):
+        _pila_spans().append(self)
+        return self
+
+    def __exit__(self, tipo, valor, tb):
+        pila = _pila_spans()
+        if pila and pila[-1] is self:
+            pila.pop()
+        self.terminar(error=repr(valor) if valor is not None else None)
+        return False
+
+    def hijo(self, nombre: str, **atributos) -> "Span":
+        return Span(self.trace_id, self.span_id, nombre, atributos)
+
+    def agregar_atributos(self, **atributos):
+        self.atributos.update(atributos)
+
+    def terminar(self, error: Optional[str] = None, **atributos):
+        if self._terminado:
+            return
+        self._terminado = True
+        fin_ns = time.monotonic_ns()
+        self.atributos.update(atributos)
+        exportador_trazas.agregar({
+            "trace_id": self.trace_id,
+            "span_id": self.span_id,
+            "parent_span_id": self.padre_id,
+            "name": self.nombre,
+            "start_time_unix_nano": self.inicio_ns + _DESFASE_EPOCH_NS,
+            "end_time_unix_nano": fin_ns + _DESFASE_EPOCH_NS,
+            "duracion_ms": round((fin_ns - self.inicio_ns) / 1e6, 3),
+            "attributes": self.atributos,
+            "status": {"code": "ERROR", "message": error} if error else {"code": "OK"},
+        })
+
+def iniciar_traza(nombre: str, **atributos):
+    """
+    Abre el span raíz de un trabajo si sale sorteado en el muestreo.
+    Returns: Span, o _SPAN_NULO si el trabajo no se traza
+    """
+    if not TRAZAS_ACTIVAS or random.random() >= MUESTREO_TRAZAS:
+        return _SPAN_NULO
+    return Span(uuid.uuid4().hex, None, nombre, atributos)
+
+def abrir_span(nombre: str, **atributos):
+    """Abre un span hijo del span activo en este hilo (o _SPAN_NULO si no hay traza)."""
+    pila = getattr(_contexto_trazas, "pila", None)
+    if not pila:
+        return _SPAN_NULO
+    return pila[-1].hijo(nombre, **atributos)
+
+def span_activo():
+    """Span activo en este hilo, para pasarlo a otro hilo."""
+    pila = getattr(_contexto_trazas, "pila", None)
+    return pila[-1] if pila else _SPAN_NULO
+
+@contextlib.contextmanager
+def activar_span(span):
+    """Hace que `span` sea el activo en este hilo sin cerrarlo al salir (para executors)."""
+    if not span.muestreado:
+        yield span
+        return
+    pila = _pila_spans()
+    pila.append(span)
+    try:
+        yield span
+    finally:
+        if pila and pila[-1] is span:
+            pila.pop()
+
+def ejecutar_con_span(span, funcion, *args):
+    """Ejecuta `funcion` con `span` como span activo (para llamadas que corren en un executor)."""
+    with activar_span(span):
+        return funcion(*args)
+
+class ExportadorTrazas:
+    """Acumula spans terminados y los escribe en lote en un JSONL que rota por tamaño."""
+
+    def __init__(self, ruta: str = ARCHIVO_TRAZAS, max_bytes: int = MAX_BYTES_ARCHIVO_TRAZAS,
+                 conservados: int = ARCHIVOS_TRAZAS_CONSERVADOS,
+                 intervalo: float = INTERVALO_ESCRITURA_TRAZAS):
+        self.ruta = ruta
+        self.max_bytes = max_bytes
+        self.conservados = conservados
+        self.intervalo = intervalo
+        self._lock = threading.Lock()
+        self._pendientes: List[Dict] = []
+        self.descartados = 0
+        self._hilo = None
+
+    def agregar(self, registro: Dict):
+        with self._lock:
+            if len(self._pendientes) >= MAX_SPANS_EN_MEMORIA:
+                self.descartados += 1
+                return
+            self._pendientes.append(registro)
+
+    def _rotar_si_corresponde(self):
+        try:
+            if os.path.getsize(self.ruta) < self.max_bytes:
+                return
+        except OSError:
+            return
+        for i in range(self.conservados - 1, 0, -1):
+            if os.path.exists(f"{self.ruta}.{i}"):
+                os.replace(f"{self.ruta}.{i}", f"{self.ruta}.{i + 1}")
+        os.replace(self.ruta, f"{self.ruta}.1")
+
+    def escribir_pendientes(self):
+        with self._lock:
+            lote, self._pendientes = self._pendientes, []
+        if not lote:
+            return
+        try:
+            self._rotar_si_corresponde()
+            with open(self.ruta, "a", encoding='utf-8') as f:
+                f.write("".join(json.dumps(registro, ensure_ascii=False) + "\n" for registro in lote))
+        except Exception as e:
+            log_error(f"Error al escribir {len(lote)} span(s) de trazas", e)
+
+    def _bucle(self):
+        while True:
+            time.sleep(self.intervalo)
+            self.escribir_pendientes()
+
+    def iniciar(self):
+        if self._hilo is None:
+            self._hilo = threading.Thread(target=self._bucle, name="trazas", daemon=True)
+            self._hilo.start()
+            atexit.register(self.escribir_pendientes)
+
+exportador_trazas = ExportadorTrazas()
+
+# ============================================================================
+# PERFILADO BAJO DEMANDA
+# ============================================================================
+
+class Perfilador:
+    """
+    Perfilado del servicio en producción, sin reiniciarlo.
+    - CPU: muestrea las pilas de todos los hilos durante una ventana y pesa cada muestra por el
+      tiempo de CPU que usó ese hilo desde la anterior (los hilos esperando no suman); guarda
+      pilas colapsadas (.folded, para flamegraph.pl/speedscope) y un .pstats
+    - Memoria: instantáneas de tracemalloc con diferencia contra la anterior
+    """
+
+    def __init__(self, directorio: str = DIRECTORIO_PERFILES):
+        self.directorio = directorio
+        self._lock_cpu = threading.Lock()
+        self._instantanea_anterior = None
+        self._lock_memoria = threading.Lock()
+
+    def _ruta(self, prefijo: str, extension: str) -> str:
+        os.makedirs(self.directorio, exist_ok=True)
+        return os.path.join(self.directorio, f"{prefijo}_{datetime.now().strftime('%Y%m%d_%H%M%S')}.{extension}")
+
+    def perfil_cpu(self, segundos: float = DURACION_PERFIL_CPU) -> bool:
+        """
+        Inicia una captura de CPU en segundo plano.
+        Returns: False si ya hay una captura en curso
+        """
+        if not self._lock_cpu.acquire(blocking=False):
+            return False
+        segundos = max(1, min(float(segundos), MAX_DURACION_PERFIL_CPU))
+        threading.Thread(target=self._capturar_cpu, args=(segundos,), name="perfil-cpu", daemon=True).start()
+        return True
+
+    @staticmethod
+    def _cpu_hilo_us(ident: int) -> Optional[int]:
+        """Returns: Tiempo de CPU consumido por el hilo (microsegundos), o None si no se puede medir."""
+        try:
+            return time.clock_gettime_ns(time.pthread_getcpuclockid(ident)) // 1000
+        except (AttributeError, OSError, OverflowError):
+            return None
+
+    def _capturar_cpu(self, segundos: float):
+        try:
+            log_info(f"🔬 Perfil de CPU: muestreando {segundos:.0f} segundos...")
+            # pila -> [muestras, peso]; el peso son microsegundos de CPU con reloj por hilo, si no muestras
+            pilas: Dict[tuple, list] = {}
+            propio = threading.get_ident()
+            por_cpu = self._cpu_hilo_us(propio) is not None
+            cpu_anterior: Dict[int, int] = {}
+            nombres = {}
+            fin = time.monotonic() + segundos
+            muestras = 0
+            while time.monotonic() < fin:
+                for hilo in threading.enumerate():
+                    nombres[hilo.ident] = hilo.name
+                for ident, cuadro in sys._current_frames().items():
+                    if ident == propio:
+                        continue
+                    if por_cpu:
+                        cpu = self._cpu_hilo_us(ident)
+                        anterior = cpu_anterior.get(ident)
+                        if cpu is None:
+                            continue
+                        cpu_anterior[ident] = cpu
+                        if anterior is None or cpu <= anterior:
+                            continue  # Primera lectura del hilo, o estuvo esperando
+                        peso = cpu - anterior
+                    else:
+                        codigo = cuadro.f_code
+                        if (os.path.basename(codigo.co_filename), codigo.co_name) in FUNCIONES_DE_ESPERA:
+                            continue
+                        peso = 1
+                    pila = []
+                    while cuadro is not None:
+                        codigo = cuadro.f_code
+                        pila.append((codigo.co_filename, codigo.co_firstlineno, codigo.co_name))
+                        cuadro = cuadro.f_back
+                    pila.reverse()
+                    clave = (nombres.get(ident, str(ident)),) + tuple(pila)
+                    acumulado = pilas.setdefault(clave, [0, 0])
+                    acumulado[0] += 1
+                    acumulado[1] += peso
+                muestras += 1
+                time.sleep(INTERVALO_MUESTREO_CPU)
+            
+            # Sin reloj por hilo es tiempo de pared (menos las esperas reconocibles): se nombra distinto
+            prefijo = "cpu" if por_cpu else "pared"
+            if not por_cpu:
+                log_warning("Sin reloj de CPU por hilo: el perfil es de tiempo de pared (se descartan solo las esperas reconocibles)")
+            ruta_folded = self._ruta(prefijo, "folded")
+            self._escribir_pilas_colapsadas(ruta_folded, pilas)
+            ruta_pstats = self._ruta(prefijo, "pstats")
+            self._escribir_pstats(ruta_pstats, pilas, 1e-6 if por_cpu else segundos / max(muestras, 1))
+            unidad = f"{sum(peso for _, peso in pilas.values()) / 1e6:.2f} s de CPU" if por_cpu else "sin reloj de CPU por hilo, esperas descartadas"
+            log_success(f"Perfil de CPU ({muestras} muestras, {unidad}): {ruta_folded} y {ruta_pstats}")
+        except Exception as e:
+            log_error("Error durante el perfil de CPU", e)
+        finally:
+            self._lock_cpu.release()
+
+    @staticmethod
+    def _escribir_pilas_colapsadas(ruta: str, pilas: Dict[tuple, list]):
+        """Formato de pilas colapsadas: `hilo;func (archivo:línea);... peso`."""
+        with open(ruta, "w", encoding='utf-8') as f:
+            for (hilo, *cuadros), (_, cantidad) in sorted(pilas.items(), key=lambda item: -item[1][1]):
+                nombres = [hilo] + [f"{nombre} ({os.path.basename(archivo)}:{linea})" for archivo, linea, nombre in cuadros]
+                f.write(";".join(n.replace(";", ":") for n in nombres) + f" {cantidad}\n")
+
+    @staticmethod
+    def _escribir_pstats(ruta: str, pilas: Dict[tuple, list], segundos_por_peso: float):
+        """
+        Arma un archivo compatible con pstats a partir de las muestras:
+        tiempo propio = peso en el tope de la pila, acumulado = peso en cualquier nivel,
+        llamadas = muestras. `segundos_por_peso` convierte el peso (µs de CPU o muestras) a segundos.
+        """
+        propias: Dict[tuple, int] = {}
+        acumuladas: Dict[tuple, list] = {}
+        llamadores: Dict[tuple, Dict[tuple, list]] = {}
+        for (_, *cuadros), (muestras, peso) in pilas.items():
+            if not cuadros:
+                continue
+            propias[cuadros[-1]] = propias.get(cuadros[-1], 0) + peso
+            for funcion in set(cuadros):
+                total = acumuladas.setdefault(funcion, [0, 0])
+                total[0] += muestras
+                total[1] += peso
+            for llamador, llamada in set(zip(cuadros, cuadros[1:])):
+                total = llamadores.setdefault(llamada, {}).setdefault(llamador, [0, 0])
+                total[0] += muestras
+                total[1] += peso
+        
+        estadisticas = {}
+        for funcion, (muestras, acumulado) in acumuladas.items():
+            propio = propias.get(funcion, 0)
+            estadisticas[funcion] = (
+                muestras, muestras,
+                propio * segundos_por_peso, acumulado * segundos_por_peso,
+                {llamador: (n, n, 0.0, peso * segundos_por_peso)
+                 for llamador, (n, peso) in llamadores.get(funcion, {}).items()},
+            )
+        with open(ruta, "wb") as f:
+            marshal.dump(estadisticas, f)
+
+    @staticmethod
+    def _tomar_instantanea():
+        return tracemalloc.take_snapshot().filter_traces((
+            tracemalloc.Filter(False, tracemalloc.__file__),
+            tracemalloc.Filter(False, "<frozen importlib._bootstrap>"),
+        ))
+
+    def instantanea_memoria(self) -> Optional[str]:
+        """
+        Toma una instantánea de tracemalloc y la compara con la anterior.
+        La primera llamada solo activa tracemalloc (todavía no hay con qué comparar).
+        Returns: Ruta del reporte, o None si recién se activó el rastreo
+        """
+        with self._lock_memoria:
+            if not tracemalloc.is_tracing():
+                tracemalloc.start(CUADROS_TRACEMALLOC)
+                self._instantanea_anterior = self._tomar_instantanea()
+                log_info(f"🔬 tracemalloc activado ({CUADROS_TRACEMALLOC} cuadros). La próxima instantánea mostrará la diferencia")
+                return None
+            
+            instantanea = self._tomar_instantanea()
+            ruta_instantanea = self._ruta("memoria", "tracemalloc")
+            instantanea.dump(ruta_instantanea)
+            
+            actual, pico = tracemalloc.get_traced_memory()
+            diferencias = instantanea.compare_to(self._instantanea_anterior, 'lineno')
+            ruta_reporte = self._ruta("memoria", "txt")
+            with open(ruta_reporte, "w", encoding='utf-8') as f:
+                f.write(f"Memoria rastreada: {actual / 1024:.1f} KiB (pico {pico / 1024:.1f} KiB)\n")
+                f.write(f"Instantánea completa: {ruta_instantanea}\n\n")
+                f.write("Diferencia contra la instantánea anterior (por línea):\n")
+                for diferencia in diferencias[:50]:
+                    f.write(f"{diferencia}\n")
+                f.write("\nMayores asignaciones actuales (por línea):\n")
+                for estadistica in instantanea.statistics('lineno')[:50]:
+                    f.write(f"{estadistica}\n")
+            self._instantanea_anterior = instantanea
+            
+            log_success(f"Instantánea de memoria: {ruta_reporte}")
+            for diferencia in diferencias[:5]:
+                log_info(f"   {diferencia}")
+            return ruta_reporte
+
+perfilador = Perfilador()
+
+def registrar_senales_perfilado():
+    """SIGUSR1 inicia un perfil de CPU y SIGUSR2 toma una instantánea de memoria."""
+    if not hasattr(signal, "SIGUSR1"):
+        return
+    signal.signal(signal.SIGUSR1, lambda *_: perfilador.perfil_cpu())
+    signal.signal(signal.SIGUSR2, lambda *_: threading.Thread(
+        target=perfilador.instantanea_memoria, name="perfil-memoria", daemon=True
+    ).start())
+
 # ============================================================================
 # FUNCIONES AUXILIARES ROBUSTAS
 # ============================================================================
@@ -183,6 +1088,14 @@ def guardar_log_local(datos: dict):
     except Exception as e:
         log_error("Error al guardar log local", e)
 
+def guardar_json_atomico(ruta: str, datos):
+    """Guarda un JSON reemplazando el archivo de forma atómica (nunca queda a medio escribir)."""
+    os.makedirs(os.path.dirname(ruta), exist_ok=True)
+    ruta_temporal = f"{ruta}.tmp"
+    with open(ruta_temporal, "w", encoding='utf-8') as f:
+        json.dump(datos, f, ensure_ascii=False)
+    os.replace(ruta_temporal, ruta)
+
 def obtener_nombre_archivo_prn(color: str, es_grande: bool) -> str:
     """
     Obtiene el nombre del archivo .prn basado en el color.
@@ -217,210 +1130,824 @@ def obtener_nombre_archivo_prn(color: str, es_grande: bool) -> str:
         log_error(f"Error al obtener nombre archivo PRN para {color}", e)
         return color.replace("_GRANDE", "")
 
-def verificar_archivos_prn_faltantes():
+# ============================================================================
+# VERIFICACIÓN DE COBERTURA DE ARCHIVOS PRN (EN SEGUNDO PLANO)
+# ============================================================================
+
+class VerificadorCoberturaPRN:
     """
-    Verifica si faltan archivos PRN para colores existentes en la base de datos
-    y notifica si es necesario.
+    Compara los colores de `colores_personalizados` (menos los de `colores_eliminados`)
+    contra los archivos .prn de RUTA_PRN en un hilo propio, sin frenar la impresión.
+    - Los colores se vuelven a descargar solo si cambió el `updated_at` de alguna de las dos filas
+    - El directorio se indexa en memoria y se reindexa solo si cambió su mtime
+    - Solo se reportan los faltantes nuevos y los que se resolvieron
     """
-    try:
-        # Obtener colores de Supabase
-        colores_response = supabase_client.table('colores_personalizados').select('colores_data').eq('id', 'colores_global').single()
-        colores_eliminados_response = supabase_client.table('colores_eliminados').select('eliminados_data').eq('id', 'eliminados_global').single()
-
-        colores_faltantes = []
-
-        if colores_response.data and colores_response.data.get('colores_data'):
-            colores_data = colores_response.data['colores_data']
-
-            for tipo_material, colores_tipo in colores_data.items():
-                # Verificar colores chicos
-                if 'chica' in colores_tipo:
-                    for color in colores_tipo['chica'].keys():
-                        nombre_archivo = obtener_nombre_archivo_prn(color, False)
-                        ruta = os.path.join(RUTA_PRN, f"{nombre_archivo}.prn")
-                        if not os.path.exists(ruta):
-                            colores_faltantes.append(f"{color} (chica) - {tipo_material}")
-
-                # Verificar colores grandes
-                if 'grande' in colores_tipo:
-                    for color in colores_tipo['grande'].keys():
-                        nombre_archivo = obtener_nombre_archivo_prn(color, True)
-                        ruta = os.path.join(RUTA_PRN, f"{nombre_archivo}.prn")
-                        if not os.path.exists(ruta):
-                            colores_faltantes.append(f"{color.replace('_GRANDE', '')} (grande) - {tipo_material}")
-
-        if colores_faltantes:
+
+    # (tabla, id de la fila, columna con los datos)
+    FILAS_COLORES = (
+        ('colores_personalizados', 'colores_global', 'colores_data'),
+        ('colores_eliminados', 'eliminados_global', 'eliminados_data'),
+    )
+
+    def __init__(self, intervalo: float = INTERVALO_VERIFICACION_PRN):
+        self.intervalo = intervalo
+        self.colores_data: Dict = {}
+        self.eliminados_data: Dict = {}
+        self.versiones_colores: Optional[Dict] = None
+        self.indice_prn: set = set()
+        self.mtime_directorio: Optional[int] = -1  # -1: todavía sin indexar
+        self.faltantes: set = set()
+        self._lock = threading.Lock()
+        self._hilo: Optional[threading.Thread] = None
+
+    def _actualizar_colores(self) -> bool:
+        """Descarga los colores y los eliminados si cambiaron. Returns: True si hubo cambios."""
+        versiones = {}
+        for tabla, fila_id, _ in self.FILAS_COLORES:
+            response = supabase_client.table(tabla)\
+                .select('updated_at').eq('id', fila_id).limit(1).execute()
+            versiones[tabla] = response.data[0].get('updated_at') if response.data else None
+        if versiones == self.versiones_colores and all(versiones.values()):
+            return False
+        
+        datos = {}
+        for tabla, fila_id, columna in self.FILAS_COLORES:
+            response = supabase_client.table(tabla)\
+                .select(f'{columna},updated_at').eq('id', fila_id).limit(1).execute()
+            fila = response.data[0] if response.data else {}
+            datos[tabla] = fila.get(columna) or {}
+            versiones[tabla] = fila.get('updated_at')
+        self.colores_data = datos['colores_personalizados']
+        self.eliminados_data = datos['colores_eliminados']
+        self.versiones_colores = versiones
+        return True
+
+    def _actualizar_indice(self) -> bool:
+        """Reindexa RUTA_PRN si cambió el directorio. Returns: True si hubo cambios."""
+        try:
+            mtime = os.stat(RUTA_PRN).st_mtime_ns
+        except FileNotFoundError:
+            mtime = None
+        if mtime == self.mtime_directorio:
+            return False
+        
+        indice = set()
+        if mtime is not None:
+            with os.scandir(RUTA_PRN) as entradas:
+                for entrada in entradas:
+                    if entrada.name.endswith('.prn'):
+                        indice.add(entrada.name[:-4])
+        self.indice_prn = indice
+        self.mtime_directorio = mtime
+        return True
+
+    def _tiene_plantilla(self, color: str, es_grande: bool) -> bool:
+        """Misma búsqueda que obtener_nombre_archivo_prn(), pero contra el índice en memoria."""
+        color_sin_sufijo = color.replace("_GRANDE", "")
+        if es_grande:
+            posibles_nombres = (f"{color_sin_sufijo}_GRANDE", color_sin_sufijo, color)
+        else:
+            posibles_nombres = (color_sin_sufijo, color)
+        return any(nombre in self.indice_prn for nombre in posibles_nombres)
+
+    def _calcular_faltantes(self) -> set:
+        faltantes = set()
+        for tipo_material, colores_tipo in self.colores_data.items():
+            # Igual que combinar_catalogo() en etiquetas.py: los eliminados desde la web no cuentan
+            eliminados = set((self.eliminados_data.get(tipo_material) or {}).get('chica') or [])
+            for color in (colores_tipo.get('chica') or {}):
+                if color in eliminados:
+                    continue
+                if not self._tiene_plantilla(color, False):
+                    faltantes.add((color, False, tipo_material))
+            for color in (colores_tipo.get('grande') or {}):
+                if color.replace('_GRANDE', '') in eliminados:
+                    continue
+                if not self._tiene_plantilla(color, True):
+                    faltantes.add((color.replace('_GRANDE', ''), True, tipo_material))
+        return faltantes
+
+    def verificar(self) -> tuple:
+        """
+        Ejecuta una verificación incremental.
+        Returns: (faltantes_nuevos, faltantes_resueltos)
+        """
+        with self._lock:
+            cambiaron_colores = self._actualizar_colores()
+            cambio_directorio = self._actualizar_indice()
+            if not cambiaron_colores and not cambio_directorio:
+                return set(), set()
+            
+            faltantes = self._calcular_faltantes()
+            nuevos = faltantes - self.faltantes
+            resueltos = self.faltantes - faltantes
+            self.faltantes = faltantes
+        
+        if nuevos:
             log_warning("ARCHIVOS PRN FALTANTES:")
-            for color_faltante in colores_faltantes:
-                log_warning(f"   ❌ {color_faltante}")
+            for color, es_grande, tipo_material in sorted(nuevos):
+                notificar_error_prn(color, es_grande, tipo_material)
             log_info("   💡 Estos colores se agregaron desde la web pero no tienen archivos PRN")
             log_info("   🔄 Se generarán automáticamente desde la aplicación web")
+        for color, es_grande, tipo_material in sorted(resueltos):
+            log_success(f"Archivo PRN disponible: {color} ({'grande' if es_grande else 'chica'}) - {tipo_material}")
+        return nuevos, resueltos
+
+    def _bucle(self):
+        while True:
+            try:
+                if supabase_client is not None:
+                    self.verificar()
+            except Exception as e:
+                log_error("Error verificando archivos PRN faltantes", e)
+            time.sleep(self.intervalo)
+
+    def iniciar(self):
+        """Arranca el hilo de verificación (la primera verificación es inmediata)."""
+        if self._hilo is None:
+            self._hilo = threading.Thread(target=self._bucle, name="verificador-prn", daemon=True)
+            self._hilo.start()
+
+verificador_prn = VerificadorCoberturaPRN()
+
+def verificar_archivos_prn_faltantes() -> List[str]:
+    """
+    Verifica si faltan archivos PRN para colores existentes en la base de datos.
+    Returns: Descripción de todos los faltantes conocidos
+    """
+    try:
+        verificador_prn.verificar()
+    except Exception as e:
+        log_error("Error verificando archivos PRN faltantes", e)
+    return [
+        f"{color} ({'grande' if es_grande else 'chica'}) - {tipo_material}"
+        for color, es_grande, tipo_material in sorted(verificador_prn.faltantes)
+    ]
+
+# ============================================================================
+# TRANSPORTE HACIA LA IMPRESORA
+# ============================================================================
+
+def _enviar_por_spooler(nombre_impresora: str, datos: bytes):
+    """Entrega los bytes ZPL a `lp` sin pasar por archivos temporales."""
+    if MODO_SPOOLER == "memfd" and hasattr(os, "memfd_create"):
+        fd = os.memfd_create("etiqueta_zpl")
+        try:
+            vista = memoryview(datos)
+            while vista:
+                escritos = os.write(fd, vista)
+                vista = vista[escritos:]
+            os.lseek(fd, 0, os.SEEK_SET)
+            subprocess.run(
+                ["lp", "-d", nombre_impresora],
+                stdin=fd,
+                check=True,
+                capture_output=True,
+                timeout=TIMEOUT_IMPRESION
+            )
+        finally:
+            os.close(fd)
+    else:
+        subprocess.run(
+            ["lp", "-d", nombre_impresora],
+            input=datos,
+            check=True,
+            capture_output=True,
+            timeout=TIMEOUT_IMPRESION
+        )
+
+def _enviar_por_socket(direccion: tuple, datos: bytes):
+    """Escribe los bytes ZPL directamente en el socket RAW de la impresora."""
+    with socket.create_connection(direccion, timeout=TIMEOUT_IMPRESION) as conexion:
+        conexion.sendall(datos)
+        conexion.shutdown(socket.SHUT_WR)
+
+def enviar_a_impresora(nombre_impresora: str, datos: bytes, reintentos: int = 3) -> bool:
+    """
+    Envía una etiqueta ya renderizada a la impresora con reintentos.
+    Usa el socket RAW si la impresora está en IMPRESORAS_RAW, si no el spooler de CUPS.
+    Returns: True si la impresora (o el spooler) aceptó los datos
+    """
+    direccion_raw = IMPRESORAS_RAW.get(nombre_impresora)
+    etiquetas_metrica = {"impresora": nombre_impresora}
+    inicio = time.monotonic()
+    for reintento in range(reintentos):
+        if reintento > 0:
+            metricas.incrementar("gst3d_reintentos_impresion_total", etiquetas_metrica)
+        try:
+            if direccion_raw:
+                _enviar_por_socket(direccion_raw, datos)
+            else:
+                _enviar_por_spooler(nombre_impresora, datos)
+            metricas.observar("gst3d_transporte_segundos", time.monotonic() - inicio, etiquetas_metrica)
+            return True
+        except subprocess.TimeoutExpired:
+            log_warning(f"Timeout al imprimir en {nombre_impresora} (reintento {reintento + 1}/{reintentos})")
+        except subprocess.CalledProcessError as e:
+            stderr = e.stderr.decode('utf-8', errors='replace') if isinstance(e.stderr, bytes) else e.stderr
+            log_error(f"Error al imprimir en {nombre_impresora} (reintento {reintento + 1}/{reintentos}): {stderr}", e)
+        except Exception as e:
+            log_error(f"Error inesperado al imprimir en {nombre_impresora} (reintento {reintento + 1}/{reintentos})", e)
+        if reintento < reintentos - 1:
+            time.sleep(2)
+    metricas.incrementar("gst3d_errores_impresion_total", etiquetas_metrica)
+    return False
+
+# ============================================================================
+# PIPELINE DE RENDERIZADO ADELANTADO
+# ============================================================================
+
+def _reiniciar_contador_horario_si_corresponde():
+    """Reinicia el contador horario si ya pasó una hora. Llamar con _lock_contadores tomado."""
+    global etiquetas_impresas_en_hora
+    global hora_de_inicio_del_contador
+    
+    if datetime.now() - hora_de_inicio_del_contador >= timedelta(hours=1):
+        etiquetas_impresas_en_hora = 0
+        hora_de_inicio_del_contador = datetime.now()
+        guardar_estado_horario()
+        log_info("Contador horario reiniciado")
+
+def reservar_cupo_horario() -> bool:
+    """Reserva una etiqueta del cupo horario. Returns: False si el límite ya se alcanzó."""
+    global etiquetas_impresas_en_hora
+    
+    with _lock_contadores:
+        _reiniciar_contador_horario_si_corresponde()
+        if etiquetas_impresas_en_hora >= LIMITE_ETIQUETAS_POR_HORA:
+            return False
+        etiquetas_impresas_en_hora += 1
+        return True
+
+def liberar_cupo_horario():
+    """Devuelve al cupo horario una etiqueta reservada que finalmente no se imprimió."""
+    global etiquetas_impresas_en_hora
+    
+    with _lock_contadores:
+        etiquetas_impresas_en_hora = max(0, etiquetas_impresas_en_hora - 1)
+
+def reservar_id_etiqueta() -> int:
+    """Reserva el siguiente ID único de etiqueta y lo persiste antes de usarlo."""
+    with _lock_contadores:
+        id_numero = leer_contador_id()
+        guardar_contador_id(id_numero + 1)
+        return id_numero
+
+def cargar_plantilla(ruta: str) -> Optional[str]:
+    """
+    Carga una plantilla ZPL usando un caché en memoria invalidado por mtime.
+    Returns: El contenido de la plantilla, o None si no existe o no se puede leer
+    """
+    try:
+        mtime = os.stat(ruta).st_mtime_ns
+    except FileNotFoundError:
+        return None
+    
+    en_cache = _cache_plantillas.get(ruta)
+    if en_cache and en_cache[0] == mtime:
+        return en_cache[1]
+    
+    if OPTIMIZAR_PLANTILLAS:
+        contenido = cargar_plantilla_optimizada(ruta, mtime)
+    else:
+        with open(ruta, 'r', encoding='utf-8') as f:
+            contenido = f.read()
+    _cache_plantillas[ruta] = (mtime, contenido)
+    return contenido
+
+def cargar_plantilla_optimizada(ruta: str, mtime: int) -> str:
+    """
+    Devuelve la forma optimizada de una plantilla, reutilizando la copia en disco
+    si es más nueva que el original. Si algo falla, devuelve el original.
+    """
+    ruta_optimizada = os.path.join(os.path.dirname(ruta), SUBCARPETA_PLANTILLAS_OPTIMIZADAS, os.path.basename(ruta))
+    try:
+        if os.stat(ruta_optimizada).st_mtime_ns >= mtime:
+            with open(ruta_optimizada, 'r', encoding='utf-8') as f:
+                return f.read()
+    except FileNotFoundError:
+        pass
+    
+    with open(ruta, 'r', encoding='utf-8') as f:
+        original = f.read()
+    try:
+        optimizada = optimizar_zpl(original)
+    except Exception as e:
+        log_error(f"No se pudo optimizar la plantilla {ruta}, se usa la original", e)
+        return original
+    
+    try:
+        os.makedirs(os.path.dirname(ruta_optimizada), exist_ok=True)
+        ruta_temporal = f"{ruta_optimizada}.tmp"
+        with open(ruta_temporal, 'w', encoding='utf-8') as f:
+            f.write(optimizada)
+        os.replace(ruta_temporal, ruta_optimizada)
+        log_info(f"Plantilla optimizada: {os.path.basename(ruta)} ({len(original)} -> {len(optimizada)} bytes)")
+    except OSError as e:
+        log_warning(f"No se pudo guardar la plantilla optimizada de {ruta}: {e}")
+    return optimizada
+
+def renderizar_etiqueta(zpl_original: str, tipo_material: str, color: str, es_grande: bool,
+                        cantidad: int, maquina_id: int, operador: str,
+                        impresion_id: Optional[str] = None) -> Dict:
+    """
+    Prepara una etiqueta lista para enviar: reserva su ID, arma el ZPL final
+    y deja preparado el registro del log local.
+    """
+    id_numero = reservar_id_etiqueta()
+    numero_formateado = f"{id_numero:010d}"
+    fecha_actual = datetime.now().strftime("%d/%m/%Y %H:%M:%S")
+    
+    # Construir código de barras
+    color_para_barcode = color.replace("_GRANDE", "")
+    contenido_barcode = f"{ID_MAQUINA}-{tipo_material}-{color_para_barcode}-{numero_formateado}"
+    
+    # Agregar información adicional al ZPL
+    zpl_extra = f"""
+^FO60,60^BY0.5,2,150^BCN,100,Y,N,N^FD{contenido_barcode}^FS
+^FO30,300^A0N,30,30^FDFecha: {fecha_actual}^FS
+^FO30,340^A0N,30,30^FDEtiq. ID: {numero_formateado}^FS
+^FO30,380^A0N,25,25^FDMáq: {maquina_id:02d} | Op: {operador[:15]}^FS
+"""
+    
+    # Generar ZPL final
+    zpl_final = zpl_original.replace("^XZ", zpl_extra + "\n^XZ")
+    
+    return {
+        "datos": zpl_final.encode('utf-8'),
+        "id_numero": numero_formateado,
+        "registro": {
+            "fecha": fecha_actual,
+            "tipo": tipo_material,
+            "color": color,
+            "tipo_etiqueta": "grande" if es_grande else "chica",
+            "id_numero": numero_formateado,
+            "codigo_barra": contenido_barcode,
+            "id_maquina": str(ID_MAQUINA),
+            "maquina_id": maquina_id,
+            "operador": operador,
+            "cantidad": cantidad,
+            "impresion_id": impresion_id
+        }
+    }
+
+def _productor_etiquetas(cola: queue.Queue, detener: threading.Event, zpl_original: str,
+                         tipo_material: str, color: str, es_grande: bool, cantidad: int,
+                         maquina_id: int, operador: str, impresion_id: Optional[str] = None,
+                         span_padre=_SPAN_NULO):
+    """
+    Etapa de renderizado: prepara las etiquetas por adelantado y las deja en la cola.
+    La cola es acotada, así que se bloquea cuando va ETIQUETAS_RENDERIZADAS_ADELANTADAS por delante.
+    `span_padre` es el span del hilo que imprime, para colgar de él los spans de renderizado.
+    """
+    try:
+        for i in range(cantidad):
+            if detener.is_set():
+                break
+            if not reservar_cupo_horario():
+                log_warning(f"Límite alcanzado después de reservar {i} etiquetas")
+                break
+            try:
+                inicio = time.monotonic()
+                with span_padre.hijo("renderizado", indice=i) as span_render:
+                    etiqueta = renderizar_etiqueta(zpl_original, tipo_material, color, es_grande,
+                                                   cantidad, maquina_id, operador, impresion_id)
+                    span_render.agregar_atributos(id_numero=etiqueta["id_numero"])
+                metricas.observar("gst3d_renderizado_segundos", time.monotonic() - inicio)
+            except Exception as e:
+                liberar_cupo_horario()
+                log_error(f"Error al renderizar etiqueta {i+1}/{cantidad}", e)
+                continue
+            while not detener.is_set():
+                try:
+                    cola.put(etiqueta, timeout=0.5)
+                    break
+                except queue.Full:
+                    continue
+            else:
+                liberar_cupo_horario()
+    finally:
+        cola.put(None)
+
+# ============================================================================
+# REGISTRO DE ETIQUETAS IMPRESAS
+# ============================================================================
+
+class AcumuladorDeltasStock:
+    """
+    Acumula localmente las variaciones de stock por (tipo, color) y las envía
+    cada INTERVALO_ENVIO_STOCK en una sola llamada a `aplicar_deltas_stock`,
+    en lugar de bloquear la fila `stock_global` una vez por etiqueta.
+    Lo pendiente se persiste en ARCHIVO_DELTAS_STOCK para sobrevivir reinicios.
+    Cada lote lleva un id, así reenviar un lote ya aplicado no lo aplica dos veces.
+    """
+
+    def __init__(self, ruta: str = ARCHIVO_DELTAS_STOCK, intervalo: float = INTERVALO_ENVIO_STOCK):
+        self.ruta = ruta
+        self.intervalo = intervalo
+        self.deltas: Dict[str, Dict[str, int]] = {}
+        self.lote_en_vuelo: Optional[Dict] = None
+        self._lock = threading.Lock()
+        self._hilo: Optional[threading.Thread] = None
+
+    def cargar(self):
+        """Recupera los deltas que quedaron sin enviar en la ejecución anterior."""
+        try:
+            if os.path.exists(self.ruta):
+                with open(self.ruta, "r", encoding='utf-8') as f:
+                    datos = json.load(f)
+                self.deltas = datos.get("deltas") or {}
+                self.lote_en_vuelo = datos.get("lote_en_vuelo")
+                if self.deltas or self.lote_en_vuelo:
+                    log_info("Deltas de stock pendientes recuperados del disco")
+        except Exception as e:
+            log_error("Error al cargar deltas de stock pendientes", e)
+
+    def _persistir(self):
+        """Guarda el estado pendiente. Llamar con self._lock tomado."""
+        try:
+            guardar_json_atomico(self.ruta, {"deltas": self.deltas, "lote_en_vuelo": self.lote_en_vuelo})
+        except Exception as e:
+            log_error("Error al guardar deltas de stock pendientes", e)
+
+    def registrar(self, tipo: str, color: str, delta: int):
+        """Suma una variación de stock al acumulado local."""
+        with self._lock:
+            colores = self.deltas.setdefault(tipo, {})
+            colores[color] = colores.get(color, 0) + delta
+            if colores[color] == 0:
+                del colores[color]
+                if not colores:
+                    del self.deltas[tipo]
+            self._persistir()
+
+    def enviar(self) -> bool:
+        """
+        Envía el lote pendiente (o arma uno nuevo con lo acumulado).
+        Returns: True si no quedó nada pendiente de envío
+        """
+        with self._lock:
+            if self.lote_en_vuelo is None:
+                if not self.deltas:
+                    return True
+                self.lote_en_vuelo = {"id": str(uuid.uuid4()), "deltas": self.deltas}
+                self.deltas = {}
+                self._persistir()
+            lote = self.lote_en_vuelo
+        
+        try:
+            if not reconectar_supabase_si_es_necesario():
+                return False
+            supabase_client.rpc('aplicar_deltas_stock', {
+                'p_lote_id': lote["id"],
+                'p_deltas': lote["deltas"]
+            }).execute()
+        except Exception as e:
+            log_warning(f"No se pudo enviar el lote de stock {lote['id']}, se reintentará: {e}")
+            return False
+        
+        with self._lock:
+            self.lote_en_vuelo = None
+            self._persistir()
+        cantidad = sum(len(colores) for colores in lote["deltas"].values())
+        log_success(f"Stock actualizado: {cantidad} color(es) en un solo lote")
+        return True
+
+    def _bucle(self):
+        while True:
+            time.sleep(self.intervalo)
+            try:
+                self.enviar()
+            except Exception as e:
+                log_error("Error en el envío de deltas de stock", e)
+
+    def iniciar(self):
+        """Recupera lo pendiente y arranca el hilo de envío."""
+        if self._hilo is None:
+            self.cargar()
+            self._hilo = threading.Thread(target=self._bucle, name="stock", daemon=True)
+            self._hilo.start()
+            atexit.register(self.enviar)
+
+acumulador_stock = AcumuladorDeltasStock()
+
+class ContadorEtiquetasImpresas:
+    """
+    Cuenta en memoria las etiquetas chicas y grandes confirmadas y las suma en
+    `contador_etiquetas` con un único incremento atómico cada INTERVALO_ENVIO_CONTADOR
+    segundos o cada ETIQUETAS_POR_ENVIO_CONTADOR etiquetas, lo que ocurra primero.
+    """
+
+    def __init__(self, id_contador: str = ID_CONTADOR_ETIQUETAS_SERVICIO,
+                 intervalo: float = INTERVALO_ENVIO_CONTADOR,
+                 etiquetas_por_envio: int = ETIQUETAS_POR_ENVIO_CONTADOR):
+        self.id_contador = id_contador
+        self.intervalo = intervalo
+        self.etiquetas_por_envio = etiquetas_por_envio
+        self.chicas = 0
+        self.grandes = 0
+        self._lock = threading.Lock()
+        self._enviar_ya = threading.Event()
+        self._hilo: Optional[threading.Thread] = None
+
+    def registrar(self, es_grande: bool):
+        """Suma una etiqueta confirmada."""
+        with self._lock:
+            if es_grande:
+                self.grandes += 1
+            else:
+                self.chicas += 1
+            if self.chicas + self.grandes >= self.etiquetas_por_envio:
+                self._enviar_ya.set()
+
+    def enviar(self) -> bool:
+        """
+        Envía lo acumulado como un solo incremento.
+        Returns: True si no quedó nada pendiente de envío
+        """
+        with self._lock:
+            chicas, grandes = self.chicas, self.grandes
+            self.chicas = self.grandes = 0
+        if chicas == 0 and grandes == 0:
+            return True
+        
+        try:
+            if not reconectar_supabase_si_es_necesario():
+                raise ConnectionError("Sin conexión a Supabase")
+            supabase_client.rpc('incrementar_contador_etiquetas', {
+                'p_id': self.id_contador,
+                'p_chicas': chicas,
+                'p_grandes': grandes
+            }).execute()
+            return True
+        except Exception as e:
+            # Devolver lo no enviado al acumulado para el próximo intento
+            with self._lock:
+                self.chicas += chicas
+                self.grandes += grandes
+            log_warning(f"No se pudo actualizar contador_etiquetas, se reintentará: {e}")
+            return False
+
+    def _bucle(self):
+        while True:
+            self._enviar_ya.wait(self.intervalo)
+            self._enviar_ya.clear()
+            try:
+                self.enviar()
+            except Exception as e:
+                log_error("Error en el envío del contador de etiquetas", e)
+
+    def iniciar(self):
+        """Arranca el hilo de envío."""
+        if self._hilo is None:
+            self._hilo = threading.Thread(target=self._bucle, name="contador-etiquetas", daemon=True)
+            self._hilo.start()
+            atexit.register(self.enviar)
+
+contador_etiquetas_impresas = ContadorEtiquetasImpresas()
+
+def registro_a_fila_etiqueta(registro: Dict) -> Optional[Dict]:
+    """Convierte un registro de ARCHIVO_LOG_LOCAL en una fila de `etiquetas_impresas`."""
+    codigo_barra = registro.get("codigo_barra")
+    if not codigo_barra:
+        return None
+    
+    fecha = None
+    try:
+        fecha = datetime.strptime(registro.get("fecha", ""), "%d/%m/%Y %H:%M:%S").astimezone().isoformat()
+    except (ValueError, TypeError):
+        pass
+    
+    return {
+        "codigo_barra": codigo_barra,
+        "id_numero": registro.get("id_numero"),
+        "id_maquina": registro.get("id_maquina"),
+        "impresion_id": registro.get("impresion_id"),
+        "maquina_id": registro.get("maquina_id"),
+        "operador": registro.get("operador"),
+        "tipo_material": registro.get("tipo"),
+        "color": registro.get("color"),
+        "tipo_etiqueta": registro.get("tipo_etiqueta"),
+        "fecha": fecha,
+    }
+
+class SubidorRegistrosEtiquetas:
+    """
+    Sube a `etiquetas_impresas` los registros nuevos de ARCHIVO_LOG_LOCAL en inserciones
+    de muchas filas. Recuerda hasta qué byte del log subió (ARCHIVO_CURSOR_SUBIDA_LOG)
+    y retoma desde ahí; el tamaño del lote se adapta a la latencia de cada inserción.
+    """
+
+    def __init__(self, ruta_log: str = ARCHIVO_LOG_LOCAL, ruta_cursor: str = ARCHIVO_CURSOR_SUBIDA_LOG,
+                 intervalo: float = INTERVALO_SUBIDA_REGISTROS):
+        self.ruta_log = ruta_log
+        self.ruta_cursor = ruta_cursor
+        self.intervalo = intervalo
+        self.tamano_lote = LOTE_SUBIDA_MINIMO
+        self._hilo: Optional[threading.Thread] = None
+
+    def leer_cursor(self) -> int:
+        try:
+            with open(self.ruta_cursor, "r", encoding='utf-8') as f:
+                return int(json.load(f).get("offset", 0))
+        except FileNotFoundError:
+            return 0
+        except Exception as e:
+            log_error("Error al leer el cursor de subida, se retoma desde el inicio", e)
+            return 0
+
+    def guardar_cursor(self, offset: int):
+        guardar_json_atomico(self.ruta_cursor, {"offset": offset})
+
+    def _leer_lote(self, offset: int) -> tuple:
+        """
+        Lee hasta `tamano_lote` líneas completas desde `offset`.
+        Returns: (filas, offset_siguiente)
+        """
+        filas = []
+        with open(self.ruta_log, "rb") as f:
+            f.seek(offset)
+            while len(filas) < self.tamano_lote:
+                linea = f.readline()
+                if not linea.endswith(b"\n"):
+                    break  # Línea incompleta: todavía se está escribiendo
+                offset += len(linea)
+                if not linea.strip():
+                    continue
+                try:
+                    registro = json.loads(linea)
+                except ValueError:
+                    registro = None
+                if not isinstance(registro, dict):
+                    # JSON roto o que no es un objeto (por ejemplo `[]`): se saltea para no trabar el cursor
+                    log_warning(f"Línea inválida en {self.ruta_log} (byte {offset - len(linea)}), se omite")
+                    continue
+                fila = registro_a_fila_etiqueta(registro)
+                if fila:
+                    filas.append(fila)
+        return filas, offset
+
+    def _ajustar_lote(self, latencia: float, lote_lleno: bool):
+        if latencia > LATENCIA_OBJETIVO_SUBIDA:
+            self.tamano_lote = max(LOTE_SUBIDA_MINIMO, self.tamano_lote // 2)
+        elif lote_lleno and latencia < LATENCIA_OBJETIVO_SUBIDA / 2:
+            self.tamano_lote = min(LOTE_SUBIDA_MAXIMO, self.tamano_lote * 2)
+
+    def subir_pendientes(self) -> int:
+        """
+        Sube todo lo nuevo del log, lote por lote.
+        Returns: Cantidad de registros subidos
+        """
+        if not os.path.exists(self.ruta_log):
+            return 0
+        offset = self.leer_cursor()
+        if offset > os.path.getsize(self.ruta_log):
+            log_warning("El log local es más chico que el cursor de subida, se retoma desde el inicio")
+            offset = 0
+        
+        total = 0
+        while True:
+            filas, offset_siguiente = self._leer_lote(offset)
+            if offset_siguiente == offset:
+                break
+            
+            if filas:
+                if not reconectar_supabase_si_es_necesario():
+                    break
+                inicio = time.monotonic()
+                try:
+                    supabase_client.table('etiquetas_impresas').upsert(
+                        filas, on_conflict='codigo_barra', ignore_duplicates=True
+                    ).execute()
+                except Exception as e:
+                    self.tamano_lote = LOTE_SUBIDA_MINIMO
+                    log_warning(f"No se pudieron subir {len(filas)} registro(s) de etiquetas, se reintentará: {e}")
+                    break
+                self._ajustar_lote(time.monotonic() - inicio, len(filas) >= self.tamano_lote)
+                total += len(filas)
+            
+            self.guardar_cursor(offset_siguiente)
+            offset = offset_siguiente
+        
+        if total:
+            log_success(f"Subidos {total} registro(s) de etiquetas a Supabase")
+        return total
+
+    def _bucle(self):
+        while True:
+            try:
+                self.subir_pendientes()
+            except Exception as e:
+                log_error("Error al subir registros de etiquetas", e)
+            time.sleep(self.intervalo)
+
+    def iniciar(self):
+        """Arranca el hilo de subida."""
+        if self._hilo is None:
+            self._hilo = threading.Thread(target=self._bucle, name="subida-registros", daemon=True)
+            self._hilo.start()
 
-        return colores_faltantes
+subidor_registros = SubidorRegistrosEtiquetas()
 
-    except Exception as e:
-        log_error("Error verificando archivos PRN faltantes", e)
-        return []
+def confirmar_etiqueta_impresa(registro: Dict):
+    """Registra una etiqueta que la impresora ya aceptó: log local y acumulados."""
+    guardar_log_local(registro)
+    
+    if ACTUALIZAR_CONTADOR_ETIQUETAS:
+        contador_etiquetas_impresas.registrar(registro.get("tipo_etiqueta") == "grande")
+    
+    if ACTUALIZAR_STOCK_DESDE_SERVICIO and registro.get("tipo_etiqueta") == "grande":
+        acumulador_stock.registrar(
+            registro["tipo"], registro["color"].replace("_GRANDE", ""), DELTA_STOCK_POR_BOBINA
+        )
 
 # ============================================================================
 # FUNCIÓN DE IMPRESIÓN ROBUSTA
 # ============================================================================
 
 def imprimir_etiqueta(tipo_material: str, color: str, es_grande: bool, cantidad: int, 
-                      maquina_id: int, operador: str) -> bool:
+                      maquina_id: int, operador: str, impresion_id: Optional[str] = None) -> bool:
     """
     Imprime una etiqueta (chica o grande) la cantidad de veces especificada.
+    El renderizado corre adelantado en otro hilo; este hilo solo envía a la impresora.
     Returns: True si se imprimió correctamente, False en caso contrario
     """
-    global etiquetas_impresas_en_hora
-    global hora_de_inicio_del_contador
-    
     try:
-        # Verificar límite horario
-        tiempo_transcurrido = datetime.now() - hora_de_inicio_del_contador
-        if tiempo_transcurrido >= timedelta(hours=1):
-            etiquetas_impresas_en_hora = 0
-            hora_de_inicio_del_contador = datetime.now()
-            guardar_estado_horario()
-            log_info("Contador horario reiniciado")
-        
         # Verificar si podemos imprimir
-        if etiquetas_impresas_en_hora >= LIMITE_ETIQUETAS_POR_HORA:
+        with _lock_contadores:
+            _reiniciar_contador_horario_si_corresponde()
+            limite_alcanzado = etiquetas_impresas_en_hora >= LIMITE_ETIQUETAS_POR_HORA
+        if limite_alcanzado:
             log_warning(f"Límite de etiquetas por hora alcanzado ({LIMITE_ETIQUETAS_POR_HORA})")
             return False
         
-        # Obtener nombre del archivo .prn
-        nombre_archivo_base = obtener_nombre_archivo_prn(color, es_grande)
-        ruta_original = os.path.join(RUTA_PRN, f"{nombre_archivo_base}.prn")
-        
-        if not os.path.exists(ruta_original):
+        # Obtener nombre del archivo .prn y leer la plantilla ZPL
+        with abrir_span("plantilla", color=color, es_grande=es_grande) as span_plantilla:
+            nombre_archivo_base = obtener_nombre_archivo_prn(color, es_grande)
+            ruta_original = os.path.join(RUTA_PRN, f"{nombre_archivo_base}.prn")
+            span_plantilla.agregar_atributos(archivo=nombre_archivo_base)
+            try:
+                zpl_original = cargar_plantilla(ruta_original)
+            except Exception as e:
+                log_error(f"Error al leer plantilla {ruta_original}", e)
+                return False
+        if zpl_original is None:
             log_error(f"No se encontró el archivo de plantilla: {ruta_original}")
             return False
         
-        # Leer la plantilla ZPL
-        try:
-            with open(ruta_original, 'r', encoding='utf-8') as f:
-                zpl_original = f.read()
-        except Exception as e:
-            log_error(f"Error al leer plantilla {ruta_original}", e)
-            return False
+        # Seleccionar la impresora correcta según el tipo de etiqueta
+        nombre_impresora = NOMBRE_IMPRESORA_GRANDES if es_grande else NOMBRE_IMPRESORA_CHICAS
+        
+        # Arrancar la etapa de renderizado. Cada trabajo tiene su propio hilo productor: con un pool
+        # compartido, un trabajo de más quedaría en la cola del pool y este hilo esperaría para siempre
+        cola = queue.Queue(maxsize=ETIQUETAS_RENDERIZADAS_ADELANTADAS)
+        detener = threading.Event()
+        threading.Thread(
+            target=_productor_etiquetas, name="renderizado", daemon=True,
+            args=(cola, detener, zpl_original, tipo_material, color, es_grande, cantidad,
+                  maquina_id, operador, impresion_id, span_activo()),
+        ).start()
         
-        # Imprimir la cantidad especificada
+        # Etapa de transporte: enviar cada etiqueta apenas está lista
         total_impreso = 0
-        for i in range(cantidad):
-            try:
-                # Verificar límite antes de cada impresión
-                if etiquetas_impresas_en_hora >= LIMITE_ETIQUETAS_POR_HORA:
-                    log_warning(f"Límite alcanzado después de imprimir {total_impreso} etiquetas")
+        renderizado_terminado = False
+        try:
+            while True:
+                etiqueta = cola.get()
+                if etiqueta is None:
+                    renderizado_terminado = True
                     break
                 
-                # Generar ID único
-                id_numero = leer_contador_id()
-                numero_formateado = f"{id_numero:010d}"
-                fecha_actual = datetime.now().strftime("%d/%m/%Y %H:%M:%S")
-                
-                # Construir código de barras
-                color_para_barcode = color.replace("_GRANDE", "")
-                contenido_barcode = f"{ID_MAQUINA}-{tipo_material}-{color_para_barcode}-{numero_formateado}"
-                
-                # Agregar información adicional al ZPL
-                zpl_extra = f"""
-^FO60,60^BY0.5,2,150^BCN,100,Y,N,N^FD{contenido_barcode}^FS
-^FO30,300^A0N,30,30^FDFecha: {fecha_actual}^FS
-^FO30,340^A0N,30,30^FDEtiq. ID: {numero_formateado}^FS
-^FO30,380^A0N,25,25^FDMáq: {maquina_id:02d} | Op: {operador[:15]}^FS
-"""
-                
-                # Generar ZPL final
-                zpl_final = zpl_original.replace("^XZ", zpl_extra + "\n^XZ")
-                
-                # Guardar archivo temporal
-                ruta_temp = f"/tmp/etiqueta_{id_numero}_{i}_{int(time.time())}.prn"
-                try:
-                    with open(ruta_temp, 'w', encoding='utf-8') as f:
-                        f.write(zpl_final)
-                except Exception as e:
-                    log_error(f"Error al crear archivo temporal {ruta_temp}", e)
-                    continue
-                
-                # Seleccionar la impresora correcta según el tipo de etiqueta
-                nombre_impresora = NOMBRE_IMPRESORA_GRANDES if es_grande else NOMBRE_IMPRESORA_CHICAS
-                
-                # Enviar a la impresora con reintentos
-                exito_impresion = False
-                for reintento in range(3):
-                    try:
-                        resultado = subprocess.run(
-                            ["lp", "-d", nombre_impresora, ruta_temp],
-                            check=True,
-                            capture_output=True,
-                            text=True,
-                            timeout=30
-                        )
-                        exito_impresion = True
-                        break
-                    except subprocess.TimeoutExpired:
-                        log_warning(f"Timeout al imprimir en {nombre_impresora} (reintento {reintento + 1}/3)")
-                        if reintento < 2:
-                            time.sleep(2)
-                    except subprocess.CalledProcessError as e:
-                        log_error(f"Error al imprimir en {nombre_impresora} (reintento {reintento + 1}/3): {e.stderr}", e)
-                        if reintento < 2:
-                            time.sleep(2)
-                    except Exception as e:
-                        log_error(f"Error inesperado al imprimir en {nombre_impresora} (reintento {reintento + 1}/3)", e)
-                        if reintento < 2:
-                            time.sleep(2)
-                
-                if not exito_impresion:
-                    log_error(f"No se pudo imprimir después de 3 reintentos en {nombre_impresora}: {ruta_temp}")
-                    try:
-                        os.remove(ruta_temp)
-                    except:
-                        pass
+                with abrir_span("transporte", impresora=nombre_impresora, id_numero=etiqueta["id_numero"]) as span_envio:
+                    enviada = enviar_a_impresora(nombre_impresora, etiqueta["datos"])
+                    span_envio.agregar_atributos(enviada=enviada)
+                if not enviada:
+                    log_error(f"No se pudo imprimir después de 3 reintentos en {nombre_impresora}: etiqueta {etiqueta['id_numero']}")
+                    liberar_cupo_horario()
                     continue
                 
-                # Guardar log
-                try:
-                    datos = {
-                        "fecha": fecha_actual,
-                        "tipo": tipo_material,
-                        "color": color,
-                        "tipo_etiqueta": "grande" if es_grande else "chica",
-                        "id_numero": numero_formateado,
-                        "codigo_barra": contenido_barcode,
-                        "id_maquina": str(ID_MAQUINA),
-                        "maquina_id": maquina_id,
-                        "operador": operador,
-                        "cantidad": cantidad
-                    }
-                    guardar_log_local(datos)
-                except Exception as e:
-                    log_error("Error al guardar log local", e)
-                
-                # Actualizar contadores
-                try:
-                    guardar_contador_id(id_numero + 1)
-                    etiquetas_impresas_en_hora += 1
-                    guardar_estado_horario()
-                except Exception as e:
-                    log_error("Error al actualizar contadores", e)
-                
+                with abrir_span("confirmar_etiqueta", id_numero=etiqueta["id_numero"]):
+                    confirmar_etiqueta_impresa(etiqueta["registro"])
+                    # Por etiqueta, como antes: si el servicio se cae a mitad de un trabajo, el cupo
+                    # persistido (el que lee el kiosco) ya incluye lo impreso
+                    with _lock_contadores:
+                        guardar_estado_horario()
+                metricas.registrar_etiqueta_impresa(nombre_impresora)
                 total_impreso += 1
-                
-                # Limpiar archivo temporal
-                try:
-                    os.remove(ruta_temp)
-                except:
-                    pass
-                    
-            except Exception as e:
-                log_error(f"Error al procesar etiqueta {i+1}/{cantidad}", e)
-                continue
+        finally:
+            # Si salimos antes de tiempo, liberar las etiquetas que quedaron renderizadas
+            detener.set()
+            while not renderizado_terminado:
+                etiqueta = cola.get()
+                if etiqueta is None:
+                    renderizado_terminado = True
+                else:
+                    liberar_cupo_horario()
+            with _lock_contadores:
+                guardar_estado_horario()
         
         if total_impreso > 0:
-            nombre_impresora_usada = NOMBRE_IMPRESORA_GRANDES if es_grande else NOMBRE_IMPRESORA_CHICAS
-            log_success(f"Impresas {total_impreso}/{cantidad} etiquetas {'grandes' if es_grande else 'chicas'} de {tipo_material} - {color} en {nombre_impresora_usada}")
+            log_success(f"Impresas {total_impreso}/{cantidad} etiquetas {'grandes' if es_grande else 'chicas'} de {tipo_material} - {color} en {nombre_impresora}")
             log_info(f"Etiquetas impresas en la última hora: {etiquetas_impresas_en_hora}/{LIMITE_ETIQUETAS_POR_HORA}")
         
         return total_impreso > 0
@@ -437,6 +1964,7 @@ def imprimir_etiqueta(tipo_material: str, color: str, es_grande: bool, cantidad:
 def conectar_supabase(reintentos: int = MAX_REINTENTOS_CONEXION) -> Optional[Client]:
     """Conecta a Supabase con reintentos automáticos."""
     global supabase_client
+    global supabase_conectado
     
     for intento in range(reintentos):
         try:
@@ -444,6 +1972,7 @@ def conectar_supabase(reintentos: int = MAX_REINTENTOS_CONEXION) -> Optional[Cli
             # Probar la conexión haciendo una consulta simple
             cliente.table('impresiones').select('id').limit(1).execute()
             supabase_client = cliente
+            supabase_conectado = True
             log_success(f"Conexión a Supabase establecida (intento {intento + 1})")
             return cliente
         except Exception as e:
@@ -459,15 +1988,18 @@ def conectar_supabase(reintentos: int = MAX_REINTENTOS_CONEXION) -> Optional[Cli
 def verificar_conexion_supabase() -> bool:
     """Verifica que la conexión a Supabase siga activa."""
     global supabase_client
+    global supabase_conectado
     
     if supabase_client is None:
+        supabase_conectado = False
         return False
     
     try:
         supabase_client.table('impresiones').select('id').limit(1).execute()
-        return True
+        supabase_conectado = True
     except Exception:
-        return False
+        supabase_conectado = False
+    return supabase_conectado
 
 def reconectar_supabase_si_es_necesario() -> bool:
     """Reconecta a Supabase si la conexión se perdió."""
@@ -482,10 +2014,19 @@ def reconectar_supabase_si_es_necesario() -> bool:
 
 def procesar_impresion_pendiente(impresion: Dict) -> bool:
     """Procesa una impresión pendiente desde Supabase con manejo robusto de errores."""
+    with iniciar_traza("impresion", impresion_id=impresion.get('id'), maquina_id=impresion.get('maquina_id'),
+                       consulta_pendientes_ms=duracion_ultima_consulta_ms) as span_impresion:
+        exito = _procesar_impresion_pendiente(impresion)
+        span_impresion.agregar_atributos(exito=exito)
+        return exito
+
+def _procesar_impresion_pendiente(impresion: Dict) -> bool:
     global supabase_client
     
     try:
-        if not reconectar_supabase_si_es_necesario():
+        with abrir_span("reconexion_supabase"):
+            conectado = reconectar_supabase_si_es_necesario()
+        if not conectado:
             log_error("No se pudo reconectar a Supabase para procesar impresión")
             return False
         
@@ -508,14 +2049,16 @@ def procesar_impresion_pendiente(impresion: Dict) -> bool:
         exito_chicas = True
         if cantidad_chicas > 0 and etiqueta_chica:
             try:
-                exito_chicas = imprimir_etiqueta(
-                    tipo_material=tipo_material,
-                    color=etiqueta_chica,
-                    es_grande=False,
-                    cantidad=cantidad_chicas,
-                    maquina_id=maquina_id,
-                    operador=operador
-                )
+                with abrir_span("imprimir_chicas", cantidad=cantidad_chicas):
+                    exito_chicas = imprimir_etiqueta(
+                        tipo_material=tipo_material,
+                        color=etiqueta_chica,
+                        es_grande=False,
+                        cantidad=cantidad_chicas,
+                        maquina_id=maquina_id,
+                        operador=operador,
+                        impresion_id=impresion_id
+                    )
             except Exception as e:
                 log_error("Error al imprimir etiquetas chicas", e)
                 exito_chicas = False
@@ -524,14 +2067,16 @@ def procesar_impresion_pendiente(impresion: Dict) -> bool:
         exito_grandes = True
         if cantidad_grandes > 0 and etiqueta_grande:
             try:
-                exito_grandes = imprimir_etiqueta(
-                    tipo_material=tipo_material,
-                    color=etiqueta_grande,
-                    es_grande=True,
-                    cantidad=cantidad_grandes,
-                    maquina_id=maquina_id,
-                    operador=operador
-                )
+                with abrir_span("imprimir_grandes", cantidad=cantidad_grandes):
+                    exito_grandes = imprimir_etiqueta(
+                        tipo_material=tipo_material,
+                        color=etiqueta_grande,
+                        es_grande=True,
+                        cantidad=cantidad_grandes,
+                        maquina_id=maquina_id,
+                        operador=operador,
+                        impresion_id=impresion_id
+                    )
             except Exception as e:
                 log_error("Error al imprimir etiquetas grandes", e)
                 exito_grandes = False
@@ -539,21 +2084,24 @@ def procesar_impresion_pendiente(impresion: Dict) -> bool:
         # Actualizar estado en Supabase con reintentos
         estado_final = 'impresa' if (exito_chicas and exito_grandes) else 'error'
         
-        for reintento in range(3):
-            try:
-                if reconectar_supabase_si_es_necesario():
-                    supabase_client.table('impresiones').update({
-                        'estado': estado_final
-                    }).eq('id', impresion_id).execute()
-                    
-                    log_success(f"Estado actualizado a: {estado_final}")
-                    return True
-            except Exception as e:
-                if reintento < 2:
-                    log_warning(f"Error al actualizar estado (reintento {reintento + 1}/3)", e)
-                    time.sleep(2)
-                else:
-                    log_error("Error al actualizar estado después de 3 reintentos", e)
+        with abrir_span("actualizar_estado", estado=estado_final) as span_estado:
+            for reintento in range(3):
+                try:
+                    if reconectar_supabase_si_es_necesario():
+                        supabase_client.table('impresiones').update({
+                            'estado': estado_final
+                        }).eq('id', impresion_id).execute()
+                        
+                        log_success(f"Estado actualizado a: {estado_final}")
+                        observar_latencia_cola(impresion)
+                        return True
+                except Exception as e:
+                    span_estado.agregar_atributos(reintentos=reintento + 1)
+                    if reintento < 2:
+                        log_warning(f"Error al actualizar estado (reintento {reintento + 1}/3)", e)
+                        time.sleep(2)
+                    else:
+                        log_error("Error al actualizar estado después de 3 reintentos", e)
         
         return False
             
@@ -562,46 +2110,860 @@ def procesar_impresion_pendiente(impresion: Dict) -> bool:
         traceback.print_exc()
         return False
 
-def obtener_impresiones_pendientes() -> List[Dict]:
-    """Obtiene las impresiones pendientes de Supabase con manejo robusto."""
+def clave_impresion(impresion: Dict) -> tuple:
+    """Clave de orden de la cola de pendientes: (timestamp, id)."""
+    return (impresion.get('timestamp'), impresion.get('id'))
+
+def obtener_impresiones_pendientes(despues_de: Optional[tuple] = None,
+                                   limite: int = TAMANO_PAGINA_PENDIENTES) -> List[Dict]:
+    """
+    Obtiene una página de impresiones pendientes ordenada por (timestamp, id).
+    Si se pasa `despues_de` (una clave_impresion), pagina por keyset a partir de esa clave.
+    """
     global supabase_client
+    global duracion_ultima_consulta_ms
     
+    inicio = time.monotonic()
     try:
         if not reconectar_supabase_si_es_necesario():
             return []
         
-        response = supabase_client.table('impresiones')\
-            .select('*')\
-            .eq('estado', 'pendiente')\
+        consulta = supabase_client.table('impresiones')\
+            .select(COLUMNAS_IMPRESION)\
+            .eq('estado', 'pendiente')
+        
+        if despues_de is not None:
+            timestamp, impresion_id = despues_de
+            consulta = consulta.or_(
+                f'timestamp.gt.{timestamp},and(timestamp.eq.{timestamp},id.gt."{impresion_id}")'
+            )
+        
+        response = consulta\
             .order('timestamp', desc=False)\
-            .limit(10)\
+            .order('id', desc=False)\
+            .limit(limite)\
             .execute()
         
+        duracion_ultima_consulta_ms = round((time.monotonic() - inicio) * 1000, 1)
         return response.data if response.data else []
     except Exception as e:
         log_error("Error al obtener impresiones pendientes", e)
         return []
 
+def ajustar_tamano_pagina(tamano: int, latencia: float, pagina_llena: bool) -> int:
+    """Agranda la página mientras las consultas son rápidas y la achica si se vuelven lentas."""
+    if latencia > LATENCIA_OBJETIVO_PAGINA:
+        return max(TAMANO_PAGINA_PENDIENTES, tamano // 2)
+    if pagina_llena and latencia < LATENCIA_OBJETIVO_PAGINA / 2:
+        return min(TAMANO_PAGINA_DRENAJE_MAXIMO, tamano * 2)
+    return tamano
+
+# ============================================================================
+# PLANIFICADOR DE POLLING ADAPTATIVO
+# ============================================================================
+
+class PlanificadorPolling:
+    """
+    Decide cuánto esperar antes de la próxima consulta de pendientes.
+    - Página llena: vuelve a consultar de inmediato (modo ráfaga)
+    - Cola vacía: backoff exponencial hasta INTERVALO_POLLING_MAXIMO
+    - Resto de los casos: intervalo base
+    """
+
+    def __init__(self, intervalo_base: float = INTERVALO_POLLING,
+                 intervalo_maximo: float = INTERVALO_POLLING_MAXIMO,
+                 factor: float = FACTOR_BACKOFF_POLLING, jitter: float = JITTER_POLLING):
+        self.intervalo_base = intervalo_base
+        self.intervalo_maximo = intervalo_maximo
+        self.factor = factor
+        self.jitter = jitter
+        self.intervalo_actual = intervalo_base
+
+    def registrar_consulta(self, cantidad: int, tamano_pagina: int, aceptadas: Optional[int] = None) -> float:
+        """
+        Ajusta el intervalo según el resultado de una consulta.
+        `aceptadas` permite indicar cuántas filas eran realmente nuevas (el resto ya estaba en curso).
+        Returns: Segundos a esperar antes de la próxima consulta
+        """
+        if aceptadas is None:
+            aceptadas = cantidad
+        
+        if cantidad >= tamano_pagina and aceptadas > 0:
+            self.intervalo_actual = 0
+        elif cantidad == 0:
+            self.intervalo_actual = min(
+                max(self.intervalo_actual * self.factor, self.intervalo_base),
+                self.intervalo_maximo
+            )
+        else:
+            self.intervalo_actual = self.intervalo_base
+        return self.proxima_espera()
+
+    def reiniciar(self):
+        """Vuelve al intervalo base (por ejemplo, al detectar actividad por otra vía)."""
+        self.intervalo_actual = self.intervalo_base
+
+    def proxima_espera(self) -> float:
+        """Intervalo actual con jitter aplicado."""
+        if self.intervalo_actual <= 0:
+            return 0
+        return self.intervalo_actual * random.uniform(1 - self.jitter, 1 + self.jitter)
+
+planificador_polling = PlanificadorPolling()
+metricas.gauge("gst3d_intervalo_polling_segundos", "Intervalo actual del planificador de polling",
+               lambda: planificador_polling.intervalo_actual)
+metricas.gauge("gst3d_impresiones_pendientes", "Impresiones en estado pendiente vistas en Supabase en la última pasada de polling",
+               lambda: impresiones_pendientes_vistas)
+
 # ============================================================================
 # HEARTBEAT Y MONITOREO
 # ============================================================================
 
 def hacer_heartbeat():
-    """Registra un heartbeat para indicar que el servicio está vivo."""
+    """Registra un heartbeat para indicar que el servicio está vivo (lo consulta /healthz)."""
     global ultimo_heartbeat
     ultimo_heartbeat = datetime.now()
-    # Cada hora, hacer un log más detallado
-    if ultimo_heartbeat.minute == 0:
-        log_info("💓 Servicio activo - Heartbeat")
 
 # ============================================================================
-# BUCLE PRINCIPAL ULTRA ROBUSTO
+# ENVÍO LOCAL DE TRABAJOS (SOCKET UNIX)
 # ============================================================================
+# Protocolo: una línea JSON por pedido y una línea JSON de respuesta en la misma conexión.
+#   {"accion": "imprimir", "tipo_material": "PLA", "color": "BLACK", "es_grande": false,
+#    "cantidad": 1, "maquina_id": 2, "operador": "Kiosco", "esperar": false}
+#     -> {"ok": true, "id": "local-...", "cupo_restante": 87}
+#   {"accion": "estado"} -> {"ok": true, "etiquetas_en_hora": 13, "limite": 100, "cupo_restante": 87}
+# Los trabajos locales pasan por las mismas colas de impresora, cupo horario y contador
+# de IDs que los de Supabase, pero su estado no se escribe en `impresiones`.
 
-def main():
-    """Función principal que ejecuta el bucle de polling - NUNCA SE CIERRA."""
-    global conteo_errores_consecutivos
+metricas.describir("gst3d_envios_locales_total", "counter", "Pedidos recibidos por el socket de envío local")
+
+def partes_impresion(impresion: Dict) -> List[tuple]:
+    """
+    Separa una impresión en las etiquetas que hay que mandar a cada impresora.
+    Returns: [(nombre_impresora, es_grande, color, cantidad)]
+    """
+    partes = []
+    if impresion.get('cantidad_chicas', 8) > 0 and impresion.get('etiqueta_chica'):
+        partes.append((NOMBRE_IMPRESORA_CHICAS, False, impresion.get('etiqueta_chica'), impresion.get('cantidad_chicas', 8)))
+    if impresion.get('cantidad_grandes', 8) > 0 and impresion.get('etiqueta_grande'):
+        partes.append((NOMBRE_IMPRESORA_GRANDES, True, impresion.get('etiqueta_grande'), impresion.get('cantidad_grandes', 8)))
+    return partes
+
+def cupo_horario_restante() -> int:
+    """Returns: Cuántas etiquetas quedan en el cupo de la hora actual."""
+    with _lock_contadores:
+        _reiniciar_contador_horario_si_corresponde()
+        return max(0, LIMITE_ETIQUETAS_POR_HORA - etiquetas_impresas_en_hora)
+
+def crear_impresion_local(pedido: Dict) -> Dict:
+    """
+    Valida un pedido local y lo convierte en una impresión con la forma de una fila de `impresiones`.
+    Lanza ValueError si el pedido es inválido.
+    """
+    tipo_material = pedido.get("tipo_material")
+    color = pedido.get("color")
+    cantidad = pedido.get("cantidad", 1)
+    maquina_id = pedido.get("maquina_id", 0)
+    if not isinstance(tipo_material, str) or not tipo_material.strip():
+        raise ValueError("tipo_material inválido")
+    if not isinstance(color, str) or not color.strip():
+        raise ValueError("color inválido")
+    if isinstance(cantidad, bool) or not isinstance(cantidad, int) or not 1 <= cantidad <= MAX_CANTIDAD_ENVIO_LOCAL:
+        raise ValueError(f"cantidad inválida (1 a {MAX_CANTIDAD_ENVIO_LOCAL})")
+    if isinstance(maquina_id, bool) or not isinstance(maquina_id, int):
+        raise ValueError("maquina_id inválido")
+    
+    es_grande = bool(pedido.get("es_grande", False))
+    return {
+        "id": str(pedido.get("id") or f"local-{uuid.uuid4().hex}"),
+        "maquina_id": maquina_id,
+        "tipo_material": tipo_material,
+        "etiqueta_chica": None if es_grande else color,
+        "etiqueta_grande": color if es_grande else None,
+        "cantidad_chicas": 0 if es_grande else cantidad,
+        "cantidad_grandes": cantidad if es_grande else 0,
+        "operador": str(pedido.get("operador") or "Local"),
+        "timestamp": int(time.time() * 1000),
+    }
+
+class ManejadorEnvioLocal(socketserver.StreamRequestHandler):
+    """Atiende los pedidos de una conexión al socket, uno por línea."""
+
+    def handle(self):
+        for linea in self.rfile:
+            if not linea.strip():
+                continue
+            try:
+                pedido = json.loads(linea)
+            except ValueError:
+                pedido = None
+            try:
+                respuesta = servidor_envio_local.atender(pedido)
+            except ValueError as e:
+                respuesta = {"ok": False, "error": str(e)}
+            except Exception as e:
+                log_error("Error al atender un pedido local", e)
+                respuesta = {"ok": False, "error": "error interno"}
+            self.wfile.write(json.dumps(respuesta, ensure_ascii=False).encode('utf-8') + b"\n")
+            self.wfile.flush()
+
+class ServidorEnvioLocal:
+    """
+    Recibe trabajos por un socket Unix y se los entrega al núcleo que esté corriendo.
+    El núcleo (asíncrono o clásico) define el receptor al iniciar, y también lo usa el envío
+    directo desde el dashboard: receptor(impresion, al_terminar) -> False si ya estaba en curso.
+    """
+
+    def __init__(self, ruta: str = SOCKET_ENVIO_LOCAL):
+        self.ruta = ruta
+        self.receptor = None
+        self.servidor = None
+
+    def atender(self, pedido: Dict) -> Dict:
+        """Procesa un pedido ya decodificado. Returns: La respuesta a devolver."""
+        if not isinstance(pedido, dict):
+            raise ValueError("el pedido debe ser un objeto JSON por línea")
+        accion = pedido.get("accion", "imprimir")
+        if accion == "estado":
+            cupo = cupo_horario_restante()
+            return {"ok": True, "etiquetas_en_hora": LIMITE_ETIQUETAS_POR_HORA - cupo,
+                    "limite": LIMITE_ETIQUETAS_POR_HORA, "cupo_restante": cupo}
+        if accion != "imprimir":
+            raise ValueError(f"acción desconocida: {accion}")
+        if self.receptor is None:
+            return {"ok": False, "error": "servicio iniciando"}
+        
+        impresion = crear_impresion_local(pedido)
+        cantidad = impresion["cantidad_chicas"] + impresion["cantidad_grandes"]
+        cupo = cupo_horario_restante()
+        if cupo < cantidad:
+            metricas.incrementar("gst3d_envios_locales_total", {"resultado": "limite"})
+            return {"ok": False, "error": "limite", "cupo_restante": cupo}
+        
+        resultado = {}
+        terminado = threading.Event()
+        
+        def al_terminar(exito: bool):
+            resultado["exito"] = exito
+            terminado.set()
+        
+        if not self.receptor(impresion, al_terminar):
+            metricas.incrementar("gst3d_envios_locales_total", {"resultado": "duplicado"})
+            return {"ok": False, "error": "duplicado", "id": impresion["id"]}
+        metricas.incrementar("gst3d_envios_locales_total", {"resultado": "aceptado"})
+        
+        respuesta = {"ok": True, "id": impresion["id"]}
+        if pedido.get("esperar"):
+            if terminado.wait(ESPERA_MAXIMA_ENVIO_LOCAL):
+                respuesta["exito"] = resultado["exito"]
+            else:
+                respuesta["pendiente"] = True
+        respuesta["cupo_restante"] = cupo_horario_restante()
+        return respuesta
+
+    def _socket_en_uso(self) -> bool:
+        """True si otro proceso ya atiende el socket (un servicio duplicado)."""
+        prueba = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            prueba.connect(self.ruta)
+            return True
+        except OSError:
+            return False
+        finally:
+            prueba.close()
+
+    def iniciar(self):
+        """Abre el socket en un hilo propio (una sola vez). El receptor lo define el núcleo antes."""
+        if self.servidor is not None:
+            return
+        try:
+            if os.path.exists(self.ruta):
+                if self._socket_en_uso():
+                    log_error(f"El socket {self.ruta} ya está en uso por otro proceso. Envío local desactivado")
+                    return
+                os.unlink(self.ruta)  # Quedó de una ejecución anterior
+            servidor = socketserver.ThreadingUnixStreamServer(self.ruta, ManejadorEnvioLocal)
+            os.chmod(self.ruta, 0o660)
+        except OSError as e:
+            log_error(f"No se pudo abrir el socket de envío local {self.ruta}", e)
+            return
+        servidor.daemon_threads = True
+        self.servidor = servidor
+        threading.Thread(target=servidor.serve_forever, name="envio-local", daemon=True).start()
+        atexit.register(self.detener)
+        log_info(f"📥 Envío local de trabajos en {self.ruta}")
+
+    def detener(self):
+        """Cierra el socket y borra el archivo."""
+        if self.servidor is None:
+            return
+        self.servidor.shutdown()
+        self.servidor.server_close()
+        self.servidor = None
+        try:
+            os.unlink(self.ruta)
+        except OSError:
+            pass
+
+servidor_envio_local = ServidorEnvioLocal()
+
+# Bucle clásico: los trabajos locales esperan en esta cola y se imprimen entre consultas
+cola_trabajos_locales: queue.Queue = queue.Queue()
+
+def recibir_trabajo_local_sincrono(impresion: Dict, al_terminar) -> bool:
+    """Receptor del bucle clásico: encola el trabajo para atenderlo en el hilo principal."""
+    cola_trabajos_locales.put((impresion, al_terminar))
+    return True
+
+def procesar_impresion_local(impresion: Dict, al_terminar):
+    """Imprime un trabajo local en el hilo actual y avisa el resultado."""
+    exito = True
+    with iniciar_traza("impresion", impresion_id=impresion.get('id'), maquina_id=impresion.get('maquina_id'),
+                       origen="local") as span_impresion:
+        log_info(f"Procesando trabajo local {impresion.get('id')} (Op: {impresion.get('operador')})")
+        for _, es_grande, color, cantidad in partes_impresion(impresion):
+            try:
+                with abrir_span(f"imprimir_{'grandes' if es_grande else 'chicas'}", cantidad=cantidad):
+                    exito = imprimir_etiqueta(
+                        impresion.get('tipo_material'), color, es_grande, cantidad,
+                        impresion.get('maquina_id'), impresion.get('operador'), impresion.get('id')
+                    ) and exito
+            except Exception as e:
+                log_error(f"Error al imprimir etiquetas {'grandes' if es_grande else 'chicas'} del trabajo local", e)
+                exito = False
+        span_impresion.agregar_atributos(exito=exito)
+    al_terminar(exito)
+
+def esperar_atendiendo_trabajos_locales(segundos: float):
+    """
+    Duerme hasta `segundos` (bucle clásico), imprimiendo los trabajos locales que lleguen
+    mientras tanto. Los que ya estaban encolados se imprimen aunque no haya espera.
+    """
+    limite = time.monotonic() + segundos
+    while True:
+        restante = limite - time.monotonic()
+        try:
+            if restante > 0:
+                impresion, al_terminar = cola_trabajos_locales.get(timeout=restante)
+            else:
+                impresion, al_terminar = cola_trabajos_locales.get_nowait()
+        except queue.Empty:
+            return
+        procesar_impresion_local(impresion, al_terminar)
+
+# ============================================================================
+# ENVÍO DIRECTO DESDE EL DASHBOARD (RED LOCAL)
+# ============================================================================
+# El dashboard manda la misma fila que insertaría en `impresiones` (con su id) a
+# POST /impresiones. El trabajo entra al planificador como uno local y la fila se
+# escribe en Supabase en segundo plano: primero 'pendiente', después el estado final.
+# El polling ignora esos ids, así una fila que llega por los dos caminos se imprime una sola vez.
+
+COLUMNAS_IMPRESION_DIRECTA = ("id", "maquina_id", "tipo_material", "etiqueta_chica", "etiqueta_grande",
+                              "operador", "fecha", "timestamp", "cantidad_chicas", "cantidad_grandes")
+
+metricas.describir("gst3d_envios_directos_total", "counter", "Impresiones recibidas directamente desde el dashboard")
+
+class IdsRecientes:
+    """Conjunto acotado de ids: al pasar el máximo se olvidan los más viejos."""
+
+    def __init__(self, maximo: int = MAX_IDS_DIRECTOS_RECORDADOS):
+        self.maximo = maximo
+        self._ids = set()
+        self._orden = deque()
+        self._lock = threading.Lock()
+
+    def agregar(self, impresion_id: str) -> bool:
+        """Returns: False si el id ya estaba."""
+        with self._lock:
+            if impresion_id in self._ids:
+                return False
+            self._ids.add(impresion_id)
+            self._orden.append(impresion_id)
+            while len(self._orden) > self.maximo:
+                self._ids.discard(self._orden.popleft())
+            return True
+
+    def __contains__(self, impresion_id) -> bool:
+        with self._lock:
+            return impresion_id in self._ids
+
+ids_impresiones_directas = IdsRecientes()
+
+class EscritorImpresionesDirectas:
+    """
+    Escribe en segundo plano las filas de `impresiones` de los trabajos recibidos por la red local.
+    Las escrituras de un mismo id se combinan (gana el último estado) y se envían con upsert
+    por id, así reenviar una fila no la duplica. Lo pendiente se persiste en
+    ARCHIVO_IMPRESIONES_DIRECTAS para sobrevivir reinicios y cortes de internet; las filas
+    que Supabase rechaza por sus datos van a ARCHIVO_IMPRESIONES_DIRECTAS_RECHAZADAS.
+    """
+
+    def __init__(self, ruta: str = ARCHIVO_IMPRESIONES_DIRECTAS, intervalo: float = INTERVALO_REINTENTO_DIRECTAS,
+                 ruta_rechazadas: str = ARCHIVO_IMPRESIONES_DIRECTAS_RECHAZADAS):
+        self.ruta = ruta
+        self.ruta_rechazadas = ruta_rechazadas
+        self.intervalo = intervalo
+        self.pendientes: Dict[str, Dict] = {}
+        self._lock = threading.Lock()
+        self._hay_pendientes = threading.Event()
+        self._hilo: Optional[threading.Thread] = None
+
+    def cargar(self):
+        """Recupera las filas que quedaron sin escribir en la ejecución anterior."""
+        try:
+            if os.path.exists(self.ruta):
+                with open(self.ruta, "r", encoding='utf-8') as f:
+                    self.pendientes = json.load(f) or {}
+                if self.pendientes:
+                    log_info(f"{len(self.pendientes)} impresión(es) directas pendientes de escribir recuperadas del disco")
+                    for impresion_id in self.pendientes:
+                        ids_impresiones_directas.agregar(impresion_id)
+        except Exception as e:
+            log_error("Error al cargar impresiones directas pendientes", e)
+
+    def _persistir(self):
+        """Guarda las filas pendientes. Llamar con self._lock tomado."""
+        try:
+            guardar_json_atomico(self.ruta, self.pendientes)
+        except Exception as e:
+            log_error("Error al guardar impresiones directas pendientes", e)
+
+    def registrar(self, fila: Dict):
+        """Deja una fila completa para escribir en Supabase (reemplaza a la pendiente del mismo id)."""
+        with self._lock:
+            self.pendientes[fila["id"]] = fila
+            self._persistir()
+        self._hay_pendientes.set()
+
+    def enviar(self) -> bool:
+        """
+        Escribe todas las filas pendientes en un solo upsert.
+        Returns: True si no quedó nada pendiente
+        """
+        with self._lock:
+            lote = list(self.pendientes.values())
+        if not lote:
+            return True
+        
+        try:
+            if not reconectar_supabase_si_es_necesario():
+                return False
+            supabase_client.table('impresiones').upsert(lote, on_conflict='id').execute()
+            escritas = lote
+        except Exception as e:
+            if not es_error_de_datos(e):
+                log_warning(f"No se pudieron escribir {len(lote)} impresión(es) directas, se reintentará: {e}")
+                return False
+            # Una fila inválida no puede frenar a las demás: se reintenta de a una
+            log_warning(f"Supabase rechazó el lote de {len(lote)} impresión(es) directas, se escriben de a una: {e}")
+            escritas = self._enviar_de_a_una(lote)
+        
+        with self._lock:
+            for fila in escritas:
+                # Si mientras tanto llegó un estado nuevo, queda para la próxima vuelta
+                if self.pendientes.get(fila["id"]) is fila:
+                    del self.pendientes[fila["id"]]
+            self._persistir()
+            return len(escritas) == len(lote) and not self.pendientes
+
+    def _enviar_de_a_una(self, lote: List[Dict]) -> List[Dict]:
+        """
+        Escribe las filas una por una; las que Supabase rechaza por sus datos se apartan.
+        Returns: Las filas que ya no hay que reintentar (escritas o apartadas)
+        """
+        resueltas = []
+        for fila in lote:
+            try:
+                supabase_client.table('impresiones').upsert([fila], on_conflict='id').execute()
+            except Exception as e:
+                if not es_error_de_datos(e):
+                    log_warning(f"No se pudo escribir la impresión directa {fila['id']}, se reintentará: {e}")
+                    break
+                self._apartar(fila, e)
+            resueltas.append(fila)
+        return resueltas
+
+    def _apartar(self, fila: Dict, error: Exception):
+        """Guarda en el archivo de rechazadas una fila que Supabase no acepta, para revisarla a mano."""
+        log_error(f"Supabase rechazó la impresión directa {fila['id']}; se aparta en {self.ruta_rechazadas}", error)
+        try:
+            os.makedirs(os.path.dirname(self.ruta_rechazadas), exist_ok=True)
+            with open(self.ruta_rechazadas, "a", encoding='utf-8') as f:
+                json.dump({"fecha": datetime.now().isoformat(), "error": str(error), "fila": fila}, f, ensure_ascii=False)
+                f.write("\n")
+        except Exception as e:
+            log_error("Error al guardar impresión directa rechazada", e)
+
+    def _bucle(self):
+        while True:
+            self._hay_pendientes.wait()
+            self._hay_pendientes.clear()
+            try:
+                if not self.enviar():
+                    time.sleep(self.intervalo)
+                    self._hay_pendientes.set()
+            except Exception as e:
+                log_error("Error en la escritura de impresiones directas", e)
+                time.sleep(self.intervalo)
+                self._hay_pendientes.set()
+
+    def iniciar(self):
+        """Recupera lo pendiente y arranca el hilo de escritura."""
+        if self._hilo is None:
+            self.cargar()
+            self._hilo = threading.Thread(target=self._bucle, name="impresiones-directas", daemon=True)
+            self._hilo.start()
+            atexit.register(self.enviar)
+            if self.pendientes:
+                self._hay_pendientes.set()
+
+escritor_impresiones_directas = EscritorImpresionesDirectas()
+
+def es_error_de_datos(error: Exception) -> bool:
+    """True si Supabase rechazó las filas por su contenido (clases SQLSTATE 22 y 23); reintentar no sirve."""
+    return isinstance(error, APIError) and str(error.code or "").startswith(("22", "23"))
+
+def firmar_token_lan(vence: int) -> str:
+    """Firma de un token de sesión: HMAC-SHA256 de "impresion-lan:<vence>" con SECRETO_ENVIO_LAN."""
+    return hmac.new(SECRETO_ENVIO_LAN.encode('utf-8'), f"impresion-lan:{vence}".encode('utf-8'), "sha256").hexdigest()
+
+def token_lan_valido(cabecera: Optional[str]) -> bool:
+    """
+    Valida "Bearer <vence>.<firma>": la firma tiene que coincidir (en tiempo constante) y el
+    vencimiento (epoch en segundos) tiene que estar entre ahora y DURACION_MAXIMA_TOKEN_LAN.
+    """
+    if not SECRETO_ENVIO_LAN or not cabecera or not cabecera.startswith("Bearer "):
+        return False
+    vence, _, firma = cabecera[len("Bearer "):].partition(".")
+    if not vence.isdigit():
+        return False
+    ahora = time.time()
+    if not ahora < int(vence) <= ahora + DURACION_MAXIMA_TOKEN_LAN:
+        return False
+    return hmac.compare_digest(firma.encode('utf-8'), firmar_token_lan(int(vence)).encode('utf-8'))
+
+def validar_impresion_directa(fila) -> Dict:
+    """
+    Valida la fila enviada por el dashboard y se queda solo con las columnas de `impresiones`.
+    Lanza ValueError si la fila es inválida.
+    """
+    if not isinstance(fila, dict):
+        raise ValueError("se esperaba un objeto JSON")
+    impresion = {columna: fila.get(columna) for columna in COLUMNAS_IMPRESION_DIRECTA}
+    if not isinstance(impresion["id"], str) or not impresion["id"].strip():
+        raise ValueError("id inválido")
+    if not isinstance(impresion["tipo_material"], str) or not impresion["tipo_material"].strip():
+        raise ValueError("tipo_material inválido")
+    for columna in ("maquina_id", "cantidad_chicas", "cantidad_grandes"):
+        valor = impresion[columna]
+        if isinstance(valor, bool) or not isinstance(valor, int) or valor < 0:
+            raise ValueError(f"{columna} inválido")
+    for columna in ("etiqueta_chica", "etiqueta_grande"):
+        # En `impresiones` las dos columnas son NOT NULL
+        if not isinstance(impresion[columna], str) or not impresion[columna].strip():
+            raise ValueError(f"{columna} inválido")
+    if impresion["cantidad_chicas"] + impresion["cantidad_grandes"] > 2 * MAX_CANTIDAD_ENVIO_LOCAL:
+        raise ValueError("demasiadas etiquetas en una impresión")
+    if not isinstance(impresion["timestamp"], int) or isinstance(impresion["timestamp"], bool):
+        impresion["timestamp"] = int(time.time() * 1000)
+    if not isinstance(impresion["fecha"], str):
+        impresion["fecha"] = datetime.now().isoformat()
+    impresion["operador"] = str(impresion["operador"] or "Desconocido")
+    return impresion
+
+def atender_impresion_directa(fila) -> tuple:
+    """
+    Recibe una impresión del dashboard, la pone a imprimir y agenda su escritura en Supabase.
+    Returns: (código HTTP, respuesta)
+    """
+    impresion = validar_impresion_directa(fila)
+    impresion_id = impresion["id"]
+    if impresion_id in ids_impresiones_directas:
+        metricas.incrementar("gst3d_envios_directos_total", {"resultado": "duplicado"})
+        return 200, {"ok": True, "id": impresion_id, "duplicado": True}
+    if servidor_envio_local.receptor is None:
+        return 503, {"ok": False, "error": "servicio iniciando"}
+    
+    cantidad = sum(cantidad for _, _, _, cantidad in partes_impresion(impresion))
+    cupo = cupo_horario_restante()
+    if cupo < cantidad:
+        # El dashboard la inserta como siempre y la toma el polling cuando haya cupo
+        metricas.incrementar("gst3d_envios_directos_total", {"resultado": "limite"})
+        return 429, {"ok": False, "error": "limite", "cupo_restante": cupo}
+    
+    if not ids_impresiones_directas.agregar(impresion_id):
+        return 200, {"ok": True, "id": impresion_id, "duplicado": True}
+    escritor_impresiones_directas.registrar(dict(impresion, estado='pendiente'))
+    
+    def al_terminar(exito: bool):
+        escritor_impresiones_directas.registrar(dict(impresion, estado='impresa' if exito else 'error'))
     
+    if not servidor_envio_local.receptor(impresion, al_terminar):
+        return 200, {"ok": True, "id": impresion_id, "duplicado": True}
+    metricas.incrementar("gst3d_envios_directos_total", {"resultado": "aceptado"})
+    log_info(f"📨 Impresión {impresion_id} recibida directamente del dashboard")
+    return 202, {"ok": True, "id": impresion_id, "cupo_restante": cupo_horario_restante()}
+
+# ============================================================================
+# NÚCLEO ASÍNCRONO DEL SERVICIO
+# ============================================================================
+
+class NucleoServicio:
+    """
+    Ejecuta el servicio como tareas cooperativas sobre un único event loop:
+    intake de trabajos, un emisor por impresora, escritura de estados,
+    y heartbeat. La verificación de archivos PRN corre en su propio hilo.
+    Las llamadas bloqueantes (Supabase, lp, archivos) corren en executors dedicados.
+    """
+
+    def __init__(self):
+        self.colas_impresoras: Dict[str, asyncio.Queue] = {}
+        self.executors_impresoras: Dict[str, ThreadPoolExecutor] = {}
+        self.executor_supabase = ThreadPoolExecutor(max_workers=2, thread_name_prefix="supabase")
+        self.cola_estados: Optional[asyncio.Queue] = None
+        self.en_curso: Dict[str, Dict] = {}  # impresion_id -> seguimiento del trabajo
+        self.hay_lugar: Optional[asyncio.Event] = None
+        self.loop: Optional[asyncio.AbstractEventLoop] = None
+
+    async def _en_executor(self, executor: ThreadPoolExecutor, funcion, *args):
+        """Ejecuta una función bloqueante sin frenar el event loop."""
+        return await asyncio.get_running_loop().run_in_executor(executor, funcion, *args)
+
+    def _cola_impresora(self, nombre_impresora: str) -> asyncio.Queue:
+        """Devuelve la cola de la impresora, creando su emisor la primera vez."""
+        if nombre_impresora not in self.colas_impresoras:
+            self.colas_impresoras[nombre_impresora] = asyncio.Queue()
+            self.executors_impresoras[nombre_impresora] = ThreadPoolExecutor(
+                max_workers=1, thread_name_prefix=f"impresora-{nombre_impresora}"
+            )
+            asyncio.get_running_loop().create_task(self._tarea_impresora(nombre_impresora))
+        return self.colas_impresoras[nombre_impresora]
+
+    def aceptar_impresion(self, impresion: Dict, al_terminar=None) -> bool:
+        """
+        Reparte un trabajo entre las colas de sus impresoras.
+        Si se pasa `al_terminar` (trabajos locales), el estado final se le avisa a esa
+        función en vez de escribirse en Supabase.
+        Returns: False si el trabajo ya estaba en curso
+        """
+        impresion_id = impresion.get('id')
+        if impresion_id in self.en_curso:
+            return False
+        if al_terminar is None and impresion_id in ids_impresiones_directas:
+            return False  # Ya entró directo desde el dashboard
+        
+        partes = partes_impresion(impresion)
+        seguimiento = {
+            "impresion": impresion, "partes_pendientes": len(partes), "exito": True, "al_terminar": al_terminar,
+            "span": iniciar_traza("impresion", impresion_id=impresion_id, maquina_id=impresion.get('maquina_id'),
+                                  consulta_pendientes_ms=duracion_ultima_consulta_ms),
+        }
+        self.en_curso[impresion_id] = seguimiento
+        if len(self.en_curso) >= MAX_IMPRESIONES_EN_CURSO:
+            self.hay_lugar.clear()
+        
+        log_info(f"Procesando impresión {impresion_id}")
+        log_info(f"  Máquina: {impresion.get('maquina_id')} | Operador: {impresion.get('operador', 'Desconocido')}")
+        
+        if not partes:
+            self._finalizar(impresion_id, 'impresa')
+        for nombre_impresora, es_grande, color, cantidad in partes:
+            self._cola_impresora(nombre_impresora).put_nowait((seguimiento, es_grande, color, cantidad))
+        return True
+
+    async def _tarea_intake(self):
+        """Busca trabajos pendientes y los reparte entre las impresoras."""
+        global impresiones_pendientes_vistas
+        
+        while True:
+            espera = planificador_polling.intervalo_base
+            try:
+                await self.hay_lugar.wait()
+                hacer_heartbeat()
+                impresiones = await self._en_executor(self.executor_supabase, obtener_impresiones_pendientes)
+                nuevas = [imp for imp in impresiones if self.aceptar_impresion(imp)]
+                if nuevas:
+                    log_info(f"📋 Encontradas {len(nuevas)} impresión(es) pendiente(s)")
+                vistas = len(impresiones)
+                if len(impresiones) >= TAMANO_PAGINA_PENDIENTES:
+                    vistas += await self._drenar_backlog(clave_impresion(impresiones[-1]))
+                impresiones_pendientes_vistas = vistas
+                espera = planificador_polling.registrar_consulta(
+                    len(impresiones), TAMANO_PAGINA_PENDIENTES, aceptadas=len(nuevas)
+                )
+            except Exception as e:
+                log_error("Error en la tarea de intake", e)
+            await asyncio.sleep(espera)
+
+    async def _drenar_backlog(self, cursor: tuple):
+        """
+        Recorre el backlog de pendientes por keyset a partir de `cursor` y lo va
+        entregando a las impresoras a medida que hay lugar, sin esperar al polling.
+        Returns: Cantidad de pendientes recorridas (incluidas las que ya estaban en curso)
+        """
+        tamano = TAMANO_PAGINA_PENDIENTES
+        total = 0
+        vistas = 0
+        log_info("📦 Backlog detectado, drenando pendientes...")
+        while True:
+            inicio = time.monotonic()
+            pagina = await self._en_executor(
+                self.executor_supabase, obtener_impresiones_pendientes, cursor, tamano
+            )
+            latencia = time.monotonic() - inicio
+            vistas += len(pagina)
+            
+            for impresion in pagina:
+                await self.hay_lugar.wait()
+                if self.aceptar_impresion(impresion):
+                    total += 1
+            
+            if len(pagina) < tamano:
+                break
+            cursor = clave_impresion(pagina[-1])
+            tamano = ajustar_tamano_pagina(tamano, latencia, pagina_llena=True)
+        log_info(f"📦 Drenaje terminado: {total} impresión(es) encoladas")
+        return vistas
+
+    async def _tarea_impresora(self, nombre_impresora: str):
+        """Emisor de una impresora: imprime sus partes en orden de llegada."""
+        cola = self.colas_impresoras[nombre_impresora]
+        executor = self.executors_impresoras[nombre_impresora]
+        while True:
+            seguimiento, es_grande, color, cantidad = await cola.get()
+            impresion = seguimiento["impresion"]
+            span_parte = seguimiento["span"].hijo(
+                f"imprimir_{'grandes' if es_grande else 'chicas'}", cantidad=cantidad, impresora=nombre_impresora
+            )
+            try:
+                exito = await self._en_executor(
+                    executor, ejecutar_con_span, span_parte, imprimir_etiqueta,
+                    impresion.get('tipo_material'), color, es_grande, cantidad,
+                    impresion.get('maquina_id'), impresion.get('operador', 'Desconocido'),
+                    impresion.get('id')
+                )
+            except Exception as e:
+                log_error(f"Error al imprimir etiquetas {'grandes' if es_grande else 'chicas'} en {nombre_impresora}", e)
+                exito = False
+            span_parte.terminar(exito=exito)
+            
+            seguimiento["exito"] = seguimiento["exito"] and exito
+            seguimiento["partes_pendientes"] -= 1
+            if seguimiento["partes_pendientes"] == 0:
+                estado_final = 'impresa' if seguimiento["exito"] else 'error'
+                self._finalizar(impresion.get('id'), estado_final)
+
+    def _finalizar(self, impresion_id: str, estado_final: str):
+        """Entrega el estado final: a la escritura en lote, o al que envió el trabajo local."""
+        seguimiento = self.en_curso.get(impresion_id)
+        if seguimiento is None or seguimiento["al_terminar"] is None:
+            self.cola_estados.put_nowait((impresion_id, estado_final))
+            return
+        
+        del self.en_curso[impresion_id]
+        observar_latencia_cola(seguimiento["impresion"])
+        seguimiento["span"].terminar(exito=estado_final == 'impresa')
+        try:
+            seguimiento["al_terminar"](estado_final == 'impresa')
+        except Exception as e:
+            log_error(f"Error al avisar el resultado del trabajo local {impresion_id}", e)
+        log_success(f"Trabajo {impresion_id} terminado: {estado_final}")
+        if len(self.en_curso) < MAX_IMPRESIONES_EN_CURSO:
+            self.hay_lugar.set()
+
+    async def _aceptar_local(self, impresion: Dict, al_terminar) -> bool:
+        return self.aceptar_impresion(impresion, al_terminar)
+
+    def recibir_trabajo_local(self, impresion: Dict, al_terminar) -> bool:
+        """Receptor del envío local: pasa el trabajo al event loop desde el hilo del socket."""
+        return asyncio.run_coroutine_threadsafe(self._aceptar_local(impresion, al_terminar), self.loop).result()
+
+    def _escribir_estados(self, estados: Dict[str, List[str]]):
+        """Escribe en Supabase un lote de estados finales (una consulta por estado)."""
+        if not reconectar_supabase_si_es_necesario():
+            raise ConnectionError("Sin conexión a Supabase")
+        for estado_final, ids in estados.items():
+            supabase_client.table('impresiones').update({
+                'estado': estado_final
+            }).in_('id', ids).execute()
+
+    async def _tarea_estados(self):
+        """Agrupa los estados finales que van llegando y los escribe en lote."""
+        while True:
+            lote = [await self.cola_estados.get()]
+            while not self.cola_estados.empty():
+                lote.append(self.cola_estados.get_nowait())
+            
+            estados: Dict[str, List[str]] = {}
+            spans_estado = []
+            for impresion_id, estado_final in lote:
+                estados.setdefault(estado_final, []).append(impresion_id)
+                seguimiento = self.en_curso.get(impresion_id)
+                if seguimiento:
+                    spans_estado.append(seguimiento["span"].hijo("actualizar_estado", estado=estado_final, lote=len(lote)))
+            
+            while True:
+                try:
+                    await self._en_executor(self.executor_supabase, self._escribir_estados, estados)
+                    break
+                except Exception as e:
+                    log_warning(f"Error al actualizar {len(lote)} estado(s), reintentando en {ESPERA_REINTENTO} segundos: {e}")
+                    await asyncio.sleep(ESPERA_REINTENTO)
+            
+            for span_estado in spans_estado:
+                span_estado.terminar()
+            for impresion_id, estado_final in lote:
+                seguimiento = self.en_curso.pop(impresion_id, None)
+                if seguimiento:
+                    observar_latencia_cola(seguimiento["impresion"])
+                    seguimiento["span"].terminar(exito=estado_final == 'impresa')
+                log_success(f"Estado de {impresion_id} actualizado a: {estado_final}")
+            if len(self.en_curso) < MAX_IMPRESIONES_EN_CURSO:
+                self.hay_lugar.set()
+
+    async def _tarea_heartbeat(self):
+        """Heartbeat periódico del servicio."""
+        while True:
+            hacer_heartbeat()
+            await asyncio.sleep(INTERVALO_HEARTBEAT)
+
+    async def ejecutar(self):
+        """Inicializa el servicio y corre todas las tareas - NUNCA SE CIERRA."""
+        await self._en_executor(self.executor_supabase, inicializar_servicio)
+        
+        self.loop = asyncio.get_running_loop()
+        self.cola_estados = asyncio.Queue()
+        self.hay_lugar = asyncio.Event()
+        self.hay_lugar.set()
+        metricas.gauge("gst3d_impresiones_en_curso", "Impresiones aceptadas que todavía no tienen estado final",
+                       lambda: len(self.en_curso))
+        
+        log_info("")
+        log_info(f"🔄 Iniciando núcleo asíncrono (polling cada {INTERVALO_POLLING} segundos)...")
+        log_info("   El servicio NUNCA se cerrará automáticamente")
+        log_info("   Presiona Ctrl+C para detener manualmente")
+        log_info("")
+        
+        for nombre_impresora in (NOMBRE_IMPRESORA_CHICAS, NOMBRE_IMPRESORA_GRANDES):
+            self._cola_impresora(nombre_impresora)
+        
+        servidor_envio_local.receptor = self.recibir_trabajo_local
+        if ENVIO_LOCAL_ACTIVO:
+            servidor_envio_local.iniciar()
+        
+        await asyncio.gather(
+            self._tarea_intake(),
+            self._tarea_estados(),
+            self._tarea_heartbeat(),
+        )
+
+# ============================================================================
+# BUCLE PRINCIPAL ULTRA ROBUSTO
+# ============================================================================
+
+def inicializar_servicio():
+    """Muestra la configuración, carga el estado local y conecta a Supabase."""
     log_info("=" * 70)
     log_info("🚀 Servicio de Impresión de Etiquetas GST3D - Versión Robusta")
     log_info("=" * 70)
@@ -609,7 +2971,7 @@ def main():
     log_info(f"Ruta plantillas: {RUTA_PRN}")
     log_info(f"Impresora etiquetas chicas: {NOMBRE_IMPRESORA_CHICAS}")
     log_info(f"Impresora etiquetas grandes: {NOMBRE_IMPRESORA_GRANDES}")
-    log_info(f"Intervalo de polling: {INTERVALO_POLLING} segundos")
+    log_info(f"Intervalo de polling: {INTERVALO_POLLING} segundos (hasta {INTERVALO_POLLING_MAXIMO} sin trabajos)")
     log_info("=" * 70)
     
     # Cargar estado inicial
@@ -627,9 +2989,45 @@ def main():
         except Exception as e:
             log_error(f"No se pudo crear la carpeta {RUTA_PRN}", e)
 
-    # Verificar archivos PRN faltantes al inicio
-    log_info("🔍 Verificando archivos PRN...")
-    verificar_archivos_prn_faltantes()
+    # Verificar archivos PRN faltantes en segundo plano (la primera vez, de inmediato)
+    log_info("🔍 Verificando archivos PRN en segundo plano...")
+    verificador_prn.iniciar()
+    
+    # Envío agrupado del contador de etiquetas impresas
+    if ACTUALIZAR_CONTADOR_ETIQUETAS:
+        contador_etiquetas_impresas.iniciar()
+    
+    # Subida en lote del log local de etiquetas
+    if SUBIR_REGISTROS_ETIQUETAS:
+        subidor_registros.iniciar()
+    
+    # Envío en lote de los deltas de stock
+    if ACTUALIZAR_STOCK_DESDE_SERVICIO:
+        acumulador_stock.iniciar()
+    
+    # Escritura en lote de las trazas
+    if TRAZAS_ACTIVAS:
+        exportador_trazas.iniciar()
+    
+    # Envío directo desde el dashboard: escritura en segundo plano de sus filas
+    if ENVIO_LAN_ACTIVO:
+        if not SECRETO_ENVIO_LAN or not ORIGEN_PERMITIDO_LAN:
+            log_warning("ENVIO_LAN_ACTIVO sin GST3D_SECRETO_ENVIO_LAN o GST3D_ORIGEN_DASHBOARD: el endpoint /impresiones rechazará todos los pedidos")
+        escritor_impresiones_directas.iniciar()
+    
+    # Endpoint de métricas y salud (también atiende el envío directo)
+    if SERVIDOR_METRICAS_ACTIVO or ENVIO_LAN_ACTIVO:
+        iniciar_servidor_metricas()
+
+def main_sincrono():
+    """Bucle de polling clásico, un trabajo a la vez - NUNCA SE CIERRA."""
+    global conteo_errores_consecutivos
+    global impresiones_pendientes_vistas
+    
+    inicializar_servicio()
+    servidor_envio_local.receptor = recibir_trabajo_local_sincrono
+    if ENVIO_LOCAL_ACTIVO:
+        servidor_envio_local.iniciar()
 
     log_info("")
     log_info(f"🔄 Iniciando bucle de polling (cada {INTERVALO_POLLING} segundos)...")
@@ -637,10 +3035,6 @@ def main():
     log_info("   Presiona Ctrl+C para detener manualmente")
     log_info("")
 
-    # Contador para verificaciones periódicas
-    contador_ciclos = 0
-    CICLOS_ENTRE_VERIFICACIONES = 100  # Verificar cada ~100 ciclos (500 segundos)
-
     # BUCLE PRINCIPAL - NUNCA SE SALE A MENOS QUE HAYA KeyboardInterrupt
     while True:
         try:
@@ -648,38 +3042,31 @@ def main():
             
             # Obtener impresiones pendientes
             impresiones = obtener_impresiones_pendientes()
+            impresiones_pendientes_vistas = len(impresiones)  # Acotado a una página en este modo
             
             if impresiones:
                 log_info(f"📋 Encontradas {len(impresiones)} impresión(es) pendiente(s)")
                 
                 for impresion in impresiones:
+                    if impresion.get('id') in ids_impresiones_directas:
+                        continue  # Ya entró directo desde el dashboard
                     try:
                         procesar_impresion_pendiente(impresion)
                         time.sleep(1)  # Pequeña pausa entre impresiones
                     except Exception as e:
                         log_error(f"Error al procesar impresión individual", e)
                         continue  # Continuar con la siguiente impresión
-            else:
-                # Solo mostrar mensaje cada cierto tiempo para no saturar logs
-                tiempo_actual = datetime.now()
-                if tiempo_actual.second < INTERVALO_POLLING:
-                    hacer_heartbeat()
             
-            # Verificación periódica de archivos PRN faltantes
-            contador_ciclos += 1
-            if contador_ciclos >= CICLOS_ENTRE_VERIFICACIONES:
-                contador_ciclos = 0
-                log_info("🔍 Verificación periódica de archivos PRN...")
-                verificar_archivos_prn_faltantes()
-
+            hacer_heartbeat()
+            
             # Reiniciar contador de errores si todo salió bien
             conteo_errores_consecutivos = 0
 
-            # Calcular tiempo de espera (asegurar intervalo mínimo)
+            # Calcular tiempo de espera según la demanda (ráfaga o backoff)
+            intervalo = planificador_polling.registrar_consulta(len(impresiones), TAMANO_PAGINA_PENDIENTES)
             tiempo_ciclo = time.time() - ciclo_inicio
-            tiempo_espera = max(0, INTERVALO_POLLING - tiempo_ciclo)
-            if tiempo_espera > 0:
-                time.sleep(tiempo_espera)
+            tiempo_espera = max(0, intervalo - tiempo_ciclo)
+            esperar_atendiendo_trabajos_locales(tiempo_espera)
                 
         except KeyboardInterrupt:
             log_info("")
@@ -702,6 +3089,14 @@ def main():
                 log_info("Intentando reconectar a Supabase...")
                 conectar_supabase()
 
+def main():
+    """Punto de entrada: núcleo asíncrono por defecto, `--sincrono` para el bucle clásico."""
+    registrar_senales_perfilado()
+    if "--sincrono" in sys.argv:
+        main_sincrono()
+    else:
+        asyncio.run(NucleoServicio().ejecutar())
+
 if __name__ == "__main__":
     try:
         main()
@@ -0,0 +1,197 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Optimizador de plantillas ZPL (.prn) - GST3D
+Reescribe una plantilla en una forma equivalente y más chica:
+  - Gráficos ^GFA en hexadecimal (con o sin la compresión ASCII de ZPL) -> :Z64:
+    (zlib + base64 + CRC-16 del texto codificado)
+  - Comandos de configuración repetidos con el mismo valor -> se eliminan
+  - Saltos de línea y espacios entre comandos -> se eliminan
+
+El servicio lo usa al cargar cada plantilla (ver cargar_plantilla); el archivo original
+no se modifica. También se puede correr a mano para ver cuánto se ahorra:
+
+    python3 optimizador_zpl.py /home/gst3d/Desktop/ETIQUETAS_PRN
+    python3 optimizador_zpl.py BLACK.prn --salida /tmp/optimizadas
+"""
+
+import os
+import re
+import sys
+import zlib
+import base64
+import argparse
+import binascii
+from typing import Optional, List
+
+# ============================================================================
+# CONFIGURACIÓN
+# ============================================================================
+
+# Comandos de configuración que persisten entre formatos: repetirlos con el mismo valor no cambia nada
+COMANDOS_CONFIGURACION = {
+    "~SD", "^MD", "^MM", "^MN", "^MT", "^PR", "^PW", "^LL", "^JM", "^LT", "^LS", "^PO", "^CI", "^LH",
+}
+# Comandos cuyo contenido es dato y no se toca (salvo el salto de línea final)
+COMANDOS_DE_DATOS = {"^FD", "^FV", "^SN", "^FX", "^SF"}
+# Si la plantilla cambia los caracteres de comando, no se optimiza
+COMANDOS_NO_SOPORTADOS = ("^CC", "~CC", "^CT", "~CT", "^CD", "~CD")
+
+_TOKEN = re.compile(r"[\^~][^\^~]*")
+
+# ============================================================================
+# GRÁFICOS
+# ============================================================================
+
+def decodificar_hex_zpl(datos: str, bytes_por_fila: int) -> Optional[bytes]:
+    """
+    Decodifica el hexadecimal de un ^GFA, incluida la compresión ASCII de ZPL
+    (G..Y = 1..19 repeticiones, g..z = 20..400, ',' = resto de la fila en 0,
+    '!' = resto de la fila en 1, ':' = repetir la fila anterior).
+    Returns: Los bytes del gráfico, o None si los datos no se pueden interpretar
+    """
+    ancho = bytes_por_fila * 2
+    filas: List[str] = []
+    fila = ""
+    repeticiones = 0
+
+    def cerrar_fila():
+        nonlocal fila
+        filas.append(fila)
+        fila = ""
+
+    for caracter in datos:
+        if caracter in " \t\r\n":
+            continue
+        if "G" <= caracter <= "Y":
+            repeticiones += ord(caracter) - ord("G") + 1
+        elif "g" <= caracter <= "z":
+            repeticiones += (ord(caracter) - ord("g") + 1) * 20
+        elif caracter in "0123456789ABCDEFabcdef":
+            fila += caracter.upper() * (repeticiones or 1)
+            repeticiones = 0
+            if len(fila) > ancho:
+                return None
+            if len(fila) == ancho:
+                cerrar_fila()
+        elif caracter in ",!":
+            fila = fila.ljust(ancho, "0" if caracter == "," else "F")
+            cerrar_fila()
+        elif caracter == ":":
+            if not filas or fila:
+                return None
+            fila = filas[-1]
+            cerrar_fila()
+        else:
+            return None
+    if fila:
+        return None
+    try:
+        return bytes.fromhex("".join(filas))
+    except ValueError:
+        return None
+
+def codificar_z64(datos: bytes) -> str:
+    """Codifica bytes como :Z64:<base64 de zlib>:<CRC-16 CCITT del base64>."""
+    codificado = base64.b64encode(zlib.compress(datos, 9))
+    return f":Z64:{codificado.decode('ascii')}:{binascii.crc_hqx(codificado, 0):04X}"
+
+def optimizar_grafico(parametros: str) -> str:
+    """
+    Reescribe los parámetros de un ^GF en formato A a :Z64:.
+    Devuelve los parámetros sin cambios si no es ASCII hex, no se puede decodificar o no ahorra nada.
+    """
+    partes = parametros.split(",", 4)
+    if len(partes) != 5 or partes[0].strip().upper() != "A":
+        return parametros
+    datos = partes[4]
+    if datos.lstrip().startswith((":Z64:", ":B64:")):
+        return parametros
+    try:
+        total = int(partes[2])
+        por_fila = int(partes[3])
+    except ValueError:
+        return parametros
+    if por_fila <= 0:
+        return parametros
+
+    crudo = decodificar_hex_zpl(datos, por_fila)
+    if crudo is None or len(crudo) != total:
+        return parametros
+    nuevo = f"A,{total},{total},{por_fila},{codificar_z64(crudo)}"
+    return nuevo if len(nuevo) < len(parametros) else parametros
+
+# ============================================================================
+# PLANTILLA COMPLETA
+# ============================================================================
+
+def optimizar_zpl(zpl: str) -> str:
+    """
+    Devuelve la forma compacta de una plantilla ZPL.
+    Si la plantilla usa algo que el optimizador no entiende, se devuelve sin cambios.
+    """
+    if any(comando in zpl for comando in COMANDOS_NO_SOPORTADOS):
+        return zpl
+
+    prefijo = zpl[:zpl.find("^")] if "^" in zpl else zpl
+    if prefijo.strip():
+        return zpl  # Texto suelto antes del primer comando: no se toca
+
+    tokens = []
+    ultimos_valores = {}
+    for token in _TOKEN.findall(zpl):
+        comando = token[:3].upper()
+        parametros = token[3:]
+        if comando in COMANDOS_DE_DATOS:
+            parametros = parametros.rstrip("\r\n")
+        elif comando == "^GF":
+            parametros = optimizar_grafico(parametros.strip())
+        else:
+            parametros = parametros.strip()
+
+        if comando in COMANDOS_CONFIGURACION:
+            if ultimos_valores.get(comando) == parametros:
+                continue
+            ultimos_valores[comando] = parametros
+        tokens.append(token[:3] + parametros)
+
+    return "".join(tokens) + "\n"
+
+# ============================================================================
+# LÍNEA DE COMANDOS
+# ============================================================================
+
+def main():
+    parser = argparse.ArgumentParser(description="Optimiza plantillas ZPL (.prn)")
+    parser.add_argument("rutas", nargs="+", help="Archivos .prn o carpetas que los contengan")
+    parser.add_argument("--salida", default=None, help="Carpeta donde escribir las plantillas optimizadas")
+    args = parser.parse_args()
+
+    archivos = []
+    for ruta in args.rutas:
+        if os.path.isdir(ruta):
+            archivos.extend(sorted(os.path.join(ruta, n) for n in os.listdir(ruta) if n.endswith(".prn")))
+        else:
+            archivos.append(ruta)
+
+    total_antes = total_despues = 0
+    for archivo in archivos:
+        with open(archivo, "r", encoding='utf-8') as f:
+            original = f.read()
+        optimizada = optimizar_zpl(original)
+        antes, despues = len(original.encode('utf-8')), len(optimizada.encode('utf-8'))
+        total_antes += antes
+        total_despues += despues
+        print(f"{os.path.basename(archivo):<40} {antes:>10} -> {despues:>10} bytes ({(despues / antes - 1) * 100 if antes else 0:+.1f}%)")
+        if args.salida:
+            os.makedirs(args.salida, exist_ok=True)
+            with open(os.path.join(args.salida, os.path.basename(archivo)), "w", encoding='utf-8') as f:
+                f.write(optimizada)
+
+    if not archivos:
+        print("No se encontraron plantillas .prn")
+        sys.exit(1)
+    print(f"{'Total':<40} {total_antes:>10} -> {total_despues:>10} bytes")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,557 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Prueba de carga de punta a punta del servicio de impresión - GST3D
+Levanta en el mismo proceso:
+  1. Un reemplazo de la API REST de Supabase (subconjunto de PostgREST) con la tabla `impresiones`
+  2. Impresoras falsas que aceptan y cuentan etiquetas con un tiempo de impresión configurable
+  3. Un generador de llegadas: patrones sintéticos o la repetición de llegadas reales
+     reconstruidas desde etiquetas_log.json
+
+El servicio corre sin cambios (núcleo asíncrono o bucle clásico) apuntando al reemplazo.
+Al final reporta throughput, espera en cola y latencia de punta a punta.
+
+Uso:
+    python3 prueba_carga_impresion.py --patron turno --maquinas 30
+    python3 prueba_carga_impresion.py --patron poisson --trabajos-por-minuto 20 --duracion 300
+    python3 prueba_carga_impresion.py --replay /home/gst3d/etiquetas_log.json --acelerar 60
+"""
+
+import os
+import re
+import sys
+import json
+import time
+import uuid
+import random
+import asyncio
+import argparse
+import threading
+import tempfile
+from datetime import datetime
+from urllib.parse import urlsplit, parse_qsl
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Optional, Dict, List
+
+import imprimir_etiquetas_servicio as servicio
+from benchmark_etiquetas import preparar_entorno, percentil, PLANTILLA_PRUEBA
+from emulador_zpl import ImpresoraEmulada, DPI, LARGO_ETIQUETA_PUNTOS
+
+# ============================================================================
+# CONFIGURACIÓN
+# ============================================================================
+
+SEGUNDOS_POR_ETIQUETA = 0.5  # Tiempo de impresión simulado por etiqueta
+CANTIDAD_CHICAS = 8
+CANTIDAD_GRANDES = 8
+MAQUINAS = 30
+VENTANA_TURNO = 10  # Segundos en los que llegan los trabajos de un inicio de turno
+TIEMPO_MAXIMO_ESPERA = 1800  # Segundos a esperar que terminen todos los trabajos
+ESTADOS_TERMINADOS = ('impresa', 'error')
+
+# ============================================================================
+# REEMPLAZO DE SUPABASE (SUBCONJUNTO DE POSTGREST)
+# ============================================================================
+
+def _valor_comparable(actual, valor: str):
+    """Convierte el valor del filtro al tipo de la columna para poder compararlo."""
+    valor = valor.strip('"')
+    if isinstance(actual, bool):
+        return valor == "true"
+    if isinstance(actual, (int, float)):
+        try:
+            return float(valor)
+        except ValueError:
+            return valor
+    return valor
+
+def _cumple(fila: Dict, columna: str, operador: str, valor: str) -> bool:
+    actual = fila.get(columna)
+    if operador == "is":
+        return actual is None if valor == "null" else actual == (valor == "true")
+    if operador == "in":
+        opciones = [v.strip().strip('"') for v in valor.strip("()").split(",")]
+        return str(actual) in opciones
+    if actual is None:
+        return False
+    esperado = _valor_comparable(actual, valor)
+    try:
+        return {
+            "eq": actual == esperado, "neq": actual != esperado,
+            "gt": actual > esperado, "gte": actual >= esperado,
+            "lt": actual < esperado, "lte": actual <= esperado,
+        }[operador]
+    except (KeyError, TypeError):
+        return False
+
+def _partir_nivel_superior(texto: str) -> List[str]:
+    """Separa por comas que no estén dentro de paréntesis ni comillas."""
+    partes, actual, profundidad, en_comillas = [], "", 0, False
+    for caracter in texto:
+        if caracter == '"':
+            en_comillas = not en_comillas
+        elif not en_comillas and caracter == "(":
+            profundidad += 1
+        elif not en_comillas and caracter == ")":
+            profundidad -= 1
+        if caracter == "," and profundidad == 0 and not en_comillas:
+            partes.append(actual)
+            actual = ""
+        else:
+            actual += caracter
+    partes.append(actual)
+    return partes
+
+def _cumple_logico(fila: Dict, expresion: str) -> bool:
+    """Evalúa `and(...)`, `or(...)` o `columna.operador.valor` de un filtro or=/and=."""
+    for conector, funcion in (("and(", all), ("or(", any)):
+        if expresion.startswith(conector):
+            return funcion(_cumple_logico(fila, parte) for parte in _partir_nivel_superior(expresion[len(conector):-1]))
+    columna, operador, valor = expresion.split(".", 2)
+    return _cumple(fila, columna, operador, valor)
+
+class BaseDatosFalsa:
+    """Tablas en memoria y el registro de cuándo cambió cada impresión de estado."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.tablas: Dict[str, List[Dict]] = {}
+        self.terminadas: Dict[str, tuple] = {}  # id -> (estado, momento)
+        self.consultas = 0
+
+    def insertar_impresion(self, fila: Dict):
+        with self._lock:
+            self.tablas.setdefault('impresiones', []).append(fila)
+
+    def filtrar(self, tabla: str, parametros: List[tuple]) -> List[Dict]:
+        filas = self.tablas.get(tabla, [])
+        for clave, valor in parametros:
+            if clave in ("select", "order", "limit", "offset", "on_conflict", "columns"):
+                continue
+            if clave in ("or", "and"):
+                expresion = f"{clave}{valor}"
+                filas = [f for f in filas if _cumple_logico(f, expresion)]
+                continue
+            operador, _, argumento = valor.partition(".")
+            filas = [f for f in filas if _cumple(f, clave, operador, argumento)]
+        return filas
+
+    def consultar(self, tabla: str, parametros: List[tuple]) -> List[Dict]:
+        with self._lock:
+            self.consultas += 1
+            filas = list(self.filtrar(tabla, parametros))
+        ordenes = [parte for clave, valor in parametros if clave == "order" for parte in valor.split(",")]
+        for orden in reversed(ordenes):
+            columna, *modificadores = orden.split(".")
+            filas.sort(key=lambda f: (f.get(columna) is None, f.get(columna)), reverse="desc" in modificadores)
+        limite = dict(parametros).get("limit")
+        if limite is not None:
+            filas = filas[:int(limite)]
+        columnas = dict(parametros).get("select", "*")
+        if columnas != "*":
+            nombres = columnas.split(",")
+            filas = [{n: f.get(n) for n in nombres} for f in filas]
+        return filas
+
+    def actualizar(self, tabla: str, parametros: List[tuple], cambios: Dict) -> List[Dict]:
+        ahora = time.monotonic()
+        with self._lock:
+            filas = self.filtrar(tabla, parametros)
+            for fila in filas:
+                fila.update(cambios)
+                if tabla == 'impresiones' and cambios.get('estado') in ESTADOS_TERMINADOS:
+                    self.terminadas.setdefault(fila['id'], (cambios['estado'], ahora))
+            return [dict(f) for f in filas]
+
+    def insertar(self, tabla: str, filas: List[Dict], conflicto: Optional[str], ignorar: bool) -> List[Dict]:
+        with self._lock:
+            existentes = self.tablas.setdefault(tabla, [])
+            if conflicto:
+                indice = {f.get(conflicto): f for f in existentes}
+                for fila in filas:
+                    previa = indice.get(fila.get(conflicto))
+                    if previa is None:
+                        existentes.append(dict(fila))
+                        indice[fila.get(conflicto)] = existentes[-1]
+                    elif not ignorar:
+                        previa.update(fila)
+            else:
+                existentes.extend(dict(f) for f in filas)
+            return filas
+
+    def borrar(self, tabla: str, parametros: List[tuple]) -> List[Dict]:
+        with self._lock:
+            borradas = self.filtrar(tabla, parametros)
+            ids = {id(f) for f in borradas}
+            self.tablas[tabla] = [f for f in self.tablas.get(tabla, []) if id(f) not in ids]
+            return borradas
+
+class ManejadorPostgrest(BaseHTTPRequestHandler):
+    """Atiende /rest/v1/<tabla> (GET, POST, PATCH, DELETE) y /rest/v1/rpc/<función>."""
+    base_datos: BaseDatosFalsa = None
+    protocol_version = "HTTP/1.1"
+
+    def _ruta(self) -> tuple:
+        partes = urlsplit(self.path)
+        return partes.path, parse_qsl(partes.query, keep_blank_values=True)
+
+    def _cuerpo(self):
+        largo = int(self.headers.get("Content-Length") or 0)
+        return json.loads(self.rfile.read(largo)) if largo else None
+
+    def _responder(self, codigo: int, datos=None):
+        cuerpo = json.dumps(datos).encode("utf-8") if datos is not None else b""
+        self.send_response(codigo)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(cuerpo)))
+        self.end_headers()
+        self.wfile.write(cuerpo)
+
+    def _tabla(self, ruta: str) -> Optional[str]:
+        coincidencia = re.match(r"^/rest/v1/([^/]+)$", ruta)
+        return coincidencia.group(1) if coincidencia else None
+
+    def _devolver(self, filas: List[Dict], codigo: int = 200):
+        if "return=representation" in (self.headers.get("Prefer") or ""):
+            self._responder(codigo, filas)
+        else:
+            self._responder(204 if codigo == 200 else codigo)
+
+    def do_GET(self):
+        ruta, parametros = self._ruta()
+        tabla = self._tabla(ruta)
+        if tabla is None:
+            self._responder(404, {"message": "ruta desconocida"})
+            return
+        self._responder(200, self.base_datos.consultar(tabla, parametros))
+
+    def do_PATCH(self):
+        ruta, parametros = self._ruta()
+        self._devolver(self.base_datos.actualizar(self._tabla(ruta), parametros, self._cuerpo() or {}))
+
+    def do_DELETE(self):
+        ruta, parametros = self._ruta()
+        self._devolver(self.base_datos.borrar(self._tabla(ruta), parametros))
+
+    def do_POST(self):
+        ruta, parametros = self._ruta()
+        if ruta.startswith("/rest/v1/rpc/"):
+            # Las funciones del servicio devuelven void: PostgREST responde `null`
+            self._cuerpo()
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", "4")
+            self.end_headers()
+            self.wfile.write(b"null")
+            return
+        filas = self._cuerpo() or []
+        if isinstance(filas, dict):
+            filas = [filas]
+        preferencias = self.headers.get("Prefer") or ""
+        self._devolver(self.base_datos.insertar(
+            self._tabla(ruta), filas, dict(parametros).get("on_conflict"), "ignore-duplicates" in preferencias
+        ), 201)
+
+    def log_message(self, formato, *args):
+        pass
+
+def iniciar_supabase_falso(base_datos: BaseDatosFalsa) -> ThreadingHTTPServer:
+    """Levanta el reemplazo de PostgREST en un puerto libre de localhost."""
+    manejador = type("Manejador", (ManejadorPostgrest,), {"base_datos": base_datos})
+    servidor = ThreadingHTTPServer(("127.0.0.1", 0), manejador)
+    servidor.daemon_threads = True
+    threading.Thread(target=servidor.serve_forever, name="supabase-falso", daemon=True).start()
+    return servidor
+
+# ============================================================================
+# IMPRESORAS FALSAS
+# ============================================================================
+
+ENVIAR_A_IMPRESORA_REAL = servicio.enviar_a_impresora
+
+class ImpresorasFalsas:
+    """Reemplaza enviar_a_impresora: cada impresora atiende una etiqueta a la vez."""
+
+    def __init__(self, segundos_por_etiqueta: float = SEGUNDOS_POR_ETIQUETA):
+        self.segundos_por_etiqueta = segundos_por_etiqueta
+        self._locks: Dict[str, threading.Lock] = {}
+        self._lock = threading.Lock()
+        self.etiquetas: Dict[str, int] = {}
+        self.ocupada: Dict[str, float] = {}
+
+    def enviar(self, nombre_impresora: str, datos: bytes, reintentos: int = 3) -> bool:
+        with self._lock:
+            lock = self._locks.setdefault(nombre_impresora, threading.Lock())
+        with lock:
+            inicio = time.monotonic()
+            time.sleep(self.segundos_por_etiqueta)
+            with self._lock:
+                self.etiquetas[nombre_impresora] = self.etiquetas.get(nombre_impresora, 0) + 1
+                self.ocupada[nombre_impresora] = self.ocupada.get(nombre_impresora, 0) + time.monotonic() - inicio
+        return True
+
+# ============================================================================
+# LLEGADAS
+# ============================================================================
+
+def trabajo(maquina_id: int, tipo: str, color_chica: Optional[str], color_grande: Optional[str],
+            chicas: int, grandes: int) -> Dict:
+    return {
+        "maquina_id": maquina_id, "tipo_material": tipo, "operador": f"Carga {maquina_id}",
+        "etiqueta_chica": color_chica, "etiqueta_grande": color_grande,
+        "cantidad_chicas": chicas if color_chica else 0, "cantidad_grandes": grandes if color_grande else 0,
+    }
+
+def llegadas_sinteticas(patron: str, colores: List[str], maquinas: int, duracion: float,
+                        trabajos_por_minuto: float, chicas: int, grandes: int, rondas: int,
+                        semilla: int) -> List[tuple]:
+    """
+    Genera (segundos desde el inicio, trabajo):
+    - turno: cada máquina envía un trabajo dentro de VENTANA_TURNO, `rondas` veces separadas por `duracion`
+    - poisson: llegadas exponenciales a `trabajos_por_minuto` durante `duracion`
+    - constante: llegadas equiespaciadas a `trabajos_por_minuto` durante `duracion`
+    """
+    aleatorio = random.Random(semilla)
+
+    def nuevo() -> Dict:
+        color = aleatorio.choice(colores)
+        return trabajo(aleatorio.randint(1, maquinas), "PLA", color, f"{color}_GRANDE", chicas, grandes)
+
+    llegadas = []
+    if patron == "turno":
+        for ronda in range(rondas):
+            for maquina_id in range(1, maquinas + 1):
+                color = aleatorio.choice(colores)
+                llegadas.append((ronda * duracion + aleatorio.uniform(0, VENTANA_TURNO),
+                                 trabajo(maquina_id, "PLA", color, f"{color}_GRANDE", chicas, grandes)))
+    elif patron == "poisson":
+        momento = aleatorio.expovariate(trabajos_por_minuto / 60)
+        while momento < duracion:
+            llegadas.append((momento, nuevo()))
+            momento += aleatorio.expovariate(trabajos_por_minuto / 60)
+    else:
+        paso = 60 / trabajos_por_minuto
+        llegadas = [(i * paso, nuevo()) for i in range(int(duracion / paso))]
+    return sorted(llegadas, key=lambda llegada: llegada[0])
+
+def llegadas_desde_log(ruta: str, acelerar: float, desde: Optional[datetime] = None,
+                       hasta: Optional[datetime] = None) -> List[tuple]:
+    """
+    Reconstruye los trabajos reales del log local: agrupa por impresion_id y, en los
+    registros anteriores que no lo tienen, por máquina, material y minuto.
+    El tiempo entre llegadas se divide por `acelerar`.
+    """
+    grupos: Dict[tuple, Dict] = {}
+    with open(ruta, "r", encoding='utf-8') as f:
+        for linea in f:
+            try:
+                registro = json.loads(linea)
+                momento = datetime.strptime(registro["fecha"], "%d/%m/%Y %H:%M:%S")
+            except (ValueError, KeyError):
+                continue
+            if (desde and momento < desde) or (hasta and momento >= hasta):
+                continue
+            clave = (registro.get("impresion_id"),) if registro.get("impresion_id") else \
+                (registro.get("maquina_id"), registro.get("tipo"), momento.replace(second=0))
+            grupo = grupos.setdefault(clave, {
+                "momento": momento, "maquina_id": registro.get("maquina_id") or 0, "tipo": registro.get("tipo") or "PLA",
+                "chica": None, "grande": None, "chicas": 0, "grandes": 0,
+            })
+            grupo["momento"] = min(grupo["momento"], momento)
+            if registro.get("tipo_etiqueta") == "grande":
+                grupo["grande"], grupo["grandes"] = registro.get("color"), grupo["grandes"] + 1
+            else:
+                grupo["chica"], grupo["chicas"] = registro.get("color"), grupo["chicas"] + 1
+
+    if not grupos:
+        return []
+    inicio = min(g["momento"] for g in grupos.values())
+    return sorted((
+        ((g["momento"] - inicio).total_seconds() / acelerar,
+         trabajo(g["maquina_id"], g["tipo"], g["chica"], g["grande"], g["chicas"], g["grandes"]))
+        for g in grupos.values()
+    ), key=lambda llegada: llegada[0])
+
+def asegurar_plantillas(llegadas: List[tuple]):
+    """Crea una plantilla de prueba para cada color que aparezca en las llegadas."""
+    for _, datos in llegadas:
+        for color in (datos["etiqueta_chica"], datos["etiqueta_grande"]):
+            if not color:
+                continue
+            ruta = os.path.join(servicio.RUTA_PRN, f"{color}.prn")
+            if not os.path.exists(ruta):
+                with open(ruta, "w", encoding='utf-8') as f:
+                    f.write(PLANTILLA_PRUEBA)
+
+# ============================================================================
+# EJECUCIÓN Y REPORTE
+# ============================================================================
+
+def distribucion(valores: List[float]) -> Dict:
+    if not valores:
+        return {}
+    valores = sorted(valores)
+    return {
+        "n": len(valores),
+        "media": round(sum(valores) / len(valores), 3),
+        "p50": round(percentil(valores, 50), 3),
+        "p90": round(percentil(valores, 90), 3),
+        "p99": round(percentil(valores, 99), 3),
+        "max": round(valores[-1], 3),
+    }
+
+def ejecutar_prueba(llegadas: List[tuple], segundos_por_etiqueta: float, modo: str,
+                    transporte: str = "falso", tiempo_maximo: float = TIEMPO_MAXIMO_ESPERA) -> Dict:
+    """
+    Corre el servicio contra el reemplazo de Supabase y las impresoras falsas
+    (o el emulador ZPL por socket RAW si `transporte` es "emulador").
+    Returns: Reporte con throughput, espera en cola y latencia de punta a punta (segundos)
+    """
+    base_datos = BaseDatosFalsa()
+    servidor = iniciar_supabase_falso(base_datos)
+
+    servicio.SUPABASE_URL = f"http://127.0.0.1:{servidor.server_address[1]}"
+    servicio.SUPABASE_KEY = "sb_publishable_prueba_de_carga"
+    servicio.SERVIDOR_METRICAS_ACTIVO = False
+    if transporte == "emulador":
+        velocidad = (LARGO_ETIQUETA_PUNTOS / DPI) / segundos_por_etiqueta if segundos_por_etiqueta > 0 else 0
+        emuladas = [ImpresoraEmulada(nombre, 0, velocidad).iniciar()
+                    for nombre in (servicio.NOMBRE_IMPRESORA_CHICAS, servicio.NOMBRE_IMPRESORA_GRANDES)]
+        servicio.IMPRESORAS_RAW = {impresora.nombre: ("127.0.0.1", impresora.puerto) for impresora in emuladas}
+        servicio.enviar_a_impresora = ENVIAR_A_IMPRESORA_REAL
+    else:
+        emuladas = []
+        impresoras = ImpresorasFalsas(segundos_por_etiqueta)
+        servicio.enviar_a_impresora = impresoras.enviar
+    asegurar_plantillas(llegadas)
+
+    # Momento en que cada trabajo empezó a imprimirse (primera parte que llega a una impresora)
+    inicio_impresion: Dict[str, float] = {}
+    imprimir_original = servicio.imprimir_etiqueta
+
+    def imprimir_etiqueta_medida(*args, **kwargs):
+        impresion_id = kwargs.get("impresion_id") if "impresion_id" in kwargs else (args[6] if len(args) > 6 else None)
+        inicio_impresion.setdefault(impresion_id, time.monotonic())
+        return imprimir_original(*args, **kwargs)
+
+    servicio.imprimir_etiqueta = imprimir_etiqueta_medida
+
+    if modo == "sincrono":
+        objetivo = servicio.main_sincrono
+    else:
+        objetivo = lambda: asyncio.run(servicio.NucleoServicio().ejecutar())
+    threading.Thread(target=objetivo, name="servicio", daemon=True).start()
+
+    llegada_por_id: Dict[str, float] = {}
+    etiquetas_esperadas = 0
+    inicio = time.monotonic()
+    print(f"Enviando {len(llegadas)} trabajo(s) a lo largo de {llegadas[-1][0]:.0f} s...")
+    for momento, datos in llegadas:
+        espera = inicio + momento - time.monotonic()
+        if espera > 0:
+            time.sleep(espera)
+        impresion_id = str(uuid.uuid4())
+        llegada_por_id[impresion_id] = time.monotonic()
+        etiquetas_esperadas += datos["cantidad_chicas"] + datos["cantidad_grandes"]
+        base_datos.insertar_impresion(dict(
+            datos, id=impresion_id, estado='pendiente', timestamp=int(time.time() * 1000)
+        ))
+
+    limite = time.monotonic() + tiempo_maximo
+    while len(base_datos.terminadas) < len(llegada_por_id) and time.monotonic() < limite:
+        time.sleep(0.5)
+    fin = max((momento for _, momento in base_datos.terminadas.values()), default=time.monotonic())
+    duracion = max(fin - inicio, 1e-9)
+    if emuladas:
+        # El servicio termina al entregar los datos; el emulador puede seguir imprimiendo
+        for impresora in emuladas:
+            impresora.esperar_vacia(max(0.0, limite - time.monotonic()))
+        impresoras = ImpresorasFalsas(segundos_por_etiqueta)
+        for impresora in emuladas:
+            impresoras.etiquetas[impresora.nombre] = impresora.estadisticas["etiquetas_impresas"]
+            impresoras.ocupada[impresora.nombre] = impresora.estadisticas["etiquetas_impresas"] * segundos_por_etiqueta
+            impresora.detener()
+
+    esperas = [inicio_impresion[i] - llegada for i, llegada in llegada_por_id.items() if i in inicio_impresion]
+    latencias = [base_datos.terminadas[i][1] - llegada for i, llegada in llegada_por_id.items()
+                 if i in base_datos.terminadas]
+    etiquetas = sum(impresoras.etiquetas.values())
+    return {
+        "modo": modo,
+        "transporte": transporte,
+        "trabajos": len(llegada_por_id),
+        "impresas": sum(1 for estado, _ in base_datos.terminadas.values() if estado == 'impresa'),
+        "con_error": sum(1 for estado, _ in base_datos.terminadas.values() if estado == 'error'),
+        "sin_terminar": len(llegada_por_id) - len(base_datos.terminadas),
+        "etiquetas_esperadas": etiquetas_esperadas,
+        "etiquetas_impresas": etiquetas,
+        "duracion_s": round(duracion, 1),
+        "etiquetas_por_segundo": round(etiquetas / duracion, 2),
+        "trabajos_por_minuto": round(len(base_datos.terminadas) / duracion * 60, 2),
+        "consultas_supabase": base_datos.consultas,
+        "uso_impresoras": {nombre: round(ocupada / duracion, 3) for nombre, ocupada in impresoras.ocupada.items()},
+        "espera_en_cola_s": distribucion(esperas),
+        "latencia_total_s": distribucion(latencias),
+    }
+
+def mostrar_reporte(reporte: Dict):
+    print("=" * 70)
+    print(f"Modo: {reporte['modo']} | Transporte: {reporte['transporte']} | Duración: {reporte['duracion_s']} s")
+    print(f"Trabajos: {reporte['trabajos']} (impresas {reporte['impresas']}, error {reporte['con_error']}, "
+          f"sin terminar {reporte['sin_terminar']})")
+    print(f"Etiquetas: {reporte['etiquetas_impresas']}/{reporte['etiquetas_esperadas']} "
+          f"({reporte['etiquetas_por_segundo']} por segundo, {reporte['trabajos_por_minuto']} trabajos por minuto)")
+    print(f"Consultas a Supabase: {reporte['consultas_supabase']}")
+    for nombre, uso in reporte["uso_impresoras"].items():
+        print(f"Uso de {nombre}: {uso:.0%}")
+    for titulo, clave in (("Espera en cola", "espera_en_cola_s"), ("Latencia de punta a punta", "latencia_total_s")):
+        d = reporte[clave]
+        if d:
+            print(f"{titulo} (s): p50 {d['p50']} | p90 {d['p90']} | p99 {d['p99']} | máx {d['max']}")
+    print("=" * 70)
+
+# ============================================================================
+# LÍNEA DE COMANDOS
+# ============================================================================
+
+def main():
+    parser = argparse.ArgumentParser(description="Prueba de carga del servicio de impresión")
+    parser.add_argument("--patron", choices=["turno", "poisson", "constante"], default="turno")
+    parser.add_argument("--replay", default=None, help="Repetir las llegadas reales de este etiquetas_log.json")
+    parser.add_argument("--acelerar", type=float, default=1.0, help="Factor de aceleración del replay")
+    parser.add_argument("--desde", type=datetime.fromisoformat, default=None, help="Replay desde esta fecha")
+    parser.add_argument("--hasta", type=datetime.fromisoformat, default=None, help="Replay hasta esta fecha")
+    parser.add_argument("--maquinas", type=int, default=MAQUINAS)
+    parser.add_argument("--rondas", type=int, default=1, help="Inicios de turno (patrón turno)")
+    parser.add_argument("--duracion", type=float, default=300, help="Segundos de llegadas (o entre rondas)")
+    parser.add_argument("--trabajos-por-minuto", type=float, default=10)
+    parser.add_argument("--chicas", type=int, default=CANTIDAD_CHICAS)
+    parser.add_argument("--grandes", type=int, default=CANTIDAD_GRANDES)
+    parser.add_argument("--segundos-por-etiqueta", type=float, default=SEGUNDOS_POR_ETIQUETA)
+    parser.add_argument("--modo", choices=["asincrono", "sincrono"], default="asincrono")
+    parser.add_argument("--transporte", choices=["falso", "emulador"], default="falso",
+                        help="Impresoras falsas en proceso o el emulador ZPL por socket RAW")
+    parser.add_argument("--semilla", type=int, default=1)
+    parser.add_argument("--salida", default=None, help="Guardar el reporte en este JSON")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory(prefix="prueba_carga_") as directorio:
+        colores = preparar_entorno(directorio)
+        if args.replay:
+            llegadas = llegadas_desde_log(args.replay, args.acelerar, args.desde, args.hasta)
+        else:
+            llegadas = llegadas_sinteticas(args.patron, colores, args.maquinas, args.duracion,
+                                           args.trabajos_por_minuto, args.chicas, args.grandes,
+                                           args.rondas, args.semilla)
+        if not llegadas:
+            print("No hay llegadas para enviar")
+            sys.exit(1)
+
+        reporte = ejecutar_prueba(llegadas, args.segundos_por_etiqueta, args.modo, args.transporte)
+    mostrar_reporte(reporte)
+    if args.salida:
+        servicio.guardar_json_atomico(os.path.abspath(args.salida), reporte)
+        print(f"Reporte guardado en {args.salida}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,331 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Reconciliación entre el log local de etiquetas y el estado de `impresiones` - GST3D
+Compara lo que este host realmente imprimió (etiquetas_log.json) con el `estado`
+guardado en Supabase y corrige o reporta las diferencias en lote.
+
+Ambos lados se leen como streams y se ordenan por id con un ordenamiento externo
+(tramos ordenados en archivos temporales + merge), así la memoria queda acotada
+aunque haya meses de historia. Después se cruzan en una sola pasada (merge-join) y las
+correcciones se escriben en lotes a medida que aparecen.
+
+Las dos fuentes usan la misma ventana: desde --desde (o desde el corte del último
+archivado, lo que sea más nuevo) hasta MARGEN_MINUTOS atrás.
+
+Uso:
+    python3 reconciliar_impresiones.py                 # solo reporta
+    python3 reconciliar_impresiones.py --aplicar       # además corrige los estados
+    python3 reconciliar_impresiones.py --desde 2026-01-01
+"""
+
+import os
+import sys
+import json
+import heapq
+import argparse
+import tempfile
+from datetime import datetime, timedelta
+from itertools import groupby
+from typing import Optional, Dict, List, Iterator, Iterable
+
+from imprimir_etiquetas_servicio import (
+    ARCHIVO_LOG_LOCAL,
+    conectar_supabase,
+    log_info,
+    log_error,
+    log_success,
+    log_warning,
+)
+from archivar_impresiones import leer_corte_archivado
+
+# ============================================================================
+# CONFIGURACIÓN
+# ============================================================================
+
+TAMANO_TRAMO = 100000  # Elementos ordenados en memoria antes de volcar a un archivo temporal
+TAMANO_PAGINA = 1000  # Filas por consulta a Supabase
+TAMANO_LOTE_CORRECCION = 200  # Ids por UPDATE al corregir
+MARGEN_MINUTOS = 10  # No tocar impresiones más nuevas que esto (pueden estar imprimiéndose)
+MUESTRAS_POR_CATEGORIA = 10
+
+# ============================================================================
+# ORDENAMIENTO EXTERNO
+# ============================================================================
+
+def _leer_tramo(ruta: str) -> Iterator[list]:
+    with open(ruta, "r", encoding='utf-8') as f:
+        for linea in f:
+            yield json.loads(linea)
+
+def ordenar_externo(elementos: Iterable[list], directorio: str, tamano_tramo: int = TAMANO_TRAMO) -> Iterator[list]:
+    """
+    Ordena una secuencia de listas JSON (por su primer elemento) sin cargarla entera.
+    Vuelca tramos ordenados a `directorio` y los combina con heapq.merge.
+    """
+    rutas = []
+    tramo = []
+    for elemento in elementos:
+        tramo.append(elemento)
+        if len(tramo) >= tamano_tramo:
+            tramo.sort()
+            ruta = os.path.join(directorio, f"tramo_{len(rutas)}.jsonl")
+            with open(ruta, "w", encoding='utf-8') as f:
+                for item in tramo:
+                    f.write(json.dumps(item, ensure_ascii=False))
+                    f.write("\n")
+            rutas.append(ruta)
+            tramo = []
+    tramo.sort()
+    return heapq.merge(*[_leer_tramo(ruta) for ruta in rutas], iter(tramo))
+
+# ============================================================================
+# FUENTES
+# ============================================================================
+
+def fecha_etiqueta_ms(registro: Dict) -> Optional[int]:
+    """Returns: Momento de impresión de una etiqueta del log (ms), o None si no tiene fecha válida."""
+    try:
+        return int(datetime.strptime(registro.get("fecha"), "%d/%m/%Y %H:%M:%S").timestamp() * 1000)
+    except (ValueError, TypeError):
+        return None
+
+def leer_log_local(ruta: str, estadisticas: Dict, desde_ms: Optional[int] = None) -> Iterator[list]:
+    """
+    Emite [impresion_id, es_grande, momento_ms] por cada etiqueta del log que tenga impresion_id
+    (momento_ms es 0 si la etiqueta no tiene fecha válida; así los elementos siguen siendo ordenables).
+    Con `desde_ms` se omiten las impresas antes: una etiqueta se imprime después de crear su
+    impresión, así que no puede pertenecer a una impresión de la ventana pedida a Supabase.
+    """
+    with open(ruta, "r", encoding='utf-8') as f:
+        for linea in f:
+            if not linea.strip():
+                continue
+            try:
+                registro = json.loads(linea)
+            except ValueError:
+                estadisticas["lineas_invalidas"] += 1
+                continue
+            if not isinstance(registro, dict):
+                estadisticas["lineas_invalidas"] += 1
+                continue
+            impresion_id = registro.get("impresion_id")
+            if not impresion_id:
+                estadisticas["sin_impresion_id"] += 1
+                continue
+            momento = fecha_etiqueta_ms(registro)
+            if desde_ms is not None:
+                if momento is None:
+                    estadisticas["sin_fecha"] += 1
+                    continue
+                if momento < desde_ms:
+                    continue
+            yield [impresion_id, 1 if registro.get("tipo_etiqueta") == "grande" else 0, momento or 0]
+
+def agrupar_log(etiquetas_ordenadas: Iterator[list]) -> Iterator[list]:
+    """
+    Agrupa etiquetas ordenadas por impresion_id: [impresion_id, chicas, grandes, primera_ms]
+    (primera_ms: la etiqueta más vieja con fecha, o None si ninguna la tiene).
+    """
+    for impresion_id, grupo in groupby(etiquetas_ordenadas, key=lambda e: e[0]):
+        chicas = grandes = 0
+        primera = None
+        for _, es_grande, momento in grupo:
+            if es_grande:
+                grandes += 1
+            else:
+                chicas += 1
+            if momento and (primera is None or momento < primera):
+                primera = momento
+        yield [impresion_id, chicas, grandes, primera]
+
+def exportar_impresiones(cliente, desde_ms: Optional[int], hasta_ms: int) -> Iterator[list]:
+    """
+    Exporta `impresiones` paginando por keyset sobre (timestamp, id).
+    Emite [id, estado, chicas_esperadas, grandes_esperadas].
+    """
+    cursor = None
+    while True:
+        consulta = cliente.table('impresiones')\
+            .select('id,estado,timestamp,etiqueta_chica,etiqueta_grande,cantidad_chicas,cantidad_grandes')\
+            .lt('timestamp', hasta_ms)
+        if desde_ms is not None:
+            consulta = consulta.gte('timestamp', desde_ms)
+        if cursor is not None:
+            timestamp, impresion_id = cursor
+            consulta = consulta.or_(
+                f'timestamp.gt.{timestamp},and(timestamp.eq.{timestamp},id.gt."{impresion_id}")'
+            )
+        filas = consulta.order('timestamp', desc=False).order('id', desc=False)\
+            .limit(TAMANO_PAGINA).execute().data or []
+
+        for fila in filas:
+            chicas = (fila.get('cantidad_chicas') or 0) if fila.get('etiqueta_chica') else 0
+            grandes = (fila.get('cantidad_grandes') or 0) if fila.get('etiqueta_grande') else 0
+            yield [fila['id'], fila.get('estado') or 'impresa', chicas, grandes]
+
+        if len(filas) < TAMANO_PAGINA:
+            break
+        cursor = (filas[-1]['timestamp'], filas[-1]['id'])
+
+# ============================================================================
+# MERGE-JOIN Y CORRECCIÓN
+# ============================================================================
+
+def cruzar(log_agrupado: Iterator[list], remoto: Iterator[list]) -> Iterator[tuple]:
+    """Merge-join de dos streams ordenados por id. Emite (id, local | None, remoto | None)."""
+    local = next(log_agrupado, None)
+    fila = next(remoto, None)
+    while local is not None or fila is not None:
+        if fila is None or (local is not None and local[0] < fila[0]):
+            yield local[0], local, None
+            local = next(log_agrupado, None)
+        elif local is None or fila[0] < local[0]:
+            yield fila[0], None, fila
+            fila = next(remoto, None)
+        else:
+            yield local[0], local, fila
+            local = next(log_agrupado, None)
+            fila = next(remoto, None)
+
+def clasificar(local: Optional[list], remoto: Optional[list]) -> tuple:
+    """
+    Decide qué hacer con una impresión.
+    Returns: (categoria, estado_corregido | None)
+    """
+    if remoto is None:
+        return "solo_en_log", None
+    _, estado, chicas_esperadas, grandes_esperadas = remoto
+    if local is None:
+        return ("impresa_sin_registro_local", None) if estado == 'impresa' else ("coincide", None)
+
+    _, chicas, grandes, _ = local
+    completa = chicas >= chicas_esperadas and grandes >= grandes_esperadas
+    if completa:
+        return ("coincide", None) if estado == 'impresa' else ("impresa_no_marcada", 'impresa')
+    if estado == 'impresa':
+        return "marcada_impresa_pero_incompleta", None
+    if estado == 'pendiente':
+        return "incompleta_no_marcada", 'error'
+    return "coincide", None
+
+class CorrectorEstados:
+    """
+    Junta los ids a corregir por estado y, si `aplicar`, los escribe apenas se completa un lote de
+    TAMANO_LOTE_CORRECCION, así la memoria queda acotada a un lote por estado.
+    """
+
+    def __init__(self, cliente, aplicar: bool):
+        self.cliente = cliente
+        self.aplicar = aplicar
+        self.lotes: Dict[str, List[str]] = {}
+        self.totales: Dict[str, int] = {}
+
+    def agregar(self, estado: str, impresion_id: str):
+        self.totales[estado] = self.totales.get(estado, 0) + 1
+        if not self.aplicar:
+            return
+        lote = self.lotes.setdefault(estado, [])
+        lote.append(impresion_id)
+        if len(lote) >= TAMANO_LOTE_CORRECCION:
+            self._escribir(estado)
+
+    def _escribir(self, estado: str):
+        lote = self.lotes.pop(estado, [])
+        if lote:
+            self.cliente.table('impresiones').update({'estado': estado}).in_('id', lote).execute()
+
+    def terminar(self):
+        """Escribe los lotes incompletos y reporta el total por estado."""
+        for estado in list(self.lotes):
+            self._escribir(estado)
+        if self.aplicar:
+            for estado, cantidad in self.totales.items():
+                log_success(f"{cantidad} impresión(es) corregidas a '{estado}'")
+        elif self.totales:
+            log_info(f"{sum(self.totales.values())} impresión(es) a corregir. Ejecutar con --aplicar para escribirlas")
+
+def reconciliar(ruta_log: str = ARCHIVO_LOG_LOCAL, desde: Optional[datetime] = None,
+                aplicar: bool = False) -> Dict[str, int]:
+    """
+    Reconcilia el log local con Supabase.
+    Returns: Conteo por categoría
+    """
+    if not os.path.exists(ruta_log):
+        log_error(f"No existe el log local: {ruta_log}")
+        return {}
+    cliente = conectar_supabase()
+    if cliente is None:
+        log_error("No se pudo conectar a Supabase")
+        return {}
+
+    desde_ms = int(desde.timestamp() * 1000) if desde else None
+    hasta_ms = int((datetime.now() - timedelta(minutes=MARGEN_MINUTOS)).timestamp() * 1000)
+    corte_archivado = leer_corte_archivado()
+    if corte_archivado is not None and (desde_ms is None or desde_ms < corte_archivado):
+        # Lo anterior ya no está en `impresiones`: en el log aparecería como solo_en_log
+        log_info(f"Las impresiones anteriores a {datetime.fromtimestamp(corte_archivado / 1000):%Y-%m-%d %H:%M} ya se archivaron; se reconcilia desde ahí")
+        desde_ms = corte_archivado
+    estadisticas = {"lineas_invalidas": 0, "sin_impresion_id": 0, "sin_fecha": 0}
+    conteo: Dict[str, int] = {}
+    muestras: Dict[str, List[str]] = {}
+    corrector = CorrectorEstados(cliente, aplicar)
+
+    with tempfile.TemporaryDirectory(prefix="reconciliar_") as directorio:
+        directorio_log = os.path.join(directorio, "log")
+        directorio_remoto = os.path.join(directorio, "remoto")
+        os.makedirs(directorio_log)
+        os.makedirs(directorio_remoto)
+
+        log_info("Ordenando log local...")
+        log_agrupado = agrupar_log(ordenar_externo(leer_log_local(ruta_log, estadisticas, desde_ms), directorio_log))
+        log_info("Exportando impresiones de Supabase...")
+        remoto = ordenar_externo(exportar_impresiones(cliente, desde_ms, hasta_ms), directorio_remoto)
+
+        for impresion_id, local, fila in cruzar(log_agrupado, remoto):
+            if fila is None and local[3] is not None and local[3] >= hasta_ms:
+                continue  # Impresa dentro del margen: su impresión es más nueva que la ventana de Supabase
+            categoria, estado_corregido = clasificar(local, fila)
+            conteo[categoria] = conteo.get(categoria, 0) + 1
+            if categoria != "coincide" and len(muestras.setdefault(categoria, [])) < MUESTRAS_POR_CATEGORIA:
+                muestras[categoria].append(impresion_id)
+            if estado_corregido:
+                corrector.agregar(estado_corregido, impresion_id)
+
+    log_info("=" * 70)
+    log_info("Resultado de la reconciliación")
+    for categoria, cantidad in sorted(conteo.items()):
+        log_info(f"  {categoria}: {cantidad}")
+        for impresion_id in muestras.get(categoria, []):
+            log_info(f"      {impresion_id}")
+    if estadisticas["sin_impresion_id"]:
+        log_warning(f"{estadisticas['sin_impresion_id']} etiqueta(s) del log no tienen impresion_id (registros anteriores) y no se cruzaron")
+    if estadisticas["lineas_invalidas"]:
+        log_warning(f"{estadisticas['lineas_invalidas']} línea(s) inválidas en el log")
+    if estadisticas["sin_fecha"]:
+        log_warning(f"{estadisticas['sin_fecha']} etiqueta(s) del log sin fecha válida no se cruzaron (se usó --desde o hay archivado)")
+    log_info("=" * 70)
+
+    corrector.terminar()
+    return conteo
+
+# ============================================================================
+# LÍNEA DE COMANDOS
+# ============================================================================
+
+def main():
+    parser = argparse.ArgumentParser(description="Reconcilia etiquetas_log.json con el estado de impresiones en Supabase")
+    parser.add_argument("--log", default=ARCHIVO_LOG_LOCAL, help=f"Log local (por defecto {ARCHIVO_LOG_LOCAL})")
+    parser.add_argument("--desde", type=datetime.fromisoformat, default=None,
+                        help="Considerar solo impresiones desde esta fecha (AAAA-MM-DD)")
+    parser.add_argument("--aplicar", action="store_true", help="Escribir en Supabase los estados corregidos")
+    args = parser.parse_args()
+
+    try:
+        reconciliar(args.log, args.desde, args.aplicar)
+    except KeyboardInterrupt:
+        log_info("Interrumpido")
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,200 @@
+-- ============================================================================
+-- OBJETOS DE BASE DE DATOS PARA EL SERVICIO DE IMPRESIÓN
+-- ============================================================================
+-- Índices y funciones que usa imprimir_etiquetas_servicio.py
+-- Este script es seguro de ejecutar múltiples veces
+-- ============================================================================
+-- IMPORTANTE: Ejecutar este script en el SQL Editor de Supabase
+-- ============================================================================
+
+-- ============================================================================
+-- 1. ÍNDICE PARA LA COLA DE PENDIENTES (paginación por keyset)
+-- ============================================================================
+-- El servicio recorre los pendientes ordenados por (timestamp, id)
+CREATE INDEX IF NOT EXISTS idx_impresiones_pendientes_keyset
+ON impresiones(timestamp, id) WHERE estado = 'pendiente';
+
+-- ============================================================================
+-- 2. DELTAS DE STOCK EN LOTE
+-- ============================================================================
+-- El servicio acumula variaciones por (tipo, color) y las aplica todas juntas,
+-- bloqueando la fila stock_global una sola vez por lote.
+-- Formato de p_deltas: {"PLA": {"BLACK": 3, "RED": -1}, "PETG": {...}}
+
+-- Lotes ya aplicados (permite reenviar un lote sin aplicarlo dos veces)
+CREATE TABLE IF NOT EXISTS lotes_stock_aplicados (
+  lote_id TEXT PRIMARY KEY,
+  aplicado_at TIMESTAMPTZ DEFAULT NOW()
+);
+
+ALTER TABLE lotes_stock_aplicados ENABLE ROW LEVEL SECURITY;
+
+DO $$
+BEGIN
+  IF NOT EXISTS (SELECT 1 FROM pg_policies WHERE tablename = 'lotes_stock_aplicados' AND policyname = 'Allow all operations on lotes_stock_aplicados') THEN
+    CREATE POLICY "Allow all operations on lotes_stock_aplicados" ON lotes_stock_aplicados FOR ALL USING (true) WITH CHECK (true);
+  END IF;
+END $$;
+
+CREATE OR REPLACE FUNCTION aplicar_deltas_stock(
+  p_lote_id TEXT,
+  p_deltas JSONB
+) RETURNS BOOLEAN AS $$
+DECLARE
+  v_stock_actual JSONB;
+  v_stock_tipo JSONB;
+  v_tipo TEXT;
+  v_colores JSONB;
+  v_color TEXT;
+  v_delta TEXT;
+  v_valor_actual INTEGER;
+BEGIN
+  -- Registrar el lote; si ya estaba, no se vuelve a aplicar
+  INSERT INTO lotes_stock_aplicados (lote_id) VALUES (p_lote_id)
+  ON CONFLICT (lote_id) DO NOTHING;
+  IF NOT FOUND THEN
+    RETURN FALSE;
+  END IF;
+  
+  -- Obtener el stock actual de manera atómica (un solo bloqueo para todo el lote)
+  SELECT stock_data INTO v_stock_actual
+  FROM stock
+  WHERE id = 'stock_global'
+  FOR UPDATE;
+  
+  IF v_stock_actual IS NULL THEN
+    v_stock_actual := '{}'::JSONB;
+  END IF;
+  
+  FOR v_tipo, v_colores IN SELECT * FROM jsonb_each(p_deltas) LOOP
+    v_stock_tipo := COALESCE(v_stock_actual->v_tipo, '{}'::JSONB);
+    
+    FOR v_color, v_delta IN SELECT * FROM jsonb_each_text(v_colores) LOOP
+      v_valor_actual := COALESCE((v_stock_tipo->>v_color)::INTEGER, 0);
+      -- No permitir valores negativos (igual que restar_stock_atomico)
+      v_stock_tipo := jsonb_set(
+        v_stock_tipo,
+        ARRAY[v_color],
+        to_jsonb(GREATEST(0, v_valor_actual + v_delta::INTEGER))
+      );
+    END LOOP;
+    
+    v_stock_actual := jsonb_set(v_stock_actual, ARRAY[v_tipo], v_stock_tipo);
+  END LOOP;
+  
+  INSERT INTO stock (id, stock_data, updated_at)
+  VALUES ('stock_global', v_stock_actual, NOW())
+  ON CONFLICT (id) 
+  DO UPDATE SET 
+    stock_data = EXCLUDED.stock_data,
+    updated_at = NOW();
+  
+  -- Los ids de lotes solo hacen falta mientras un host pueda reenviarlos
+  DELETE FROM lotes_stock_aplicados WHERE aplicado_at < NOW() - INTERVAL '7 days';
+  
+  RETURN TRUE;
+EXCEPTION
+  WHEN OTHERS THEN
+    RAISE EXCEPTION 'Error al aplicar deltas de stock: %', SQLERRM;
+    RETURN FALSE;
+END;
+$$ LANGUAGE plpgsql;
+
+COMMENT ON FUNCTION aplicar_deltas_stock IS 'Aplica un lote de deltas de stock en una sola transacción; idempotente por p_lote_id';
+GRANT EXECUTE ON FUNCTION aplicar_deltas_stock TO authenticated, anon;
+
+-- ============================================================================
+-- 3. INCREMENTO ATÓMICO DEL CONTADOR DE ETIQUETAS
+-- ============================================================================
+-- El servicio suma lo realmente impreso cada pocos segundos en una sola llamada.
+-- Usa su propia fila ('contador_impreso') para no duplicar lo que suma la web.
+CREATE OR REPLACE FUNCTION incrementar_contador_etiquetas(
+  p_id TEXT,
+  p_chicas INTEGER,
+  p_grandes INTEGER
+) RETURNS BOOLEAN AS $$
+BEGIN
+  INSERT INTO contador_etiquetas (id, chicas, grandes, updated_at)
+  VALUES (p_id, p_chicas, p_grandes, NOW())
+  ON CONFLICT (id)
+  DO UPDATE SET
+    chicas = contador_etiquetas.chicas + EXCLUDED.chicas,
+    grandes = contador_etiquetas.grandes + EXCLUDED.grandes,
+    updated_at = NOW();
+  
+  RETURN TRUE;
+EXCEPTION
+  WHEN OTHERS THEN
+    RAISE EXCEPTION 'Error al incrementar contador de etiquetas: %', SQLERRM;
+    RETURN FALSE;
+END;
+$$ LANGUAGE plpgsql;
+
+COMMENT ON FUNCTION incrementar_contador_etiquetas IS 'Suma etiquetas chicas y grandes al contador en un único UPDATE atómico';
+GRANT EXECUTE ON FUNCTION incrementar_contador_etiquetas TO authenticated, anon;
+
+-- ============================================================================
+-- 4. REGISTRO DE CADA ETIQUETA IMPRESA
+-- ============================================================================
+-- Copia en la nube de etiquetas_log.json de cada host de impresión.
+-- El servicio sube lotes con upsert ignorando duplicados, así un reintento no repite filas.
+CREATE TABLE IF NOT EXISTS etiquetas_impresas (
+  codigo_barra TEXT PRIMARY KEY,
+  id_numero TEXT,
+  id_maquina TEXT,
+  impresion_id TEXT,
+  maquina_id INTEGER,
+  operador TEXT,
+  tipo_material TEXT,
+  color TEXT,
+  tipo_etiqueta TEXT,
+  fecha TIMESTAMPTZ,
+  created_at TIMESTAMPTZ DEFAULT NOW()
+);
+
+CREATE INDEX IF NOT EXISTS idx_etiquetas_impresas_impresion ON etiquetas_impresas(impresion_id);
+CREATE INDEX IF NOT EXISTS idx_etiquetas_impresas_fecha ON etiquetas_impresas(fecha DESC);
+
+ALTER TABLE etiquetas_impresas ENABLE ROW LEVEL SECURITY;
+
+DO $$
+BEGIN
+  IF NOT EXISTS (SELECT 1 FROM pg_policies WHERE tablename = 'etiquetas_impresas' AND policyname = 'Allow all operations on etiquetas_impresas') THEN
+    CREATE POLICY "Allow all operations on etiquetas_impresas" ON etiquetas_impresas FOR ALL USING (true) WITH CHECK (true);
+  END IF;
+END $$;
+
+-- ============================================================================
+-- 5. HISTÓRICO DE IMPRESIONES
+-- ============================================================================
+-- Destino de archivar_impresiones.py para las impresiones terminadas viejas
+CREATE TABLE IF NOT EXISTS impresiones_historico (
+  id TEXT PRIMARY KEY,
+  maquina_id INTEGER NOT NULL,
+  tipo_material TEXT NOT NULL,
+  etiqueta_chica TEXT NOT NULL,
+  etiqueta_grande TEXT NOT NULL,
+  operador TEXT NOT NULL,
+  fecha TIMESTAMPTZ NOT NULL,
+  timestamp BIGINT NOT NULL,
+  cantidad_chicas INTEGER DEFAULT 8,
+  cantidad_grandes INTEGER DEFAULT 8,
+  estado TEXT,
+  created_at TIMESTAMPTZ,
+  archivada_at TIMESTAMPTZ DEFAULT NOW()
+);
+
+CREATE INDEX IF NOT EXISTS idx_impresiones_historico_timestamp ON impresiones_historico(timestamp DESC);
+
+ALTER TABLE impresiones_historico ENABLE ROW LEVEL SECURITY;
+
+DO $$
+BEGIN
+  IF NOT EXISTS (SELECT 1 FROM pg_policies WHERE tablename = 'impresiones_historico' AND policyname = 'Allow all operations on impresiones_historico') THEN
+    CREATE POLICY "Allow all operations on impresiones_historico" ON impresiones_historico FOR ALL USING (true) WITH CHECK (true);
+  END IF;
+END $$;
+
+-- Índice para que el archivado recorra las terminadas por (timestamp, id)
+CREATE INDEX IF NOT EXISTS idx_impresiones_terminadas_keyset
+ON impresiones(timestamp, id) WHERE estado IN ('impresa', 'error');